@@ -3,6 +3,9 @@ import sys
 import os
 import subprocess
 import argparse
+import hashlib
+import json
+import shutil
 
 version = "1.0.0"
 smesher_location = None
@@ -10,6 +13,7 @@ smesher_cloud_provider = None
 smesher_ssh_user = None
 smesher_ssh_host = None
 smesher_ssh_key = None
+smesher_ssh_targets = []
 node_location = None
 node_cloud_provider = None
 node_ssh_user = None
@@ -17,16 +21,21 @@ node_ssh_host = None
 node_ssh_key = None
 config_path = ""
 coinbase_address = ""
+data_dir = "data"
 valid_choices = ["1", "2", "3", "4"]
-valid_cloud_providers = ["runpod", "valt"]
+valid_cloud_providers = ["runpod", "local"]
 run_choice = None
+refresh = False
+repo_path = "/tmp/auto-spacemesh"
+bootstrap_state_path = os.path.expanduser("~/.cache/auto-spacemesh/bootstrap.json")
+required_tools = ["jq", "wget", "python3", "pip3", "git"]
 
 def display_version():
     print("auto-spacemesh version", version)
 
 def parse_options():
-    global config_path, coinbase_address
-    global smesher_location, smesher_cloud_provider, smesher_ssh_user, smesher_ssh_host, smesher_ssh_key
+    global config_path, coinbase_address, data_dir, run_choice, refresh
+    global smesher_location, smesher_cloud_provider, smesher_ssh_user, smesher_ssh_host, smesher_ssh_key, smesher_ssh_targets
     global node_location, node_cloud_provider, node_ssh_user, node_ssh_host, node_ssh_key
 
     parser = argparse.ArgumentParser()
@@ -34,14 +43,16 @@ def parse_options():
     parser.add_argument("-c", "--config", help="Configuration file")
     parser.add_argument("-C", "--coinbase", help="Set the Coinbase address")
     parser.add_argument("-l", "--smesher-local", help="Execute locally (default)", action="store_true")
-    parser.add_argument("-b", "--smesher-cloud", help="Execute in the cloud (runpod or valt)")
-    parser.add_argument("-s", "--smesher-ssh", help="Execute remotely via SSH", action="store_true")
+    parser.add_argument("-b", "--smesher-cloud", help="Execute in the cloud (runpod or local, comma-separated to race both)")
+    parser.add_argument("-s", "--smesher-ssh", help="Execute remotely via SSH on USER@HOST[:PORT] (repeat to use several hosts in parallel)", action="append")
     parser.add_argument("-k", "--smesher-ssh-key", help="Use a specific SSH key")
     parser.add_argument("-L", "--node-local", help="Execute locally (default)", action="store_true")
-    parser.add_argument("-B", "--node-cloud", help="Execute in the cloud (runpod or valt)")
+    parser.add_argument("-B", "--node-cloud", help="Execute in the cloud (runpod)")
     parser.add_argument("-S", "--node-ssh", help="Execute remotely via SSH", action="store_true")
     parser.add_argument("-K", "--node-ssh-key", help="Use a specific SSH key")
     parser.add_argument("-r", "--run", help="Run choice directly (1-4)")
+    parser.add_argument("-d", "--data-dir", help="Directory for data files", default="data")
+    parser.add_argument("--refresh", help="Reinstall packages, re-clone the repo and reinstall Python dependencies", action="store_true")
     args = parser.parse_args()
 
     if args.version:
@@ -52,6 +63,9 @@ def parse_options():
         config_path = args.config
         print("Config option selected with argument:", config_path)
 
+    data_dir = args.data_dir
+    refresh = args.refresh
+
     if args.coinbase:
         coinbase_address = args.coinbase
         print("Coinbase option selected with argument:", coinbase_address)
@@ -62,19 +76,21 @@ def parse_options():
         smesher_cloud_provider = ""
         smesher_ssh_user = ""
         smesher_ssh_host = ""
+        smesher_ssh_targets = []
         smesher_ssh_key = ""
 
     if args.smesher_ssh:
-        ssh_arg = args.smesher_ssh
-        if "@" not in ssh_arg:
-            print("Invalid argument for --ssh option")
-            sys.exit(1)
-        ssh_user, ssh_host = ssh_arg.split("@")
-        print("SSH option selected with argument:", ssh_arg)
-        smesher_location = "local"
+        for ssh_arg in args.smesher_ssh:
+            if "@" not in ssh_arg:
+                print("Invalid argument for --ssh option")
+                sys.exit(1)
+            print("SSH option selected with argument:", ssh_arg)
+        ssh_user, ssh_host = args.smesher_ssh[0].split("@", 1)
+        smesher_location = "ssh"
         smesher_cloud_provider = ""
         smesher_ssh_user = ssh_user
         smesher_ssh_host = ssh_host
+        smesher_ssh_targets = args.smesher_ssh
 
     if args.smesher_ssh_key:
         ssh_key = args.smesher_ssh_key
@@ -85,7 +101,7 @@ def parse_options():
         cloud_arg = args.smesher_cloud
         if "=" in cloud_arg:
             cloud_arg = cloud_arg.split("=")[1]
-        if cloud_arg not in valid_cloud_providers:
+        if any(name not in valid_cloud_providers for name in cloud_arg.split(",")):
             print("Invalid argument for --smesher-cloud option")
             sys.exit(1)
         cloud_provider = cloud_arg
@@ -104,7 +120,44 @@ def parse_options():
         smesher_location = "local"
         print("No smesher location specified. Defaulting to local.")
 
-def install_dependencies():
+# Bootstrap state: what a previous launch already provisioned, so warm starts skip the network entirely
+
+def load_bootstrap_state():
+    if refresh or not os.path.isfile(bootstrap_state_path):
+        return {}
+    try:
+        with open(bootstrap_state_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_bootstrap_state(state):
+    os.makedirs(os.path.dirname(bootstrap_state_path), exist_ok=True)
+    with open(bootstrap_state_path, "w") as f:
+        json.dump(state, f, indent=2)
+
+def tool_versions():
+    versions = {}
+    for tool in required_tools:
+        if not shutil.which(tool):
+            return None
+        result = subprocess.run([tool, "--version"], capture_output=True, text=True)
+        versions[tool] = (result.stdout or result.stderr).strip().split("\n")[0]
+    return versions
+
+def requirements_hash():
+    # pip installs per interpreter, so the interpreter is part of the hash
+    digest = hashlib.sha256(sys.version.encode("utf-8"))
+    with open("requirements.txt", "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+def install_dependencies(state):
+    if not refresh and all(shutil.which(tool) for tool in required_tools):
+        print("Dependencies already installed")
+        if not state.get("tools"):
+            state["tools"] = tool_versions()
+        return
     print("Installing dependencies")
     if sys.platform.startswith("linux"):
         print("Linux detected")
@@ -119,34 +172,70 @@ def install_dependencies():
     else:
         print("Unsupported OS")
         sys.exit(1)
+    state["tools"] = tool_versions()
 
-def clone_repo():
-    print("Cloning auto-spacemesh repo")
-    subprocess.run(["rm", "-rf", "/tmp/auto-spacemesh"])
-    subprocess.run(["git", "clone", "-q", "https://github.com/smeshcloud/auto-spacemesh.git", "/tmp/auto-spacemesh"])
-    os.chdir("/tmp/auto-spacemesh")
+def clone_repo(state):
+    if not refresh and os.path.isdir(f"{repo_path}/.git"):
+        print("Using existing auto-spacemesh repo in", repo_path)
+    else:
+        print("Cloning auto-spacemesh repo")
+        subprocess.run(["rm", "-rf", repo_path])
+        subprocess.run(["git", "clone", "-q", "https://github.com/smeshcloud/auto-spacemesh.git", repo_path])
+    os.chdir(repo_path)
+    result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+    state["repo_commit"] = result.stdout.strip()
 
-def install_python_dependencies():
+def install_python_dependencies(state):
+    current_hash = requirements_hash()
+    if state.get("requirements_hash") == current_hash:
+        print("Python dependencies already installed")
+        return
     print("Installing Python dependencies")
-    subprocess.run(["pip3", "install", "-qqq", "-r", "requirements.txt"])
+    if subprocess.run(["pip3", "install", "-qqq", "-r", "requirements.txt"]).returncode == 0:
+        state["requirements_hash"] = current_hash
+
+def smesher_args():
+    if smesher_location == "cloud":
+        return ["--cloud", smesher_cloud_provider]
+    if smesher_ssh_targets:
+        args = ["--ssh"]
+        for target in smesher_ssh_targets:
+            args += ["--ssh-host", target]
+        return args + (["--ssh-key", smesher_ssh_key] if smesher_ssh_key else [])
+    return ["--local"]
+
+def run_stages(data_dir, targets):
+    # stages that are already up to date are skipped, see stage_runner.py
+    from stage_runner import build_pipeline, run_pipeline
+    stages = build_pipeline(data_dir, smesher_args(), coinbase=coinbase_address)
+    os.makedirs(data_dir, exist_ok=True)
+    if not run_pipeline(stages, targets, f"{data_dir}/pipeline.json"):
+        print("Pipeline failed, run the same choice again to resume")
 
 def generate_config():
     print("Generating a new Spacemesh node/smesher config")
-    subprocess.run(["bash", "stage1.sh"])
+    run_stages(data_dir, ["stage1"])
 
 def generate_config_and_start_smesher():
     print("Generating a new Spacemesh node/smesher stage1 config and start smeshing")
-    subprocess.run(["bash", "stage1.sh"])
-    subprocess.run(["python3", "stage2.py"])
+    run_stages(data_dir, ["stage2"])
+
+def existing_data_dir(path):
+    # the data dir holding <data dir>/stage1/stage1.json, given the stage1 directory or its stage1.json
+    path = os.path.abspath(path)
+    if os.path.isfile(path):
+        path = os.path.dirname(path)
+    if not os.path.isfile(os.path.join(path, "stage1.json")):
+        return None
+    return os.path.dirname(path)
 
 def start_smesher_with_existing_config(path):
     print("Starting the smesher using stage1 config in", path)
-    subprocess.run(["python3", "stage2.py", path])
+    run_stages(existing_data_dir(path), ["stage2"])
 
 def start_smesher_with_existing_config_and_start_smesher(path):
     print("Starting the smesher using stage1 config in", path)
-    subprocess.run(["python3", "stage2.py", path])
-    subprocess.run(["python3", "stage3.py"])
+    run_stages(existing_data_dir(path), ["stage2", "stage3"])
 
 def main():
     global run_choice
@@ -154,9 +243,11 @@ def main():
     parse_options()
     print()
 
-    install_dependencies()
-    clone_repo()
-    install_python_dependencies()
+    state = load_bootstrap_state()
+    install_dependencies(state)
+    clone_repo(state)
+    install_python_dependencies(state)
+    save_bootstrap_state(state)
 
     while True:
         if not run_choice:
@@ -184,8 +275,10 @@ def main():
                 default_path = "C:\TEMP\stage1"
             path = input(f"Path to existing Spacemesh node/smesher stage1 config [{default_path}]: ") or default_path
             print()
-            if not os.path.isdir(path):
+            if not os.path.exists(path):
                 print("Directory does not exist")
+            elif not existing_data_dir(path):
+                print("No stage1.json found in", path)
             else:
                 start_smesher_with_existing_config(path)
         elif choice == "4":
@@ -194,8 +287,10 @@ def main():
                 default_path = "C:\TEMP\stage1"
             path = input(f"Path to existing Spacemesh node/smesher stage1 config [{default_path}]: ") or default_path
             print()
-            if not os.path.isdir(path):
+            if not os.path.exists(path):
                 print("Directory does not exist")
+            elif not existing_data_dir(path):
+                print("No stage1.json found in", path)
             else:
                 start_smesher_with_existing_config_and_start_smesher(path)
         elif choice == "5":
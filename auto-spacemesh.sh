@@ -20,7 +20,10 @@ exec_destination="local"
 config_path=""
 coinbase_address=""
 valid_choices=("1" "2" "3" "4")
-valid_cloud_providers=("runpod" "valt")
+valid_cloud_providers=("runpod" "local")
+refresh=""
+repo_path="/tmp/auto-spacemesh"
+bootstrap_dir="$HOME/.cache/auto-spacemesh"
 
 display_help() {
   echo "Usage: auto-spacemesh.sh [OPTIONS]"
@@ -32,8 +35,9 @@ display_help() {
   echo "  -l, --local           Execute locally (default)"
   echo "  -s, --ssh USER@HOST   Execute remotely via SSH"
   echo "  -k, --ssh-key KEY     Use a specific SSH key"
-  echo "  -b, --cloud PROVIDER  Execute in the cloud (runpod or valt)"
+  echo "  -b, --cloud PROVIDER  Execute in the cloud (runpod or local)"
   echo "  -r, --run CHOICE      Run choice directly (1-4)"
+  echo "      --refresh         Reinstall packages, re-clone the repo and reinstall Python dependencies"
 }
 
 display_version() {
@@ -167,6 +171,11 @@ parse_options() {
         esac
         shift 2
         ;;
+      --refresh)
+        echo "Refresh option selected"
+        refresh="1"
+        shift
+        ;;
       --)
         shift
         break
@@ -194,33 +203,52 @@ display_version
 parse_options "$@"
 echo ""
 
-# Install dependencies
-echo "Installing dependencies"
-if [[ "$OSTYPE" == "linux-gnu"* ]]; then
-  echo "Linux detected"
-  sudo apt-get update
-  sudo apt-get install -y -q jq wget python3 python3-pip git
-elif [[ "$OSTYPE" == "darwin"* ]]; then
-  echo "MacOS detected"
-  brew install -q jq wget python3 git
-elif [[ "$OSTYPE" == "win32" ]]; then
-  echo "Windows detected"
-  exit 1
+# Install dependencies (skipped when every tool is already present)
+mkdir -p "$bootstrap_dir"
+if [[ -z $refresh ]] && [[ $(command -v jq wget python3 pip3 git | wc -l) -eq 5 ]]; then
+  echo "Dependencies already installed"
 else
-  echo "Unsupported OS"
-  exit 1
+  echo "Installing dependencies"
+  if [[ "$OSTYPE" == "linux-gnu"* ]]; then
+    echo "Linux detected"
+    sudo apt-get update
+    sudo apt-get install -y -q jq wget python3 python3-pip git
+  elif [[ "$OSTYPE" == "darwin"* ]]; then
+    echo "MacOS detected"
+    brew install -q jq wget python3 git
+  elif [[ "$OSTYPE" == "win32" ]]; then
+    echo "Windows detected"
+    exit 1
+  else
+    echo "Unsupported OS"
+    exit 1
+  fi
+  for tool in jq wget python3 pip3 git; do
+    echo "$tool: $($tool --version 2>&1 | head -n 1)"
+  done > "$bootstrap_dir/tools"
 fi
 
-# Clone the auto-spacemesh repo
-echo "Cloning auto-spacemesh repo"
-rm -rf /tmp/auto-spacemesh
-git clone -q https://github.com/smeshcloud/auto-spacemesh.git /tmp/auto-spacemesh
-cd /tmp/auto-spacemesh
-
-# Install Python dependencies
-echo "Installing Python dependencies"
-pip3 install -qqq -r requirements.txt
+# Clone the auto-spacemesh repo (an existing checkout is reused)
+if [[ -z $refresh ]] && [[ -d "$repo_path/.git" ]]; then
+  echo "Using existing auto-spacemesh repo in $repo_path"
+else
+  echo "Cloning auto-spacemesh repo"
+  rm -rf "$repo_path"
+  git clone -q https://github.com/smeshcloud/auto-spacemesh.git "$repo_path"
+fi
+cd "$repo_path"
+git rev-parse HEAD > "$bootstrap_dir/repo_commit"
 
+# Install Python dependencies when requirements.txt or the interpreter changed
+sha256_cmd="sha256sum"
+command -v sha256sum > /dev/null || sha256_cmd="shasum -a 256"
+requirements_hash=$( (python3 --version; cat requirements.txt) | $sha256_cmd | awk '{print $1}')
+if [[ -z $refresh ]] && [[ "$(cat "$bootstrap_dir/requirements_hash" 2> /dev/null)" == "$requirements_hash" ]]; then
+  echo "Python dependencies already installed"
+else
+  echo "Installing Python dependencies"
+  pip3 install -qqq -r requirements.txt && echo "$requirements_hash" > "$bootstrap_dir/requirements_hash"
+fi
 
 # Present the user with choices and loop if run option is not specified
 while true; do
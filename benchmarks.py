@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+#
+# Offline benchmarks for the hot paths of the pipeline.
+#
+#   - public-nodes.py health checks against 10/100/1000 fake gRPC endpoints,
+#     10% of them slow (past the timeout) and 10% dead
+#   - stage1.py identity generation in batches against a fake public node
+#   - stage2 orchestration (pricing, capacity race, tracking): RunPodProvider
+#     over a fake runpod module whose capacity only appears after a number of
+#     requests races a provider that never has any; the race backs off in
+#     milliseconds and tracking runs on a virtual clock, so only the
+#     orchestration overhead costs real time
+#   - stage3 read/verify throughput on synthetic PoST files
+#
+# Results are written as JSON; when a baseline exists every metric is compared
+# against it and regressions beyond --tolerance make the run fail.
+#
+# Usage:
+#
+#   benchmarks.py [--quick] [--only NAME ...] [--baseline FILE] [--save]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+# grpc logs every connection torn down by a stopped fake server
+os.environ.setdefault("GRPC_VERBOSITY", "ERROR")
+
+import spacemesh_api
+from spacemesh_api import Activation, NodeStatus, encode_highest_response, encode_status_response, serve_fake_nodes
+
+# metric name -> True when higher is better
+directions = {
+  "nodes_per_second": True,
+  "wall_seconds": False,
+  "identities_per_second": True,
+  "orchestration_ms": False,
+  "api_calls": False,
+  "read_mib_per_second": True,
+  "verify_mib_per_second": True,
+}
+
+def free_ports(count):
+  # ports nobody listens on, for dead endpoints
+  sockets = [socket.socket() for _ in range(count)]
+  for sock in sockets:
+    sock.bind(("127.0.0.1", 0))
+  ports = [sock.getsockname()[1] for sock in sockets]
+  for sock in sockets:
+    sock.close()
+  return ports
+
+def fake_node(delay=0.0, top_layer=100000, synced_layer=100000, ports=1):
+  # one server can listen on many ports, so 1000 endpoints only need a handful of servers
+  def status(request, context):
+    time.sleep(delay)
+    return encode_status_response(NodeStatus(20, True, synced_layer, top_layer, synced_layer))
+
+  def highest(request, context):
+    time.sleep(delay)
+    return encode_highest_response(Activation("ab" * 32, top_layer, "cd" * 32, "sm1qqqqqqxre24mtprsmuht8gfhu28z95hm22zvrdq34rmr8", 4, 1))
+
+  return serve_fake_nodes({ "NodeService/Status": status, "ActivationService/Highest": highest }, ports, max_workers=64)
+
+def load_public_nodes():
+  spec = importlib.util.spec_from_file_location("public_nodes", os.path.join(os.path.dirname(os.path.abspath(__file__)), "public-nodes.py"))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+def bench_public_nodes(sizes, timeout=1.0):
+  public_nodes = load_public_nodes()
+  results = {}
+  for size in sizes:
+    slow = dead = size // 10
+    fast = size - slow - dead
+    fast_server, fast_endpoints = fake_node(ports=fast)
+    slow_server, slow_endpoints = fake_node(delay=timeout * 2, ports=slow) if slow else (None, [])
+    endpoints = fast_endpoints + slow_endpoints + [f"127.0.0.1:{port}" for port in free_ports(dead)]
+    started = time.monotonic()
+    node_status = public_nodes.probe_all_nodes(endpoints, False, timeout, timeout * 3, 64)
+    wall = time.monotonic() - started
+    online = sum(1 for status in node_status.values() if 'latency' in status)
+    results[f"public_nodes_{size}"] = { "wall_seconds": wall, "nodes_per_second": size / wall, "online": online, "expected_online": fast }
+    for server in [fast_server, slow_server]:
+      if server:
+        server.stop(0)
+    spacemesh_api.close_all_channels()
+  return results
+
+def bench_stage1(count):
+  import stage1
+  server, endpoints = fake_node()
+  work_dir = tempfile.mkdtemp(prefix="bench-stage1-")
+  try:
+    # a minimal mainnet template per identity, so config.json is written without downloading it
+    for index in range(count):
+      os.makedirs(f"{work_dir}/identity-{index}/stage1")
+      with open(f"{work_dir}/identity-{index}/stage1/config.mainnet.json", "w") as f:
+        json.dump({ "api": {}, "main": { "layer-duration": "5m", "layers-per-epoch": 4032 } }, f)
+    started = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+      for index in range(count):
+        stage1.run_stage1(f"{work_dir}/identity-{index}", endpoints, timeout=2.0)
+    wall = time.monotonic() - started
+  finally:
+    server.stop(0)
+    spacemesh_api.close_all_channels()
+    shutil.rmtree(work_dir)
+  return { f"stage1_batch_{count}": { "wall_seconds": wall, "identities_per_second": count / wall } }
+
+class VirtualClock:
+  def __init__(self):
+    self.now = 0.0
+
+  def time(self):
+    return self.now
+
+  def monotonic(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += seconds
+
+class FakeRunPod:
+  # capacity appears after capacity_after create_pod requests; pods write labels at labels_per_second
+  def __init__(self, clock, gpu_ids=(), capacity_after=50, labels_per_second=200_000, price=0.5):
+    self.clock = clock
+    self.gpu_ids = list(gpu_ids)
+    self.capacity_after = capacity_after
+    self.requests = 0
+    self.labels_per_second = labels_per_second
+    self.price = price
+    self.calls = 0
+    self.pods = {}
+
+  def get_gpus(self):
+    self.calls += 1
+    return [{ "id": gpu_id } for gpu_id in self.gpu_ids]
+
+  def get_gpu(self, gpu_id, quantity=1):
+    self.calls += 1
+    price = self.price * (1 + self.gpu_ids.index(gpu_id) / len(self.gpu_ids))
+    return { "id": gpu_id, "lowestPrice": { "minimumBidPrice": price * 0.6, "uninterruptablePrice": price } }
+
+  def create_pod(self, gpu_type_id=None, gpu_count=1, **kwargs):
+    self.calls += 1
+    self.requests += 1
+    if self.requests <= self.capacity_after:
+      raise RuntimeError("There are no longer any instances available with the requested specifications")
+    pod_id = f"pod{len(self.pods)}"
+    self.pods[pod_id] = { "id": pod_id, "started": self.clock.now, "desiredStatus": "RUNNING", "costPerHr": self.price * gpu_count, "machine": { "podHostId": pod_id } }
+    return self.pods[pod_id]
+
+  def get_pod(self, pod_id):
+    self.calls += 1
+    pod = self.pods.get(pod_id)
+    if pod:
+      pod["runtime"] = { "uptimeInSeconds": self.clock.now - pod["started"] }
+    return pod
+
+  def terminate_pod(self, pod_id):
+    self.calls += 1
+    self.pods[pod_id]["desiredStatus"] = "TERMINATED"
+
+class BusyProvider:
+  # a provider that lists capacity but never manages to provision it
+  name = "busy"
+
+  def __init__(self):
+    self.calls = 0
+
+  def options(self, quantity, total_bytes, max_cost_per_tib=None):
+    self.calls += 1
+    return [{ "provider": self.name, "id": "busy", "quantity": quantity, "market": "on-demand", "price": 0.1, "cost_per_tib": 0.1 }]
+
+  def provision(self, option):
+    self.calls += 1
+    raise RuntimeError("No capacity")
+
+def bench_stage2(total_labels=4 * 2 ** 32, capacity_after=50):
+  clock = VirtualClock()
+  fake = FakeRunPod(clock, capacity_after=capacity_after)
+  # gpu_selector, pod_tracker and providers import runpod when they are loaded
+  sys.modules["runpod"] = fake
+  import gpu_selector
+  import pod_tracker
+  import providers
+  gpu_selector.runpod = pod_tracker.runpod = providers.runpod = fake
+  fake.gpu_ids = list(gpu_selector.gpu_labels_per_second)
+  pod_tracker.time = clock
+
+  def read_log(pod):
+    return f"num_labels_written: {int(min(total_labels, (clock.now - pod['started']) * fake.labels_per_second))}"
+
+  total_bytes = total_labels * 16
+  started = time.monotonic()
+  cpu_started = time.process_time()
+  with contextlib.redirect_stdout(io.StringIO()):
+    busy = BusyProvider()
+    provider, option, pod = providers.race_for_capacity([providers.RunPodProvider({ "name": "bench" }), busy], 1, total_bytes, poll_interval=0.001, retry_interval=0.001)
+    race_ms = (time.monotonic() - started) * 1000
+    result = pod_tracker.track_pod(pod["id"], total_labels, read_log)
+  wall = time.monotonic() - started
+  return { "stage2_runpod": {
+    "orchestration_ms": wall * 1000,
+    "race_ms": race_ms,
+    "cpu_ms": (time.process_time() - cpu_started) * 1000,
+    "api_calls": fake.calls + busy.calls,
+    "create_requests": fake.requests,
+    "winner": provider.name,
+    "virtual_total_seconds": clock.now,
+    "cost": result["cost"],
+    "status": result["status"],
+  } }
+
+def bench_stage3(size_mib, sample_rate=0.01):
+  import stage3
+  from proving_bench import measure
+  post_dir = tempfile.mkdtemp(prefix="bench-stage3-")
+  try:
+    stage3.generate_synthetic_post(post_dir, 1, (size_mib << 20) // 16, 64 << 20)
+    paths = sorted(f"{post_dir}/{name}" for name, _ in stage3.expected_files(stage3.load_metadata(post_dir)))
+    read_rate = measure(paths, os.cpu_count(), 4 << 20, 0, 30, hash_data=False)
+    started = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+      result = stage3.verify_post(post_dir, sample_rate, os.cpu_count(), None)
+    wall = time.monotonic() - started
+  finally:
+    shutil.rmtree(post_dir)
+  return { f"stage3_{size_mib}mib": { "read_mib_per_second": read_rate / 2 ** 20, "verify_mib_per_second": size_mib / wall, "wall_seconds": wall, "ok": result["ok"] } }
+
+def compare(results, baseline, tolerance):
+  # [(benchmark, metric, baseline, current, change)] for metrics that got worse than the tolerance allows
+  regressions = []
+  for name, metrics in results.items():
+    for metric, value in metrics.items():
+      previous = baseline.get(name, {}).get(metric)
+      if metric not in directions or not isinstance(previous, (int, float)) or not previous:
+        continue
+      change = (value - previous) / previous
+      if (change < -tolerance) if directions[metric] else (change > tolerance):
+        regressions.append((name, metric, previous, value, change))
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description="Run the offline benchmark suite")
+  parser.add_argument("--quick", action="store_true", help="Smaller sizes (10/100 endpoints, 10 identities, 64 MiB)")
+  parser.add_argument("--only", help="Run only these benchmarks (public-nodes, stage1, stage2, stage3)", action="append")
+  parser.add_argument("--baseline", help="Baseline file to compare against", default="benchmark-baseline.json")
+  parser.add_argument("--output", help="Write this run's results here", default="benchmark-results.json")
+  parser.add_argument("--save", action="store_true", help="Store this run as the new baseline")
+  parser.add_argument("--tolerance", help="Allowed relative regression", default=0.2, type=float)
+  args = parser.parse_args()
+
+  selected = args.only or ["public-nodes", "stage1", "stage2", "stage3"]
+  results = {}
+  if "public-nodes" in selected:
+    results.update(bench_public_nodes([10, 100] if args.quick else [10, 100, 1000]))
+  if "stage1" in selected:
+    results.update(bench_stage1(10 if args.quick else 100))
+  if "stage2" in selected:
+    results.update(bench_stage2())
+  if "stage3" in selected:
+    results.update(bench_stage3(64 if args.quick else 512))
+
+  for name, metrics in results.items():
+    print(f"{name:24} " + "  ".join(f"{metric}={value:.3f}" if isinstance(value, float) else f"{metric}={value}" for metric, value in metrics.items()))
+
+  report = { "host": platform.node(), "python": platform.python_version(), "cpus": os.cpu_count(), "time": time.time(), "results": results }
+  with open(args.output, "w") as f:
+    json.dump(report, f, indent=2)
+
+  regressions = []
+  if os.path.isfile(args.baseline):
+    with open(args.baseline, "r") as f:
+      regressions = compare(results, json.load(f)["results"], args.tolerance)
+    for name, metric, previous, value, change in regressions:
+      print(f"Regression: {name} {metric} {previous:.3f} -> {value:.3f} ({change:+.0%})")
+    if not regressions:
+      print(f"No regressions against {args.baseline}")
+  if args.save:
+    shutil.copyfile(args.output, args.baseline)
+    print(f"Baseline saved to {args.baseline}")
+  if regressions and not args.save:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
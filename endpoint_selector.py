@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# Pick the fastest synced Spacemesh endpoint.
+#
+# Keeps an EWMA of the RPC latency of every endpoint plus its layer lag from
+# NodeService.Status, ejects endpoints that keep failing for a cooldown and
+# runs calls against the best endpoint, optionally hedged: when the best one
+# has not answered within the hedge delay the same call goes to the runner-up
+# and the first answer wins.
+#
+# Usage:
+#
+#   endpoint_selector.py [--node HOST:PORT ...] [--hedge]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import grpc
+
+from spacemesh_api import SpacemeshClient
+
+public_nodes = [
+  "public.smesh.cloud:9092",
+  "pub-node1.smesh.cloud:9092",
+  "pub-node2.smesh.cloud:9092",
+  "pub-node3.smesh.cloud:9092",
+  "pub-node4.smesh.cloud:9092",
+  "pub-node5.smesh.cloud:9092",
+  "pub-node6.smesh.cloud:9092",
+  "pub-node7.smesh.cloud:9092",
+  "pub-node8.smesh.cloud:9092"
+]
+
+# layers a node may trail the top layer and still count as synced
+max_sync_lag = 3
+
+def sync_status(top_layer, synced_layer, verified_layer):
+  if abs(top_layer - synced_layer) < max_sync_lag and abs(verified_layer - synced_layer) < max_sync_lag:
+    return 'SYNCED & VERIFIED'
+  if abs(top_layer - synced_layer) < max_sync_lag:
+    return 'SYNCED'
+  return 'NOT SYNCED'
+
+class EndpointSelector:
+  def __init__(self, endpoints, timeout=5.0, alpha=0.3, max_failures=2, cooldown=60, lag_penalty=0.5, unsynced_penalty=60, workers=16):
+    self.endpoints = list(endpoints)
+    self.timeout = timeout
+    self.alpha = alpha
+    self.max_failures = max_failures
+    self.cooldown = cooldown
+    # seconds added to the score per layer of lag, and once for a node that is not synced
+    self.lag_penalty = lag_penalty
+    self.unsynced_penalty = unsynced_penalty
+    self.lock = threading.Lock()
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    self.state = { endpoint: { "latency": None, "failures": 0, "ejected_until": 0, "lag": None, "status": None } for endpoint in self.endpoints }
+
+  def record_success(self, endpoint, latency, status=None):
+    with self.lock:
+      state = self.state[endpoint]
+      state["latency"] = latency if state["latency"] is None else self.alpha * latency + (1 - self.alpha) * state["latency"]
+      state["failures"] = 0
+      state["ejected_until"] = 0
+      if status is not None:
+        state["lag"] = status.top_layer - status.synced_layer
+        state["status"] = sync_status(status.top_layer, status.synced_layer, status.verified_layer)
+
+  def record_failure(self, endpoint):
+    with self.lock:
+      state = self.state[endpoint]
+      state["failures"] += 1
+      if state["failures"] >= self.max_failures:
+        state["ejected_until"] = time.monotonic() + self.cooldown
+
+  def score(self, endpoint):
+    # lower is better; endpoints without a measurement are assumed to answer in half the timeout
+    state = self.state[endpoint]
+    score = state["latency"] if state["latency"] is not None else self.timeout / 2
+    if state["lag"] is not None:
+      score += max(0, state["lag"]) * self.lag_penalty
+    if state["status"] == 'NOT SYNCED':
+      score += self.unsynced_penalty
+    return score
+
+  def ranked(self):
+    # healthy endpoints by score; when everything is ejected, the one returning soonest
+    now = time.monotonic()
+    with self.lock:
+      healthy = [endpoint for endpoint in self.endpoints if self.state[endpoint]["ejected_until"] <= now]
+      if not healthy:
+        return sorted(self.endpoints, key=lambda endpoint: self.state[endpoint]["ejected_until"])
+      return sorted(healthy, key=self.score)
+
+  def best(self):
+    return self.ranked()[0]
+
+  def attempt(self, endpoint, fn):
+    started = time.monotonic()
+    try:
+      result = fn(SpacemeshClient(endpoint, timeout=self.timeout))
+    except grpc.RpcError:
+      self.record_failure(endpoint)
+      raise
+    self.record_success(endpoint, time.monotonic() - started)
+    return result
+
+  def refresh(self):
+    # probe every endpoint's status once so ranking accounts for layer lag
+    def probe(endpoint):
+      started = time.monotonic()
+      try:
+        status = SpacemeshClient(endpoint, timeout=self.timeout).status()
+      except grpc.RpcError:
+        self.record_failure(endpoint)
+        return
+      self.record_success(endpoint, time.monotonic() - started, status)
+    wait([self.executor.submit(probe, endpoint) for endpoint in self.endpoints])
+
+  def call(self, fn, attempts=3):
+    # fn(client) against the best endpoint, falling back to the next ones on failure; returns (result, endpoint)
+    error = None
+    for endpoint in self.ranked()[:attempts]:
+      try:
+        return self.attempt(endpoint, fn), endpoint
+      except grpc.RpcError as e:
+        error = e
+    raise error
+
+  def hedge_delay(self, endpoint):
+    with self.lock:
+      latency = self.state[endpoint]["latency"]
+    return 2 * latency if latency is not None else self.timeout / 4
+
+  def hedged_call(self, fn, delay=None):
+    # fn(client) against the best endpoint, and against the runner-up as well when the best is slow or fails
+    ranked = self.ranked()[:2]
+    if len(ranked) < 2:
+      return self.call(fn)
+    delay = delay if delay is not None else self.hedge_delay(ranked[0])
+    futures = { self.executor.submit(self.attempt, ranked[0], fn): ranked[0] }
+    done, _ = wait(futures, timeout=delay)
+    for future in done:
+      if future.exception() is None:
+        return future.result(), futures[future]
+    futures[self.executor.submit(self.attempt, ranked[1], fn)] = ranked[1]
+
+    error = None
+    pending = set(futures)
+    while pending:
+      done, pending = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        if future.exception() is None:
+          return future.result(), futures[future]
+        error = future.exception()
+    raise error
+
+  def close(self):
+    self.executor.shutdown(wait=False)
+
+def main():
+  parser = argparse.ArgumentParser(description="Rank Spacemesh endpoints by latency and sync state")
+  parser.add_argument("--node", help="Endpoint to consider (repeatable, default: the public nodes)", action="append")
+  parser.add_argument("--timeout", help="Per-call timeout in seconds", default=5.0, type=float)
+  parser.add_argument("--hedge", action="store_true", help="Fetch the highest ATX with a hedged call to the best two endpoints")
+  args = parser.parse_args()
+
+  selector = EndpointSelector(args.node or public_nodes, timeout=args.timeout)
+  selector.refresh()
+  for endpoint in selector.ranked():
+    state = selector.state[endpoint]
+    latency = f"{state['latency'] * 1000:.0f}ms" if state["latency"] is not None else "-"
+    print(f"{endpoint:32} {latency:>8} {state['status'] or 'OFFLINE':18} score {selector.score(endpoint):.3f}")
+  if args.hedge:
+    try:
+      atx, endpoint = selector.hedged_call(lambda client: client.highest_atx())
+    except grpc.RpcError as e:
+      print(f"Error: Highest ATX failed: {e.code().name}")
+      sys.exit(1)
+    print(f"Highest ATX {atx.id} from {endpoint}")
+  selector.close()
+
+if __name__ == "__main__":
+  main()
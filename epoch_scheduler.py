@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+#
+# Plan PoST generation around Spacemesh epochs and PoET cycle gaps.
+#
+# Genesis time, layer duration, layers per epoch and the PoET phase shift,
+# cycle gap and grace period come from the mainnet config template (stage 1
+# keeps it in <data-dir>/stage1/config.mainnet.json). The current layer is
+# asked from the public nodes, so the timeline follows the network even when
+# the local clock is off. Every epoch has one cycle gap, the cycle_gap before
+# its PoET round starts phase_shift into the epoch: identities prove their
+# PoST in it and register for the round by grace_period before it starts. A
+# new identity therefore needs its PoST and one proving pass finished before
+# that registration deadline.
+#
+# From the measured generation rate (labels/sec per GPU or CPU slot) and
+# proving rate, every identity gets the first cycle gap it can still reach,
+# the GPUs that takes, the latest safe start and a warning when a running job
+# is predicted to miss its gap.
+#
+# Usage:
+#
+#   epoch_scheduler.py timeline [--data-dir DIR] [--gaps N]
+#   epoch_scheduler.py plan [--data-dir DIR ...] [--labels-per-second N] [--max-gpus N] [--gpu-budget N] [--epoch N]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+import grpc
+
+from endpoint_selector import EndpointSelector, public_nodes
+from post_shards import post_files, shard_progress
+from proving_bench import proving_name
+
+label_size = 16
+# mainnet values, used for whatever the template does not set
+mainnet = {
+  "genesis_time": "2023-07-14T08:00:00Z",
+  "layer_duration": "5m",
+  "layers_per_epoch": 4032,
+  "phase_shift": "240h",
+  "cycle_gap": "12h",
+  "grace_period": "1h",
+}
+# proving rate assumed until proving_bench.py has measured one into stage1/proving.json (bytes/sec)
+default_proving_rate = 200 << 20
+duration_units = { "ns": 1e-9, "us": 1e-6, "µs": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600 }
+duration_pattern = re.compile(r"(\d+(?:\.\d+)?)(ns|us|µs|ms|s|m|h)")
+
+def parse_duration(value):
+  # Go duration ("5m", "240h", "1h30m") or plain seconds -> seconds
+  if isinstance(value, (int, float)):
+    return float(value)
+  parts = duration_pattern.findall(value)
+  if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+    raise ValueError(f"Invalid duration: {value}")
+  return sum(float(number) * duration_units[unit] for number, unit in parts)
+
+def parse_time(value):
+  return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+def format_time(seconds):
+  return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+def format_hours(seconds):
+  return f"{seconds / 86400:.1f} days" if abs(seconds) >= 2 * 86400 else f"{seconds / 3600:.1f} h"
+
+def load_network(config_path=None):
+  # timing parameters (seconds) from a go-spacemesh config such as config.mainnet.json
+  config = {}
+  if config_path and os.path.isfile(config_path):
+    with open(config_path, "r") as f:
+      config = json.load(f)
+  main = config.get("main", {})
+  poet = config.get("poet", {})
+  values = {
+    "genesis_time": config.get("genesis", {}).get("genesis-time", mainnet["genesis_time"]),
+    "layer_duration": main.get("layer-duration", mainnet["layer_duration"]),
+    "layers_per_epoch": main.get("layers-per-epoch", mainnet["layers_per_epoch"]),
+    "phase_shift": poet.get("phase-shift", mainnet["phase_shift"]),
+    "cycle_gap": poet.get("cycle-gap", mainnet["cycle_gap"]),
+    "grace_period": poet.get("grace-period", mainnet["grace_period"]),
+  }
+  return {
+    "genesis_time": parse_time(values["genesis_time"]),
+    "layer_duration": parse_duration(values["layer_duration"]),
+    "layers_per_epoch": int(values["layers_per_epoch"]),
+    "phase_shift": parse_duration(values["phase_shift"]),
+    "cycle_gap": parse_duration(values["cycle_gap"]),
+    "grace_period": parse_duration(values["grace_period"]),
+  }
+
+def epoch_duration(network):
+  return network["layers_per_epoch"] * network["layer_duration"]
+
+def layer_time(network, layer):
+  return network["genesis_time"] + layer * network["layer_duration"]
+
+def layer_at(network, now):
+  return int((now - network["genesis_time"]) // network["layer_duration"])
+
+def epoch_of_layer(network, layer):
+  return layer // network["layers_per_epoch"]
+
+def cycle_gap(network, epoch):
+  # the epoch's PoET round starts phase_shift into it and the cycle gap is the cycle_gap before that; proofs are
+  # built in the gap and the challenge for the round is due grace_period before it starts. The ATX counts for epoch + 1.
+  end = network["genesis_time"] + epoch * epoch_duration(network) + network["phase_shift"]
+  start = end - network["cycle_gap"]
+  return { "epoch": epoch, "start": start, "end": end, "registration_deadline": end - network["grace_period"], "eligible_epoch": epoch + 1 }
+
+def cycle_gaps(network, now, count=4):
+  # the next `count` gaps whose registration deadline has not passed
+  epoch = max(0, epoch_of_layer(network, layer_at(network, now)) - 1)
+  gaps = []
+  while len(gaps) < count:
+    gap = cycle_gap(network, epoch)
+    if gap["registration_deadline"] > now:
+      gaps.append(gap)
+    epoch += 1
+  return gaps
+
+def network_time(network, nodes=None, timeout=5.0, max_skew_layers=1):
+  # (now, top layer, source): the local clock unless the network's top layer says it is off by more than a layer
+  now = time.time()
+  selector = EndpointSelector(nodes or public_nodes, timeout=timeout)
+  try:
+    selector.refresh()
+    status, node = selector.call(lambda client: client.status())
+  except grpc.RpcError:
+    return now, layer_at(network, now), "local clock"
+  finally:
+    selector.close()
+  if abs(status.top_layer - layer_at(network, now)) > max_skew_layers:
+    return layer_time(network, status.top_layer), status.top_layer, f"top layer of {node}"
+  return now, status.top_layer, node
+
+def load_proving_rate(stage1_path):
+  # bytes/sec proving_bench.py measured for the identity, kept out of stage1.json so it does not change stage 2's inputs
+  path = f"{stage1_path}/{proving_name}"
+  if os.path.isfile(path):
+    with open(path, "r") as f:
+      return float(json.load(f).get("proving_rate") or default_proving_rate)
+  return float(default_proving_rate)
+
+def identity_status(data_dir, now=None):
+  # size, bytes still to generate and proving rate of the identity in data_dir, plus the ETA of a tracked cloud job
+  now = now or time.time()
+  stage1_path = f"{data_dir}/stage1"
+  config = json.load(open(f"{stage1_path}/stage1.json", "r"))
+  stage2_config_path = f"{data_dir}/stage2/stage2.json"
+  stage2_config = json.load(open(stage2_config_path, "r")) if os.path.isfile(stage2_config_path) else {}
+  files = post_files(config)
+  post_dir = stage2_config.get("post_dir") or stage1_path
+  written, total_bytes, _ = shard_progress(post_dir, files, { "from_file": 0, "to_file": len(files) - 1 })
+  if stage2_config.get("labels_written") is not None:
+    # a cloud job writes remotely, its progress only shows up in stage2.json
+    written = max(written, int(stage2_config["labels_written"]) * label_size)
+  finish = None
+  if stage2_config.get("eta_seconds") is not None and stage2_config.get("status") is None:
+    finish = os.path.getmtime(stage2_config_path) + float(stage2_config["eta_seconds"])
+  return {
+    "name": config["node_id_first_8"],
+    "data_dir": data_dir,
+    "total_bytes": total_bytes,
+    "remaining_bytes": max(0, total_bytes - written),
+    "proving_rate": load_proving_rate(stage1_path),
+    "finish": finish if finish and finish > now else None,
+  }
+
+def plan_identity(network, now, total_bytes, remaining_bytes, rate_per_gpu, proving_rate, max_gpus=1, epoch=None, margin=3600, start=None, horizon=8):
+  # The first cycle gap (from `epoch` on) this PoST can still be generated and proven for with at most
+  # max_gpus, starting no earlier than `start`; rate_per_gpu and proving_rate are bytes/sec.
+  start = max(now, start or now)
+  proving_seconds = total_bytes / proving_rate
+  missed = []
+  for gap in cycle_gaps(network, now, horizon):
+    if epoch is not None and gap["epoch"] < epoch:
+      continue
+    deadline = gap["registration_deadline"] - proving_seconds - margin
+    available = deadline - start
+    gpus = max(1, math.ceil(remaining_bytes / rate_per_gpu / available)) if available > 0 and remaining_bytes else 0
+    if available <= 0 or gpus > max_gpus:
+      missed.append(gap)
+      continue
+    generation_seconds = remaining_bytes / (rate_per_gpu * gpus) if gpus else 0
+    return {
+      "gap": gap,
+      "deadline": deadline,
+      "gpus": gpus,
+      "start": start,
+      "latest_start": deadline - generation_seconds,
+      "finish": start + generation_seconds,
+      "generation_seconds": generation_seconds,
+      "proving_seconds": proving_seconds,
+      "slack": available - generation_seconds,
+      "missed": missed,
+    }
+  return { "gap": None, "gpus": None, "proving_seconds": proving_seconds, "missed": missed }
+
+def schedule_fleet(network, now, identities, rate_per_gpu, max_gpus=1, gpu_budget=None, epoch=None, margin=3600):
+  # Plan every identity, smallest remaining work first. With a GPU budget an identity starts once enough
+  # GPUs are free, so later identities may move to a later cycle gap.
+  free_at = [now] * gpu_budget if gpu_budget else None
+  plans = []
+  for identity in sorted(identities, key=lambda identity: identity["remaining_bytes"]):
+    plan_args = (network, now, identity["total_bytes"], identity["remaining_bytes"], rate_per_gpu, identity["proving_rate"], min(max_gpus, gpu_budget or max_gpus), epoch, margin)
+    plan = plan_identity(*plan_args)
+    if free_at and plan["gpus"]:
+      # wait for as many GPUs as the plan needs, replanning until the start time settles
+      for _ in range(gpu_budget):
+        start = sorted(free_at)[plan["gpus"] - 1]
+        replanned = plan_identity(*plan_args, start=start)
+        if not replanned["gpus"] or replanned["gpus"] <= plan["gpus"]:
+          plan = replanned
+          break
+        plan = replanned
+      if plan["gpus"]:
+        for _ in range(plan["gpus"]):
+          free_at[free_at.index(min(free_at))] = plan["finish"]
+    plan["identity"] = identity
+    plans.append(plan)
+  return plans
+
+def plan_warnings(plan, max_gpus):
+  # early warnings for one identity's plan, most urgent first
+  warnings = []
+  identity = plan.get("identity") or {}
+  if plan["gap"] is None:
+    warnings.append(f"no cycle gap is reachable with {max_gpus} GPUs within the planning horizon")
+  elif plan["missed"]:
+    first = plan["missed"][0]
+    warnings.append(f"misses the epoch {first['epoch']} cycle gap (registration {format_time(first['registration_deadline'])}) with up to {max_gpus} GPUs, waits until epoch {plan['gap']['epoch']}")
+  if plan["gap"] and identity.get("finish"):
+    late = identity["finish"] - plan["deadline"]
+    if late > 0:
+      warnings.append(f"running job finishes {format_hours(late)} after the deadline, at the planned rate epoch {plan['gap']['epoch']} takes {plan['gpus']} GPUs")
+  return warnings
+
+def plan_lines(plan, now, max_gpus):
+  identity = plan.get("identity") or {}
+  name = identity.get("name", "identity")
+  if plan["gap"] is None:
+    return [f"  - {name}: {identity.get('remaining_bytes', 0) / 2 ** 30:.0f} GiB left, WARNING: {plan_warnings(plan, max_gpus)[0]}"]
+  gap = plan["gap"]
+  lines = [f"  - {name}: epoch {gap['epoch']} cycle gap ({format_time(gap['start'])}, ATX for epoch {gap['eligible_epoch']}), PoST due {format_time(plan['deadline'])} (proving takes {format_hours(plan['proving_seconds'])})"]
+  if plan["gpus"]:
+    start = "now" if plan["start"] <= now else format_time(plan["start"])
+    lines.append(f"    {identity.get('remaining_bytes', 0) / 2 ** 30:.0f} GiB left: {plan['gpus']} GPUs for {format_hours(plan['generation_seconds'])}, start {start}, latest {format_time(plan['latest_start'])}, {format_hours(plan['slack'])} slack")
+  else:
+    lines.append("    PoST complete, ready to register")
+  for warning in plan_warnings(plan, max_gpus):
+    lines.append(f"    WARNING: {warning}")
+  return lines
+
+def main():
+  parser = argparse.ArgumentParser(description="Plan PoST generation around epochs and PoET cycle gaps")
+  parser.add_argument("command", choices=["timeline", "plan"])
+  parser.add_argument("--data-dir", help="Identity data directory (repeatable for plan)", action="append")
+  parser.add_argument("--config", help="go-spacemesh config with the network timing (default: <data-dir>/stage1/config.mainnet.json)")
+  parser.add_argument("--node", help="Node to ask for the current layer (repeatable, default: the public nodes)", action="append")
+  parser.add_argument("--offline", action="store_true", help="Use the local clock instead of asking nodes for the current layer")
+  parser.add_argument("--gaps", help="Cycle gaps to list (timeline)", default=4, type=int)
+  parser.add_argument("--labels-per-second", help="Generation rate per GPU or CPU slot", default=100_000, type=int)
+  parser.add_argument("--max-gpus", help="Most GPUs one identity may use", default=8, type=int)
+  parser.add_argument("--gpu-budget", help="GPUs available to the whole fleet at once", type=int)
+  parser.add_argument("--epoch", help="Plan for this epoch's cycle gap or later", type=int)
+  parser.add_argument("--margin", help="Hours kept free before each deadline", default=1.0, type=float)
+  parser.add_argument("--json", action="store_true", help="Print the plan as JSON")
+  args = parser.parse_args()
+
+  data_dirs = args.data_dir or ["data"]
+  network = load_network(args.config or f"{data_dirs[0]}/stage1/config.mainnet.json")
+  if args.offline:
+    now, layer, source = time.time(), layer_at(network, time.time()), "local clock"
+  else:
+    now, layer, source = network_time(network, args.node)
+  print(f"Layer {layer}, epoch {epoch_of_layer(network, layer)} (from {source}), {format_time(now)}")
+
+  if args.command == "timeline":
+    for gap in cycle_gaps(network, now, args.gaps):
+      print(f"  - Epoch {gap['epoch']}: cycle gap {format_time(gap['start'])} - {format_time(gap['end'])}, register by {format_time(gap['registration_deadline'])} (in {format_hours(gap['registration_deadline'] - now)}), ATX for epoch {gap['eligible_epoch']}")
+    return
+
+  identities = []
+  for data_dir in data_dirs:
+    if not os.path.isfile(f"{data_dir}/stage1/stage1.json"):
+      print(f"Error: {data_dir}/stage1/stage1.json does not exist, run stage 1 first.")
+      sys.exit(1)
+    identities.append(identity_status(data_dir, now))
+  plans = schedule_fleet(network, now, identities, args.labels_per_second * label_size, args.max_gpus, args.gpu_budget, args.epoch, args.margin * 3600)
+  if args.json:
+    print(json.dumps(plans, indent=2))
+    return
+  for plan in plans:
+    for line in plan_lines(plan, now, args.max_gpus):
+      print(line)
+  if any(plan_warnings(plan, args.max_gpus) for plan in plans):
+    sys.exit(2)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+#
+# Run the auto-spacemesh pipeline (stage1 -> stage2 -> stage3) for a whole
+# fleet of identities.
+#
+# Identities come from a JSON manifest. Every identity gets its own data
+# directory and one job per stage; jobs are scheduled with a concurrency limit
+# per stage and their state is kept in SQLite, so a crashed run resumes where
+# it stopped.
+#
+# Usage:
+#
+#   fleet.py run <manifest.json> [--db fleet.db] [--concurrency stage1=8,stage2=8,stage3=4]
+#   fleet.py status [--db fleet.db]
+#
+# Manifest:
+#
+#   {
+#     "data_dir": "fleet",
+#     "commands": { "stage2": "python3 stage2.py --data-dir {data_dir} --local" },
+#     "identities": [ { "name": "smesher-001" }, { "name": "smesher-002", "data_dir": "/mnt/disk2/smesher-002" } ]
+#   }
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import json
+import os
+import shlex
+import sqlite3
+import subprocess
+import sys
+import time
+
+stages = ["stage1", "stage2", "stage3"]
+default_commands = {
+  "stage1": "python3 stage1.py --data-dir {data_dir}",
+  "stage2": "python3 stage2.py --data-dir {data_dir} --local",
+  "stage3": "python3 stage3.py --data-dir {data_dir}",
+}
+default_concurrency = { "stage1": 8, "stage2": 4, "stage3": 2 }
+
+def connect(db_path):
+  db = sqlite3.connect(db_path)
+  db.row_factory = sqlite3.Row
+  db.executescript("""
+    CREATE TABLE IF NOT EXISTS identities (
+      name TEXT PRIMARY KEY,
+      data_dir TEXT NOT NULL,
+      params TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS jobs (
+      identity TEXT NOT NULL,
+      stage TEXT NOT NULL,
+      status TEXT NOT NULL DEFAULT 'pending',
+      attempts INTEGER NOT NULL DEFAULT 0,
+      exit_code INTEGER,
+      started_at REAL,
+      finished_at REAL,
+      PRIMARY KEY (identity, stage)
+    );
+  """)
+  return db
+
+def load_manifest(db, manifest_path):
+  # register new identities; identities already in the database keep their job state
+  with open(manifest_path, "r") as f:
+    manifest = json.load(f)
+  base_dir = manifest.get("data_dir", "fleet")
+  commands = dict(default_commands, **manifest.get("commands", {}))
+  with db:
+    for identity in manifest["identities"]:
+      name = identity["name"]
+      data_dir = identity.get("data_dir", f"{base_dir}/{name}")
+      params = dict(identity, commands=dict(commands, **identity.get("commands", {})))
+      db.execute("INSERT OR IGNORE INTO identities (name, data_dir, params) VALUES (?, ?, ?)", (name, data_dir, json.dumps(params)))
+      for stage in stages:
+        db.execute("INSERT OR IGNORE INTO jobs (identity, stage) VALUES (?, ?)", (name, stage))
+  return len(manifest["identities"])
+
+def reset_interrupted_jobs(db):
+  # jobs left "running" by a crashed scheduler are started again
+  with db:
+    return db.execute("UPDATE jobs SET status = 'pending', started_at = NULL WHERE status = 'running'").rowcount
+
+def ready_jobs(db, stage, limit):
+  previous = stages[stages.index(stage) - 1] if stages.index(stage) > 0 else None
+  if previous:
+    query = """
+      SELECT jobs.identity, identities.data_dir, identities.params FROM jobs
+      JOIN identities ON identities.name = jobs.identity
+      JOIN jobs AS previous ON previous.identity = jobs.identity AND previous.stage = ?
+      WHERE jobs.stage = ? AND jobs.status = 'pending' AND previous.status = 'done'
+      ORDER BY jobs.identity LIMIT ?"""
+    return db.execute(query, (previous, stage, limit)).fetchall()
+  query = """
+    SELECT jobs.identity, identities.data_dir, identities.params FROM jobs
+    JOIN identities ON identities.name = jobs.identity
+    WHERE jobs.stage = ? AND jobs.status = 'pending'
+    ORDER BY jobs.identity LIMIT ?"""
+  return db.execute(query, (stage, limit)).fetchall()
+
+def start_job(db, job, stage):
+  params = json.loads(job["params"])
+  data_dir = job["data_dir"]
+  os.makedirs(data_dir, exist_ok=True)
+  command = shlex.split(params["commands"][stage].format(data_dir=data_dir, name=job["identity"]))
+  log_file = open(f"{data_dir}/fleet-{stage}.log", "ab")
+  try:
+    process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+  except OSError as e:
+    # a command that cannot start will not start on a retry either
+    log_file.write(f"Error: cannot start {command[0]}: {e}\n".encode("utf-8"))
+    log_file.close()
+    with db:
+      db.execute("UPDATE jobs SET status = 'failed', attempts = attempts + 1, started_at = ?, finished_at = ?, exit_code = NULL WHERE identity = ? AND stage = ?", (time.time(), time.time(), job["identity"], stage))
+    return None, e
+  log_file.close()
+  with db:
+    db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, finished_at = NULL, exit_code = NULL WHERE identity = ? AND stage = ?", (time.time(), job["identity"], stage))
+  return process, None
+
+def finish_job(db, identity, stage, exit_code, retries):
+  with db:
+    attempts = db.execute("SELECT attempts FROM jobs WHERE identity = ? AND stage = ?", (identity, stage)).fetchone()["attempts"]
+    if exit_code == 0:
+      status = "done"
+    elif attempts <= retries:
+      status = "pending"
+    else:
+      status = "failed"
+    db.execute("UPDATE jobs SET status = ?, exit_code = ?, finished_at = ? WHERE identity = ? AND stage = ?", (status, exit_code, time.time(), identity, stage))
+  return status
+
+def run(db, concurrency, retries=1, poll_interval=1.0, log=print):
+  running = {}
+  while True:
+    for (identity, stage), process in list(running.items()):
+      exit_code = process.poll()
+      if exit_code is not None:
+        del running[(identity, stage)]
+        status = finish_job(db, identity, stage, exit_code, retries)
+        log(f"{identity} {stage} exited with code {exit_code} ({status})")
+
+    for stage in stages:
+      slots = concurrency[stage] - sum(1 for _, running_stage in running if running_stage == stage)
+      if slots <= 0:
+        continue
+      for job in ready_jobs(db, stage, slots):
+        process, error = start_job(db, job, stage)
+        if error:
+          log(f"{job['identity']} {stage} could not start: {error} (failed)")
+          continue
+        running[(job["identity"], stage)] = process
+        log(f"{job['identity']} {stage} started")
+
+    if not running:
+      return
+    time.sleep(poll_interval)
+
+def summary(db):
+  # per stage job counts, mean duration and throughput of completed jobs
+  rows = []
+  for stage in stages:
+    counts = { status: 0 for status in ["pending", "running", "done", "failed"] }
+    for row in db.execute("SELECT status, COUNT(*) AS count FROM jobs WHERE stage = ? GROUP BY status", (stage,)):
+      counts[row["status"]] = row["count"]
+    timing = db.execute("SELECT AVG(finished_at - started_at) AS duration, MIN(started_at) AS first, MAX(finished_at) AS last FROM jobs WHERE stage = ? AND status = 'done'", (stage,)).fetchone()
+    per_hour = None
+    if counts["done"] and timing["last"] > timing["first"]:
+      per_hour = counts["done"] * 3600 / (timing["last"] - timing["first"])
+    rows.append(dict(counts, stage=stage, duration=timing["duration"], per_hour=per_hour))
+  return rows
+
+def print_summary(db):
+  print(f"{'Stage':6} {'Pending':>7} {'Running':>7} {'Done':>6} {'Failed':>6} {'Avg time':>9} {'Per hour':>9}")
+  print(f"{'':-<6} {'':->7} {'':->7} {'':->6} {'':->6} {'':->9} {'':->9}")
+  for row in summary(db):
+    duration = f"{row['duration'] / 60:.1f}m" if row["duration"] is not None else "-"
+    per_hour = f"{row['per_hour']:.1f}" if row["per_hour"] is not None else "-"
+    print(f"{row['stage']:6} {row['pending']:7} {row['running']:7} {row['done']:6} {row['failed']:6} {duration:>9} {per_hour:>9}")
+
+def parse_concurrency(value):
+  concurrency = dict(default_concurrency)
+  if value:
+    for item in value.split(","):
+      stage, limit = item.split("=")
+      if stage not in stages:
+        raise argparse.ArgumentTypeError(f"Unknown stage {stage}")
+      concurrency[stage] = int(limit)
+  return concurrency
+
+def main():
+  parser = argparse.ArgumentParser(description="Run the auto-spacemesh pipeline for a fleet of identities")
+  parser.add_argument("--db", help="SQLite job database", default="fleet.db")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  run_parser = subparsers.add_parser("run", help="Register the manifest's identities and run their pending jobs")
+  run_parser.add_argument("manifest", help="Fleet manifest (JSON)")
+  run_parser.add_argument("--concurrency", help="Jobs per stage, e.g. stage1=8,stage2=8,stage3=4", type=parse_concurrency, default=parse_concurrency(None))
+  run_parser.add_argument("--retries", help="Restarts allowed per failed job", default=1, type=int)
+  subparsers.add_parser("status", help="Show job counts and throughput per stage")
+  args = parser.parse_args()
+
+  db = connect(args.db)
+  if args.command == "status":
+    print_summary(db)
+    return
+
+  count = load_manifest(db, args.manifest)
+  interrupted = reset_interrupted_jobs(db)
+  print(f"Fleet: {count} identities in {args.manifest}" + (f", resuming {interrupted} interrupted jobs" if interrupted else ""))
+  try:
+    run(db, args.concurrency, args.retries)
+  except KeyboardInterrupt:
+    print()
+    print("Interrupted, run the same command again to resume")
+    sys.exit(1)
+  print()
+  print_summary(db)
+
+if __name__ == "__main__":
+  main()
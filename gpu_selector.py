@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# Pick the cheapest RunPod GPU for PoST generation.
+#
+# Every listed GPU type is priced (spot and on-demand) in parallel and ranked by
+# the estimated cost of writing one TiB of PoST labels, using measured
+# labels/sec per GPU model. providers.race_for_capacity then requests pods from
+# the best option down, with exponential backoff between rounds instead of
+# fixed sleeps.
+#
+# Used by stage2.py --cloud runpod.
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import runpod
+
+# Sustained PoST initialization rate per GPU (labels/sec, postcli with default batch size).
+# Keep this table up to date when new measurements come in; GPUs not listed here are never selected.
+gpu_labels_per_second = {
+  "NVIDIA GeForce RTX 4090": 230_000,
+  "NVIDIA GeForce RTX 4080": 160_000,
+  "NVIDIA GeForce RTX 3090 Ti": 155_000,
+  "NVIDIA GeForce RTX 3090": 140_000,
+  "NVIDIA GeForce RTX 3080 Ti": 135_000,
+  "NVIDIA GeForce RTX 3080": 120_000,
+  "NVIDIA RTX 6000 Ada Generation": 220_000,
+  "NVIDIA RTX A6000": 140_000,
+  "NVIDIA RTX A5000": 100_000,
+  "NVIDIA RTX A4500": 85_000,
+  "NVIDIA RTX A4000": 70_000,
+  "NVIDIA A40": 130_000,
+  "NVIDIA L40": 200_000,
+  "NVIDIA L40S": 210_000,
+  "NVIDIA A100 80GB PCIe": 170_000,
+  "NVIDIA A100-SXM4-80GB": 180_000,
+  "NVIDIA H100 PCIe": 250_000,
+  "NVIDIA H100 80GB HBM3": 290_000,
+}
+
+label_size = 16
+tib = 1 << 40
+
+def cost_per_tib(price_per_gpu_hour, labels_per_second):
+  # price does not depend on the GPU count, more GPUs only finish sooner
+  tib_per_gpu_hour = labels_per_second * label_size * 3600 / tib
+  return price_per_gpu_hour / tib_per_gpu_hour
+
+def fetch_gpu_prices(gpu_ids, quantity, workers=8):
+  def fetch(gpu_id):
+    try:
+      return gpu_id, runpod.get_gpu(gpu_id, quantity)
+    except Exception:
+      return gpu_id, None
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    return { gpu_id: gpu for gpu_id, gpu in executor.map(fetch, gpu_ids) if gpu }
+
+def spot_supported():
+  # the RunPod SDK has no call to bid for spot (interruptible) pods, only newer versions might
+  return hasattr(runpod, "create_spot_pod")
+
+def rank_gpu_options(gpus, quantity, total_bytes, market="any", max_cost_per_tib=None, gpu_type=None):
+  # [option] sorted by $/TiB; an option is one GPU type in one market (spot only when the SDK can bid for it, or on-demand)
+  gpu_ids = [gpu["id"] for gpu in gpus if gpu["id"] in gpu_labels_per_second and (gpu_type is None or gpu["id"] == gpu_type)]
+  prices = fetch_gpu_prices(gpu_ids, quantity)
+  options = []
+  for gpu_id, gpu in prices.items():
+    lowest_price = (gpu.get("lowestPrice") or {}).get("minimumBidPrice")
+    ondemand_price = (gpu.get("lowestPrice") or {}).get("uninterruptablePrice")
+    labels_per_second = gpu_labels_per_second[gpu_id]
+    for option_market, price in [("spot", lowest_price), ("on-demand", ondemand_price)]:
+      if price is None or (market != "any" and market != option_market) or (option_market == "spot" and not spot_supported()):
+        continue
+      option = {
+        "id": gpu_id,
+        "quantity": quantity,
+        "market": option_market,
+        "price": price,
+        "lowest_price": lowest_price,
+        "ondemand_price": ondemand_price,
+        "labels_per_second": labels_per_second,
+        "cost_per_tib": cost_per_tib(price, labels_per_second),
+        "hours": total_bytes / (labels_per_second * label_size * quantity * 3600),
+      }
+      option["total_cost"] = option["price"] * quantity * option["hours"]
+      if max_cost_per_tib is None or option["cost_per_tib"] <= max_cost_per_tib:
+        options.append(option)
+  return sorted(options, key=lambda option: (option["cost_per_tib"], option["hours"]))
+
+def backoff_delays(initial=5, maximum=300, factor=2):
+  delay = initial
+  while True:
+    yield delay
+    delay = min(maximum, delay * factor)
+
+def wait_for_gpu_options(gpus, quantity, total_bytes, market="any", max_cost_per_tib=None, gpu_type=None, log=print):
+  for delay in backoff_delays():
+    options = rank_gpu_options(gpus, quantity, total_bytes, market, max_cost_per_tib, gpu_type)
+    if options:
+      return options
+    log(f"S2.3   - No priced GPU available, checking again in {delay}s")
+    time.sleep(delay)
+
+def create_pod_for_option(option, **pod_args):
+  # spot capacity is bid for at the current minimum price; never silently rented on-demand instead
+  if option["market"] == "spot":
+    if not spot_supported():
+      raise RuntimeError("the runpod SDK cannot bid for spot pods")
+    return runpod.create_spot_pod(gpu_type_id=option["id"], gpu_count=option["quantity"], bid_per_gpu=option["price"], **pod_args)
+  return runpod.create_pod(gpu_type_id=option["id"], gpu_count=option["quantity"], **pod_args)
+
+def print_options(options, limit=5, log=print):
+  for option in options[:limit]:
+    log(f"S2.3   - {option['id']:32} {option['market']:9} ${option['price']:.3f}/GPU/hr  ${option['cost_per_tib']:.2f}/TiB  {option['hours']:.1f}h  ${option['total_cost']:.2f} total")
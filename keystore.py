@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#
+# Batch identity keystore.
+#
+# Holds any number of ed25519 identities in one file that is read through
+# mmap: a header, an open addressing index keyed by the 8 character node ID
+# prefix and one fixed width record per identity (public key, private seed,
+# prefix, status, creation time). Finding an identity by full node ID or by
+# prefix touches one or two index slots, listing reads the records in place,
+# and key.bin for a single identity is exported on demand. Writers hold an
+# flock on the <keystore>.lock file next to it.
+#
+# Usage:
+#
+#   keystore.py generate COUNT [--keystore FILE]
+#   keystore.py list [--status STATUS]
+#   keystore.py show ID
+#   keystore.py export ID [--data-dir DIR]
+#   keystore.py set-status ID STATUS
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+
+Identity = namedtuple("Identity", ["index", "node_id", "prefix", "status", "created_at"])
+
+magic = b"SMKS"
+format_version = 1
+# magic, version, record size, identity count, index slots
+header_format = struct.Struct("<4sHHII")
+# public key, private seed, node ID prefix (hex), status, creation time
+record_format = struct.Struct("<32s32s8sB7xQ8x")
+slot_format = struct.Struct("<I")
+# byte offset of the status inside a record (after public key, seed and prefix)
+status_offset = 72
+statuses = ["new", "exported", "active", "retired"]
+default_keystore = "keystore.bin"
+
+def index_capacity(count):
+  # power of two, at most half full
+  capacity = 16
+  while capacity < count * 2:
+    capacity *= 2
+  return capacity
+
+def prefix_hash(prefix):
+  return int(prefix, 16)
+
+class Keystore:
+  def __init__(self, path, writable=False):
+    self.path = path
+    self.file = open(path, "r+b" if writable else "rb")
+    self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+    file_magic, version, record_size, self.count, self.capacity = header_format.unpack_from(self.map, 0)
+    if file_magic != magic or version != format_version or record_size != record_format.size:
+      raise ValueError(f"{path} is not a keystore (version {format_version})")
+    self.index_offset = header_format.size
+    self.records_offset = self.index_offset + self.capacity * slot_format.size
+
+  def __len__(self):
+    return self.count
+
+  def close(self):
+    self.map.close()
+    self.file.close()
+
+  def raw_record(self, index):
+    return record_format.unpack_from(self.map, self.records_offset + index * record_format.size)
+
+  def record(self, index):
+    public_key, _, prefix, status, created_at = self.raw_record(index)
+    return Identity(index, public_key.hex(), prefix.decode("ascii"), statuses[status], created_at)
+
+  def identities(self, status=None):
+    for index in range(self.count):
+      identity = self.record(index)
+      if status is None or identity.status == status:
+        yield identity
+
+  def matches(self, prefix):
+    # record indexes whose prefix equals prefix, following the probe chain
+    found = []
+    slot = prefix_hash(prefix) % self.capacity
+    while True:
+      (entry,) = slot_format.unpack_from(self.map, self.index_offset + slot * slot_format.size)
+      if entry == 0:
+        return found
+      if self.raw_record(entry - 1)[2].decode("ascii") == prefix:
+        found.append(entry - 1)
+      slot = (slot + 1) % self.capacity
+
+  def find(self, node_id):
+    # by full node ID or by its first 8 hex characters
+    node_id = node_id.lower()
+    if len(node_id) < 8:
+      raise ValueError("Identity lookups need at least the 8 character node ID prefix")
+    candidates = [self.record(index) for index in self.matches(node_id[:8])]
+    candidates = [identity for identity in candidates if identity.node_id.startswith(node_id)]
+    if not candidates:
+      raise KeyError(f"No identity {node_id} in {self.path}")
+    if len(candidates) > 1:
+      raise ValueError(f"Prefix {node_id} is ambiguous, use the full node ID")
+    return candidates[0]
+
+  def private_key(self, identity):
+    # the 64 byte ed25519 private key (seed + public key), as go-spacemesh stores it
+    public_key, seed, _, _, _ = self.raw_record(identity.index)
+    return seed + public_key
+
+  def set_status(self, identity, status):
+    offset = self.records_offset + identity.index * record_format.size + status_offset
+    self.map[offset] = statuses.index(status)
+    self.map.flush()
+
+@contextmanager
+def keystore_lock(path):
+  # exclusive lock for changes to the keystore. write_keystore swaps in a new file, so the lock lives in a
+  # <keystore>.lock sidecar that every writer opens, never in the keystore file itself.
+  fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+  try:
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    yield
+  finally:
+    os.close(fd)
+
+def read_records(path):
+  if not os.path.isfile(path):
+    return []
+  keystore = Keystore(path)
+  try:
+    return [keystore.raw_record(index) for index in range(keystore.count)]
+  finally:
+    keystore.close()
+
+def write_keystore(path, records):
+  # rebuild the whole file (index included) and swap it in atomically; callers hold keystore_lock
+  capacity = index_capacity(len(records))
+  slots = [0] * capacity
+  for index, record in enumerate(records):
+    slot = prefix_hash(record[2].decode("ascii")) % capacity
+    while slots[slot]:
+      slot = (slot + 1) % capacity
+    slots[slot] = index + 1
+  tmp_path = f"{path}.tmp"
+  fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+  with os.fdopen(fd, "wb") as f:
+    f.write(header_format.pack(magic, format_version, record_format.size, len(records), capacity))
+    f.write(b"".join(slot_format.pack(slot) for slot in slots))
+    for record in records:
+      f.write(record_format.pack(*record))
+  os.replace(tmp_path, path)
+
+def generate_identities(path, count):
+  # append count new identities; returns their node IDs
+  import nacl.signing
+  with keystore_lock(path):
+    records = read_records(path)
+    node_ids = []
+    now = int(time.time())
+    for _ in range(count):
+      signing_key = nacl.signing.SigningKey.generate()
+      public_key = signing_key.verify_key.encode()
+      records.append((public_key, signing_key.encode(), public_key.hex()[:8].encode("ascii"), 0, now))
+      node_ids.append(public_key.hex())
+    write_keystore(path, records)
+  return node_ids
+
+def export_key(keystore, identity, stage1_path):
+  # key.bin for stage1/go-spacemesh: hex of the 64 byte private key
+  os.makedirs(stage1_path, exist_ok=True)
+  bin_file = f"{stage1_path}/key.bin"
+  fd = os.open(bin_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+  with os.fdopen(fd, "w") as f:
+    f.write(keystore.private_key(identity).hex())
+  if identity.status == "new":
+    keystore.set_status(identity, "exported")
+  return bin_file
+
+def main():
+  parser = argparse.ArgumentParser(description="Batch identity keystore")
+  parser.add_argument("--keystore", help="Keystore file", default=default_keystore)
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  generate_parser = subparsers.add_parser("generate", help="Generate new identities")
+  generate_parser.add_argument("count", type=int)
+  list_parser = subparsers.add_parser("list", help="List identities")
+  list_parser.add_argument("--status", choices=statuses)
+  show_parser = subparsers.add_parser("show", help="Show one identity")
+  show_parser.add_argument("id", help="Node ID or 8 character prefix")
+  export_parser = subparsers.add_parser("export", help="Write key.bin of one identity to <data-dir>/stage1")
+  export_parser.add_argument("id", help="Node ID or 8 character prefix")
+  export_parser.add_argument("--data-dir", help="Directory for data files", default="data")
+  status_parser = subparsers.add_parser("set-status", help="Change the status of one identity")
+  status_parser.add_argument("id", help="Node ID or 8 character prefix")
+  status_parser.add_argument("status", choices=statuses)
+  args = parser.parse_args()
+
+  if args.command == "generate":
+    started = time.monotonic()
+    node_ids = generate_identities(args.keystore, args.count)
+    print(f"Generated {len(node_ids)} identities in {time.monotonic() - started:.2f}s ({args.keystore})")
+    return
+
+  if not os.path.isfile(args.keystore):
+    print(f"Error: Keystore {args.keystore} does not exist, generate identities first.")
+    sys.exit(1)
+  writable = args.command in ("export", "set-status")
+  # status changes are written into the mapped file, which must not be swapped out by a concurrent generate
+  with keystore_lock(args.keystore) if writable else nullcontext():
+    keystore = Keystore(args.keystore, writable)
+    try:
+      if args.command == "list":
+        for identity in keystore.identities(args.status):
+          print(f"{identity.prefix}  {identity.status:8}  {identity.node_id}")
+        return
+      try:
+        identity = keystore.find(args.id)
+      except (KeyError, ValueError) as e:
+        print(f"Error: {e.args[0]}")
+        sys.exit(1)
+      if args.command == "show":
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(identity.created_at))
+        print(f"Node ID: {identity.node_id}")
+        print(f"Status:  {identity.status}")
+        print(f"Created: {created}")
+      elif args.command == "export":
+        print(f"key.bin for {identity.prefix} written to {export_key(keystore, identity, f'{args.data_dir}/stage1')}")
+      elif args.command == "set-status":
+        keystore.set_status(identity, args.status)
+        print(f"{identity.prefix} is now {args.status}")
+    finally:
+      keystore.close()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+#
+# Follow go-spacemesh and PoST init logs as they grow.
+#
+# One inotify instance watches the directories of all followed logs, so the
+# process sleeps until a log is written to and then reads only the appended
+# bytes. Rotated, truncated and recreated logs are picked up again from their
+# start. Every line that reports labels written, a PoST file index, an error,
+# the end of initialization or the start and end of a proving pass becomes a
+# LogEvent, and a rolling labels/sec rate and ETA are kept per log. Without
+# inotify (not Linux) the logs are polled.
+#
+# Usage:
+#
+#   log_follower.py LOG ... [--post-dir DIR] [--total-labels N] [--from-start] [--json]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import re
+import select
+import struct
+import time
+from collections import deque, namedtuple
+
+from stage3 import load_metadata
+
+LogEvent = namedtuple("LogEvent", ["path", "time", "kind", "labels_written", "file_index", "line"])
+
+# postcli/post-rs report progress either as a labels counter or as "written/total"
+progress_patterns = [
+  re.compile(r"num_?labels_?written\"?[=:\s]+(\d+)", re.IGNORECASE),
+  re.compile(r"currentNumLabels\"?[=:\s]+(\d+)"),
+  re.compile(r"(\d+)\s*/\s*\d+\s+labels", re.IGNORECASE),
+]
+file_index_pattern = re.compile(r"file_?index\"?[=:\s]+(\d+)", re.IGNORECASE)
+error_pattern = re.compile(r"\b(ERROR|FATAL|PANIC)\b|^panic:|\"level\":\s*\"(error|fatal|panic)\"")
+complete_pattern = re.compile(r"initialization: completed|STATE_COMPLETE", re.IGNORECASE)
+# go-spacemesh around the proving pass in each cycle gap
+proving_pattern = re.compile(r"starting post execution|post proof generation started", re.IGNORECASE)
+proven_pattern = re.compile(r"finished post execution|post proof generated", re.IGNORECASE)
+
+# inotify(7)
+in_modify = 0x2
+in_moved_from = 0x40
+in_moved_to = 0x80
+in_create = 0x100
+in_delete = 0x200
+in_nonblock = os.O_NONBLOCK
+in_cloexec = 0o2000000
+inotify_event = struct.Struct("iIII")
+
+def parse_line(path, line, now=None):
+  # a LogEvent for a line that says something about PoST progress, otherwise None
+  now = now or time.time()
+  labels_written = None
+  for pattern in progress_patterns:
+    match = pattern.search(line)
+    if match:
+      labels_written = int(match.group(1))
+      break
+  match = file_index_pattern.search(line)
+  file_index = int(match.group(1)) if match else None
+  if error_pattern.search(line):
+    kind = "error"
+  elif complete_pattern.search(line):
+    kind = "complete"
+  elif proving_pattern.search(line):
+    kind = "proving"
+  elif proven_pattern.search(line):
+    kind = "proven"
+  elif labels_written is not None:
+    kind = "labels"
+  elif file_index is not None:
+    kind = "file"
+  else:
+    return None
+  return LogEvent(path, now, kind, labels_written, file_index, line)
+
+def load_inotify():
+  libc_name = ctypes.util.find_library("c")
+  libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+  if not libc or not hasattr(libc, "inotify_init1"):
+    return None
+  libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+  return libc
+
+class RollingRate:
+  # labels/sec over the samples of the last `window` seconds
+  def __init__(self, window=120):
+    self.window = window
+    self.samples = deque()
+
+  def add(self, now, labels_written):
+    self.samples.append((now, labels_written))
+    while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+      self.samples.popleft()
+
+  def rate(self):
+    if len(self.samples) < 2 or self.samples[-1][0] <= self.samples[0][0]:
+      return None
+    return (self.samples[-1][1] - self.samples[0][1]) / (self.samples[-1][0] - self.samples[0][0])
+
+class LogFollower:
+  def __init__(self, paths=(), from_start=False, poll_interval=1.0, window=120):
+    self.from_start = from_start
+    self.poll_interval = poll_interval
+    self.window = window
+    self.logs = {}
+    self.watches = {}
+    # directories that did not exist yet when their log was added
+    self.unwatched = set()
+    libc = load_inotify()
+    self.libc = libc
+    self.inotify_fd = libc.inotify_init1(in_nonblock | in_cloexec) if libc else -1
+    if self.inotify_fd < 0:
+      self.libc = None
+    for path in paths:
+      self.add(path)
+
+  def add(self, path, total_labels=None, post_dir=None):
+    # total_labels, or the PoST directory whose postdata_metadata.json gives it once it exists, enables the ETA
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    self.logs[path] = {
+      "file": None,
+      "inode": None,
+      "buffer": b"",
+      "total_labels": total_labels,
+      "post_dir": post_dir,
+      "labels_written": None,
+      "file_index": None,
+      "errors": 0,
+      "complete": False,
+      "rate": RollingRate(self.window),
+    }
+    if self.libc and directory not in self.watches.values():
+      self.watch(directory)
+    self.open(path, at_end=not self.from_start)
+
+  def watch(self, directory):
+    wd = self.libc.inotify_add_watch(self.inotify_fd, directory.encode(), in_modify | in_moved_from | in_moved_to | in_create | in_delete)
+    if wd >= 0:
+      self.watches[wd] = directory
+      self.unwatched.discard(directory)
+    else:
+      self.unwatched.add(directory)
+    return wd >= 0
+
+  def open(self, path, at_end=False):
+    log = self.logs[path]
+    if log["file"]:
+      log["file"].close()
+    log["file"] = None
+    log["buffer"] = b""
+    try:
+      log["file"] = open(path, "rb")
+    except FileNotFoundError:
+      return
+    log["inode"] = os.fstat(log["file"].fileno()).st_ino
+    if at_end:
+      log["file"].seek(0, os.SEEK_END)
+
+  def read(self, path):
+    # parse whatever was appended since the last read
+    log = self.logs[path]
+    if not log["file"]:
+      self.open(path)
+      if not log["file"]:
+        return []
+    if os.fstat(log["file"].fileno()).st_size < log["file"].tell():
+      # truncated in place
+      log["file"].seek(0)
+      log["buffer"] = b""
+    data = log["file"].read()
+    if not data:
+      return []
+    lines = (log["buffer"] + data).split(b"\n")
+    log["buffer"] = lines.pop()
+    events = []
+    now = time.time()
+    for line in lines:
+      event = parse_line(path, line.decode("utf-8", "replace"), now)
+      if event:
+        self.update(log, event)
+        events.append(event)
+    return events
+
+  def update(self, log, event):
+    if event.labels_written is not None:
+      log["labels_written"] = event.labels_written
+      log["rate"].add(event.time, event.labels_written)
+    if event.file_index is not None:
+      log["file_index"] = event.file_index
+    if event.kind == "error":
+      log["errors"] += 1
+    elif event.kind == "complete":
+      log["complete"] = True
+
+  def rotated(self, path):
+    # a new file took the log's name: finish the old one, then start the new one from its beginning
+    log = self.logs[path]
+    # the open file still reaches the old log, whatever it is called now
+    events = self.read(path) if log["file"] else []
+    try:
+      inode = os.stat(path).st_ino
+    except FileNotFoundError:
+      return events
+    if inode == log["inode"]:
+      return events
+    self.open(path)
+    return events + self.read(path)
+
+  def poll(self, timeout=None):
+    # wait up to timeout seconds for new lines; returns their events
+    if not self.libc:
+      time.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+      events = []
+      for path in self.logs:
+        events += self.rotated(path) + self.read(path)
+      return events
+    events = []
+    if self.unwatched:
+      # keep looking for the missing directories, and read logs that appeared in them
+      timeout = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+      for directory in list(self.unwatched):
+        if self.watch(directory):
+          for path in self.logs:
+            if os.path.dirname(path) == directory:
+              events += self.read(path)
+    ready, _, _ = select.select([self.inotify_fd], [], [], timeout)
+    if not ready:
+      return events
+    changed = set()
+    moved = set()
+    try:
+      data = os.read(self.inotify_fd, 65536)
+    except BlockingIOError:
+      return events
+    offset = 0
+    while offset < len(data):
+      wd, mask, _, name_length = inotify_event.unpack_from(data, offset)
+      name = data[offset + inotify_event.size:offset + inotify_event.size + name_length].rstrip(b"\0").decode("utf-8", "replace")
+      offset += inotify_event.size + name_length
+      path = os.path.join(self.watches.get(wd, ""), name)
+      if path not in self.logs:
+        continue
+      if mask & (in_create | in_moved_to | in_moved_from | in_delete):
+        moved.add(path)
+      else:
+        changed.add(path)
+    for path in sorted(changed | moved):
+      events += self.rotated(path) if path in moved else self.read(path)
+    return events
+
+  def events(self, timeout=None):
+    # LogEvents as they happen; stops after timeout seconds without any
+    last_event = time.monotonic()
+    while True:
+      events = self.poll(timeout)
+      if events:
+        last_event = time.monotonic()
+      elif timeout is not None and time.monotonic() - last_event >= timeout:
+        return
+      yield from events
+
+  def progress(self, path):
+    # {"labels_written", "total_labels", "rate", "eta", "file_index", "errors", "complete"} of one log
+    log = self.logs[os.path.abspath(path)]
+    total_labels = log["total_labels"]
+    if total_labels is None and log["post_dir"]:
+      try:
+        metadata = load_metadata(log["post_dir"])
+        total_labels = log["total_labels"] = int(metadata["NumUnits"]) * int(metadata["LabelsPerUnit"])
+      except (OSError, ValueError):
+        pass
+    rate = log["rate"].rate()
+    eta = None
+    if rate and total_labels and log["labels_written"] is not None:
+      eta = max(0, total_labels - log["labels_written"]) / rate
+    return {
+      "labels_written": log["labels_written"],
+      "total_labels": total_labels,
+      "rate": rate,
+      "eta": eta,
+      "file_index": log["file_index"],
+      "errors": log["errors"],
+      "complete": log["complete"],
+    }
+
+  def close(self):
+    for log in self.logs.values():
+      if log["file"]:
+        log["file"].close()
+    if self.libc:
+      os.close(self.inotify_fd)
+
+def format_progress(progress):
+  parts = []
+  if progress["labels_written"] is not None:
+    if progress["total_labels"]:
+      parts.append(f"{progress['labels_written'] / progress['total_labels']:.1%}")
+    parts.append(f"{progress['labels_written']:,} labels")
+  if progress["file_index"] is not None:
+    parts.append(f"file {progress['file_index']}")
+  if progress["rate"]:
+    parts.append(f"{progress['rate']:,.0f} labels/s")
+  if progress["eta"] is not None:
+    parts.append(f"ETA {progress['eta'] / 60:.0f} min")
+  if progress["errors"]:
+    parts.append(f"{progress['errors']} errors")
+  if progress["complete"]:
+    parts.append("complete")
+  return ", ".join(parts)
+
+def main():
+  parser = argparse.ArgumentParser(description="Follow go-spacemesh / PoST init logs and report progress")
+  parser.add_argument("logs", help="Log files to follow", nargs="+")
+  parser.add_argument("--post-dir", help="PoST directory whose postdata_metadata.json gives the total labels")
+  parser.add_argument("--total-labels", help="Total labels to write, for the ETA", type=int)
+  parser.add_argument("--from-start", action="store_true", help="Parse the existing contents too")
+  parser.add_argument("--json", action="store_true", help="Print every event as a JSON line")
+  parser.add_argument("--interval", help="Seconds between progress lines per log", default=10.0, type=float)
+  parser.add_argument("--prefix", help="Prefix for progress lines (e.g. S1.6)", default="")
+  parser.add_argument("--until-complete", action="store_true", help="Exit once every log reported the end of initialization")
+  args = parser.parse_args()
+
+  follower = LogFollower(from_start=args.from_start)
+  for path in args.logs:
+    follower.add(path, args.total_labels, args.post_dir)
+  prefix = f"{args.prefix}   - " if args.prefix else ""
+  last_report = {}
+  try:
+    while True:
+      for event in follower.poll(args.interval):
+        if args.json:
+          print(json.dumps(event._asdict()), flush=True)
+          continue
+        name = os.path.relpath(event.path) if len(args.logs) > 1 else os.path.basename(event.path)
+        if event.kind in ("error", "complete", "proving", "proven"):
+          print(f"{prefix}{name}: {event.kind}: {event.line.strip()}", flush=True)
+        elif time.monotonic() - last_report.get(event.path, 0) >= args.interval:
+          last_report[event.path] = time.monotonic()
+          print(f"{prefix}{name}: {format_progress(follower.progress(event.path))}", flush=True)
+      if args.until_complete and all(follower.progress(path)["complete"] for path in follower.logs):
+        return
+  except KeyboardInterrupt:
+    pass
+  finally:
+    follower.close()
+
+if __name__ == "__main__":
+  main()
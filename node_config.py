@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# go-spacemesh node config for an identity.
+#
+# Downloads the mainnet config template and writes config.json next to
+# stage1.json with the same adjustments stage1.sh makes: the gRPC listeners
+# and the smeshing options for the identity's PoST data.
+#
+# Used by stage1.py and stage_runner.py.
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import json
+import os
+import urllib.request
+
+template_url = "https://smapp.spacemesh.network/config.mainnet.json"
+default_coinbase = "sm1qqqqqqxre24mtprsmuht8gfhu28z95hm22zvrdq34rmr8"
+
+def download_template(stage1_path):
+  os.makedirs(stage1_path, exist_ok=True)
+  with urllib.request.urlopen(template_url, timeout=60) as response:
+    template = response.read()
+  json.loads(template)
+  # written atomically, stage1.py may read it while the pipeline's template stage is still downloading
+  path = f"{stage1_path}/config.mainnet.json"
+  with open(f"{path}.tmp", "wb") as f:
+    f.write(template)
+  os.replace(f"{path}.tmp", path)
+
+def write_node_config(stage1_path, coinbase=default_coinbase):
+  # same adjustments stage1.sh makes to the mainnet template
+  config = json.load(open(f"{stage1_path}/config.mainnet.json", "r"))
+  stage1_config = json.load(open(f"{stage1_path}/stage1.json", "r"))
+  config.setdefault("api", {}).update({
+    "grpc-public-listener": "0.0.0.0:19092",
+    "grpc-private-listener": "127.0.0.1:19093",
+    "grpc-json-listener": "0.0.0.0:19094",
+  })
+  config["smeshing"] = {
+    "smeshing-opts": {
+      "smeshing-opts-datadir": stage1_path,
+      "smeshing-opts-maxfilesize": int(stage1_config["max_file_size"]),
+      "smeshing-opts-numunits": int(stage1_config["num_units"]),
+      "smeshing-opts-provider": 0,
+      "smeshing-opts-throttle": False,
+      "smeshing-opts-compute-batch-size": 1048576,
+    },
+    "smeshing-coinbase": coinbase,
+    "smeshing-proving-opts": {
+      "smeshing-opts-proving-nonces": 0,
+      "smeshing-opts-proving-threads": 0,
+    },
+    "smeshing-start": False,
+  }
+  with open(f"{stage1_path}/config.json", "w") as f:
+    json.dump(config, f, indent=2)
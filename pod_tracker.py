@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+#
+# Follow a RunPod pod until its PoST output is complete, and terminate it
+# once the output is confirmed transferred.
+#
+# Pod status and the generator log are polled with an adaptive interval (short
+# while the ETA is close, growing while nothing changes). Labels written are
+# parsed from the log into a rate and ETA, and the final runtime and cost are
+# returned so they can be recorded in stage2.json.
+#
+# Used by stage2.py --cloud runpod.
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import subprocess
+import time
+from collections import deque
+
+import runpod
+
+from log_follower import progress_patterns
+
+def parse_labels_written(text):
+  # last reported labels count in the log text, or None
+  labels_written = None
+  for line in text.splitlines():
+    for pattern in progress_patterns:
+      match = pattern.search(line)
+      if match:
+        labels_written = int(match.group(1))
+  return labels_written
+
+def pod_ssh_address(pod):
+  # public IP and port mapped to the pod's sshd, when the pod exposes one
+  runtime = pod.get("runtime") or {}
+  for port in runtime.get("ports") or []:
+    if port.get("privatePort") == 22 and port.get("isIpPublic"):
+      return port["ip"], port["publicPort"]
+  return None
+
+def ssh_log_reader(log_path, ssh_key=None, lines=200):
+  def read_log(pod):
+    address = pod_ssh_address(pod)
+    if not address:
+      return None
+    command = ["ssh", "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=accept-new", "-p", str(address[1])]
+    if ssh_key:
+      command += ["-i", ssh_key]
+    command += [f"root@{address[0]}", f"tail -n {lines} {log_path}"]
+    try:
+      result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=30)
+    except subprocess.TimeoutExpired:
+      return None
+    return result.stdout.decode("utf-8", "replace") if result.returncode == 0 else None
+  return read_log
+
+def pod_cost(pod):
+  # (cost so far, uptime in seconds) from the pod's hourly price and runtime
+  uptime = ((pod.get("runtime") or {}).get("uptimeInSeconds")) or 0
+  return (pod.get("costPerHr") or 0) * uptime / 3600, uptime
+
+def track_pod(pod_id, total_labels, read_log=None, is_complete=None, is_failed=None, min_interval=10, max_interval=300, max_api_failures=10, on_update=None, log=print):
+  # Returns {"status", "labels_written", "runtime_seconds", "cost", "pod_kept", "ssh"}. Status is
+  #   "complete"   is_complete() confirmed the output arrived locally, the pod was terminated
+  #   "generated"  without is_complete: the log reports every label written, the pod is kept so its files can be fetched
+  #   "failed"     the pod went away before finishing, or is_failed() reported a dead transfer (the pod is kept)
+  #   "untracked"  max_api_failures get_pod calls in a row failed, the pod is left alone
+  # The pod is only terminated once its output is confirmed transferred; its disk is the only copy until then.
+  samples = deque(maxlen=20)
+  interval = min_interval
+  labels_written = None
+  last_pod = {}
+  api_failures = 0
+
+  def result(status, pod_kept):
+    cost, uptime = pod_cost(last_pod)
+    return { "status": status, "labels_written": labels_written, "runtime_seconds": uptime, "cost": cost, "pod_kept": pod_kept, "ssh": pod_ssh_address(last_pod) }
+
+  while True:
+    try:
+      pod = runpod.get_pod(pod_id)
+    except Exception as e:
+      # one failed API call must not abandon a billed pod; back off and keep polling
+      api_failures += 1
+      if api_failures >= max_api_failures:
+        log(f"S2.5   - get_pod failed {api_failures} times in a row ({e}), no longer tracking pod {pod_id} (left running)")
+        return result("untracked", True)
+      delay = min(max_interval, min_interval * 2 ** api_failures)
+      log(f"S2.5   - get_pod failed ({e}), retrying in {delay:.0f}s")
+      time.sleep(delay)
+      continue
+    api_failures = 0
+    if pod:
+      last_pod = pod
+    alive = bool(pod) and pod.get("desiredStatus") not in ("EXITED", "TERMINATED")
+
+    previous = labels_written
+    eta = None
+    if alive:
+      text = read_log(pod) if read_log else None
+      if text:
+        labels_written = parse_labels_written(text) or labels_written
+      now = time.monotonic()
+      if labels_written is not None:
+        samples.append((now, labels_written))
+        if len(samples) > 1 and samples[-1][0] > samples[0][0]:
+          rate = (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+          if rate > 0:
+            eta = (total_labels - labels_written) / rate
+            log(f"S2.5   - {labels_written / total_labels:.1%} ({rate:,.0f} labels/s, ETA {eta / 60:.0f} min)")
+      if on_update:
+        on_update(pod, labels_written, eta)
+
+    # a pod that exits after writing everything has completed, so completion is checked before its status
+    if is_complete:
+      if is_complete():
+        if alive:
+          try:
+            runpod.terminate_pod(pod_id)
+          except Exception as e:
+            log(f"S2.5   - Could not terminate pod {pod_id}: {e}")
+            return result("complete", True)
+        return result("complete", False)
+      if is_failed and is_failed():
+        log(f"S2.5   - Transfer failed, pod {pod_id} is kept so the transfer can be retried")
+        return result("failed", alive)
+      if not alive:
+        # the output may still be arriving from elsewhere after the pod exited; wait for it to finish or fail
+        time.sleep(min_interval)
+        continue
+    elif labels_written is not None and labels_written >= total_labels:
+      return result("generated", alive)
+    elif not alive:
+      return result("failed", False)
+
+    # poll more often as the end approaches, back off while nothing is moving
+    if eta is not None:
+      interval = max(min_interval, min(max_interval, eta / 10))
+    elif labels_written == previous:
+      interval = min(max_interval, interval * 1.5)
+    time.sleep(interval)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+#
+# Spread the PoST files of one identity over several disks.
+#
+# Every candidate directory is probed for free space and sequential write and
+# read throughput. Proving reads all postdata_N.bin files once per pass, so the
+# files are assigned to the disks that finish their share soonest (disks on
+# the same filesystem share space and throughput). The files live in
+# <disk>/post-<node id prefix>/ and are symlinked into the PoST directory, so
+# go-spacemesh and postcli still see a single smeshing-opts-datadir. Space is
+# preallocated before generation and the layout is recorded in stage1.json.
+#
+# Usage:
+#
+#   post_layout.py probe DIR ...
+#   post_layout.py plan --disk DIR ... [--data-dir DIR] [--post-dir DIR] [--apply]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import shutil
+import sys
+import time
+
+from post_shards import post_files
+from proving_bench import drop_cache, parse_size
+
+probe_name = ".layout-probe"
+# fallocate(2) flag that reserves blocks without changing the file size
+falloc_fl_keep_size = 1
+
+def probe_disk(path, probe_size=256 << 20, block_size=4 << 20):
+  # free space plus sequential write (fsynced) and read (uncached) throughput of the filesystem holding path
+  os.makedirs(path, exist_ok=True)
+  probe_path = f"{path}/{probe_name}"
+  block = os.urandom(block_size)
+  blocks = max(1, probe_size // block_size)
+  try:
+    started = time.monotonic()
+    fd = os.open(probe_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+      for _ in range(blocks):
+        os.write(fd, block)
+      os.fsync(fd)
+    finally:
+      os.close(fd)
+    write_rate = blocks * block_size / (time.monotonic() - started)
+
+    drop_cache([probe_path])
+    started = time.monotonic()
+    fd = os.open(probe_path, os.O_RDONLY)
+    try:
+      while os.read(fd, block_size):
+        pass
+    finally:
+      os.close(fd)
+    read_rate = blocks * block_size / (time.monotonic() - started)
+  finally:
+    if os.path.exists(probe_path):
+      os.remove(probe_path)
+  return {
+    "path": os.path.abspath(path),
+    "device": os.stat(path).st_dev,
+    "free": shutil.disk_usage(path).free,
+    "write_rate": write_rate,
+    "read_rate": read_rate,
+  }
+
+def plan_layout(files, disks, reserve=0):
+  # files: [(name, size)], disks: probe_disk() results. Largest files first, each onto the filesystem
+  # whose share would be read soonest; paths on one filesystem take turns.
+  devices = {}
+  for disk in disks:
+    device = devices.setdefault(disk["device"], { "paths": [], "free": disk["free"] - reserve, "read_rate": disk["read_rate"], "bytes": 0, "turn": 0 })
+    device["paths"].append(disk["path"])
+    device["read_rate"] = max(device["read_rate"], disk["read_rate"])
+
+  placement = {}
+  assigned = { disk["path"]: [] for disk in disks }
+  for name, size in sorted(files, key=lambda file: file[1], reverse=True):
+    fitting = [device for device in devices.values() if device["free"] - device["bytes"] >= size]
+    if not fitting:
+      needed = sum(size for _, size in files)
+      raise ValueError(f"The disks have {sum(device['free'] for device in devices.values()) >> 30} GiB free, the PoST needs {needed >> 30} GiB")
+    device = min(fitting, key=lambda device: (device["bytes"] + size) / device["read_rate"])
+    path = device["paths"][device["turn"] % len(device["paths"])]
+    device["turn"] += 1
+    device["bytes"] += size
+    placement[name] = path
+    assigned[path].append(name)
+
+  # a pass takes as long as the slowest filesystem needs for its share
+  proving_seconds = max((device["bytes"] / device["read_rate"] for device in devices.values() if device["bytes"]), default=0)
+  total = sum(size for _, size in files)
+  sizes = dict(files)
+  return {
+    "disks": [dict(disk, files=sorted(assigned[disk["path"]], key=lambda name: int(name[9:-4])), bytes=sum(sizes[name] for name in assigned[disk["path"]])) for disk in disks],
+    "files": { name: placement[name] for name, _ in files },
+    "read_rate": total / proving_seconds if proving_seconds else 0,
+    "proving_seconds": proving_seconds,
+  }
+
+def preallocate(path, size):
+  # reserve size bytes for path so generation writes into contiguous extents. The file keeps its
+  # apparent size, because postcli and stage2 resume from (and treat full-size files as) finished files.
+  libc_name = ctypes.util.find_library("c")
+  libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+  if not libc or not hasattr(libc, "fallocate"):
+    return False
+  libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+  fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+  try:
+    return libc.fallocate(fd, falloc_fl_keep_size, 0, size) == 0
+  finally:
+    os.close(fd)
+
+def apply_layout(post_dir, layout, files, subdir, preallocate_files=True, log=print):
+  # symlink every postdata_N.bin of post_dir to its disk; files already generated in post_dir stay put
+  os.makedirs(post_dir, exist_ok=True)
+  preallocated = 0
+  for name, size in files:
+    link_path = f"{post_dir}/{name}"
+    target_dir = f"{layout['files'][name]}/{subdir}"
+    target_path = f"{target_dir}/{name}"
+    if os.path.isfile(link_path) and not os.path.islink(link_path):
+      log(f"  - {name} already exists in {post_dir}, leaving it there")
+      continue
+    if os.path.islink(link_path) and os.readlink(link_path) != target_path:
+      current_path = os.readlink(link_path)
+      if os.path.isfile(current_path) and os.path.getsize(current_path) > 0:
+        log(f"  - {name} already has data in {os.path.dirname(current_path)}, leaving it there")
+        layout["files"][name] = os.path.dirname(os.path.dirname(current_path))
+        continue
+      os.remove(link_path)
+    os.makedirs(target_dir, exist_ok=True)
+    if not os.path.islink(link_path):
+      os.symlink(target_path, link_path)
+    if preallocate_files and (not os.path.exists(target_path) or os.path.getsize(target_path) < size):
+      if preallocate(target_path, size):
+        preallocated += size
+  return preallocated
+
+def layout_summary(layout):
+  lines = []
+  for disk in layout["disks"]:
+    lines.append(f"  - {disk['path']}: {len(disk['files'])} files, {disk['bytes'] / 2 ** 30:.1f} GiB of {disk['free'] / 2 ** 30:.1f} GiB free, read {disk['read_rate'] / 2 ** 20:.0f} MiB/s, write {disk['write_rate'] / 2 ** 20:.0f} MiB/s")
+  lines.append(f"  - Aggregate read rate {layout['read_rate'] / 2 ** 20:.0f} MiB/s, one proving pass reads for {layout['proving_seconds'] / 60:.1f} min")
+  return lines
+
+def layout_disks(config):
+  return sorted(disk["path"] for disk in config.get("post_layout", {}).get("disks", []))
+
+def run_layout(config, post_dir, disk_paths, probe_size=256 << 20, preallocate_files=True, log=print):
+  # plan (or reuse the recorded plan for the same disks), apply it and store it in config["post_layout"]
+  files = post_files(config)
+  subdir = f"post-{config['node_id_first_8']}"
+  layout = config.get("post_layout")
+  if not layout or layout_disks(config) != sorted(os.path.abspath(path) for path in disk_paths):
+    disks = []
+    for path in disk_paths:
+      log(f"  - Probing {path}")
+      disks.append(probe_disk(path, probe_size))
+    layout = plan_layout(files, disks)
+    layout["subdir"] = subdir
+  preallocated = apply_layout(post_dir, layout, files, subdir, preallocate_files, log)
+  for line in layout_summary(layout):
+    log(line)
+  if preallocated:
+    log(f"  - Preallocated {preallocated / 2 ** 30:.1f} GiB")
+  config["post_layout"] = layout
+  return layout
+
+def main():
+  parser = argparse.ArgumentParser(description="Plan and apply a multi-disk PoST layout")
+  parser.add_argument("command", choices=["probe", "plan"])
+  parser.add_argument("disks", help="Candidate directories (probe)", nargs="*")
+  parser.add_argument("--disk", help="Candidate directory, one per disk (plan, repeatable)", action="append")
+  parser.add_argument("--data-dir", help="Directory for data files", default="data")
+  parser.add_argument("--post-dir", help="PoST directory (default: <data-dir>/stage1)")
+  parser.add_argument("--probe-size", help="Bytes written and read per disk probe", default="256M")
+  parser.add_argument("--apply", action="store_true", help="Create the symlinks, preallocate and record the layout in stage1.json")
+  parser.add_argument("--no-preallocate", action="store_true", help="Skip preallocation when applying")
+  args = parser.parse_args()
+  probe_size = parse_size(args.probe_size)
+
+  if args.command == "probe":
+    for path in args.disks:
+      disk = probe_disk(path, probe_size)
+      print(f"{disk['path']:32} free {disk['free'] / 2 ** 30:8.1f} GiB  write {disk['write_rate'] / 2 ** 20:7.0f} MiB/s  read {disk['read_rate'] / 2 ** 20:7.0f} MiB/s")
+    return
+
+  if not args.disk:
+    print("Error: plan needs at least one --disk")
+    sys.exit(1)
+  stage1_config_path = f"{args.data_dir}/stage1/stage1.json"
+  if not os.path.isfile(stage1_config_path):
+    print(f"Error: {stage1_config_path} does not exist, run stage 1 first.")
+    sys.exit(1)
+  with open(stage1_config_path, "r") as f:
+    config = json.load(f)
+  post_dir = args.post_dir or f"{args.data_dir}/stage1"
+
+  try:
+    if args.apply:
+      print(f"Applying PoST layout to {post_dir}")
+      run_layout(config, post_dir, args.disk, probe_size, not args.no_preallocate)
+      with open(stage1_config_path, "w") as f:
+        json.dump(config, f, indent=2)
+      return
+    layout = plan_layout(post_files(config), [probe_disk(path, probe_size) for path in args.disk])
+  except ValueError as e:
+    print(f"Error: {e}")
+    sys.exit(1)
+  for line in layout_summary(layout):
+    print(line)
+
+if __name__ == "__main__":
+  main()
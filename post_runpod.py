@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+#
+# Generate one identity's PoST on several RunPod pods at once, each pod
+# producing a contiguous range of postdata_N.bin files (a shard). Each pod's
+# files are pulled over its SSH endpoint into the local PoST directory while
+# the pod is still generating.
+#
+# Used by stage2.py --cloud runpod --pods N.
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import runpod
+
+from pod_tracker import pod_ssh_address
+from post_shards import file_complete, post_files, split_shards
+from post_transfer import SSHTransport, pull
+from stage3 import check_file_sizes
+
+pod_image = "ghcr.io/smeshcloud/nvidia-cuda-opencl"
+
+def shard_disk_size(files, shard):
+  # container disk in GB for the shard's files plus room for the generator
+  shard_bytes = sum(size for _, size in files[shard["from_file"]:shard["to_file"] + 1])
+  return math.ceil(shard_bytes / 1_000_000_000) + 10
+
+def shard_docker_args(generate_post_url, config, disk_size):
+  # generate-post.sh <PoST size in GB> <node id>, sized for the shard; everything else comes from shard_env
+  return f"bash -c 'wget -O- {generate_post_url} | bash -s {disk_size} {config['node_id']}'"
+
+def shard_env(config, shard):
+  # the identity's PoST parameters and the shard's file range, which generate-post.sh reads from the environment
+  return {
+    "NODE_ID": config["node_id"],
+    "COMMITMENT_ATX_ID": config["commitment_atx_id"],
+    "NUM_UNITS": str(config["num_units"]),
+    "LABELS_PER_UNIT": str(config["labels_per_unit"]),
+    "MAX_FILE_SIZE": str(config["max_file_size"]),
+    "FROM_FILE": str(shard["from_file"]),
+    "TO_FILE": str(shard["to_file"]),
+  }
+
+def create_shard_pod(generate_post_url, config, shard, gpu, disk_size, retry_interval=15, max_tries=20, log=print):
+  tries = 0
+  while tries < max_tries:
+    tries += 1
+    try:
+      pod = runpod.create_pod(
+        name=f"smesher {config['node_id_first_8']} shard {shard['id']}",
+        image_name=pod_image,
+        gpu_type_id=gpu['id'],
+        gpu_count=gpu['quantity'],
+        container_disk_in_gb=disk_size,
+        docker_args=shard_docker_args(generate_post_url, config, disk_size),
+        env=shard_env(config, shard),
+      )
+    except Exception as e:
+      log(f"S2.4   - Shard {shard['id']}: create_pod failed ({e})")
+      pod = None
+    if pod:
+      return pod
+    time.sleep(retry_interval)
+  return None
+
+def pod_state(pod_id):
+  # "running" while the pod is alive, "lost" when it was preempted, stopped or removed
+  try:
+    pod = runpod.get_pod(pod_id)
+  except Exception:
+    return "unknown"
+  if not pod or pod.get("desiredStatus") in ("EXITED", "TERMINATED"):
+    return "lost"
+  return "running"
+
+def terminate_shard_pod(shard, log=print):
+  # a failed terminate must not stop the other shards; the pod is logged so it can be released by hand
+  try:
+    runpod.terminate_pod(shard["pod_id"])
+  except Exception as e:
+    log(f"S2.5   - Shard {shard['id']}: could not terminate pod {shard['pod_id']} ({e}), release it manually")
+    return False
+  return True
+
+def shard_complete(post_dir, files, shard):
+  return all(file_complete(post_dir, name, size) for name, size in files[shard["from_file"]:shard["to_file"] + 1])
+
+def load_shards(stage2_config_path, config, num_pods, files):
+  # reuse the shard table of an interrupted run for the same identity
+  if os.path.isfile(stage2_config_path):
+    with open(stage2_config_path, "r") as f:
+      state = json.load(f)
+    if state.get("mode") == "runpod-shards" and state.get("node_id") == config["node_id"] and state.get("commitment_atx_id") == config["commitment_atx_id"]:
+      # a rerun gives failed shards a fresh set of attempts
+      for shard in state["shards"]:
+        if shard["status"] == "failed":
+          shard.update({ "status": "pending", "pod_id": None, "attempts": 0 })
+      return state["shards"]
+  shards = split_shards(len(files), num_pods)
+  for shard in shards:
+    shard.update({ "status": "pending", "pod_id": None, "pod_host_id": None, "attempts": 0 })
+  return shards
+
+def save_shards(stage2_config_path, config, gpu, shards):
+  state = {
+    "mode": "runpod-shards",
+    "node_id": config["node_id"],
+    "commitment_atx_id": config["commitment_atx_id"],
+    "gpu": gpu,
+    "shards": shards,
+  }
+  tmp_path = f"{stage2_config_path}.tmp"
+  with open(tmp_path, "w") as f:
+    json.dump(state, f, indent=2)
+  os.replace(tmp_path, stage2_config_path)
+
+def launch_shard(generate_post_url, config, files, shard, gpu, log=print):
+  disk_size = shard_disk_size(files, shard)
+  pod = create_shard_pod(generate_post_url, config, shard, gpu, disk_size, log=log)
+  shard["attempts"] += 1
+  if not pod:
+    log(f"S2.4   - Shard {shard['id']}: no pod after repeated create_pod attempts")
+    return shard
+  shard["pod_id"] = pod["id"]
+  shard["pod_host_id"] = pod.get("machine", {}).get("podHostId")
+  shard["disk_size"] = disk_size
+  shard["status"] = "running"
+  log(f"S2.4   - Shard {shard['id']} (files {shard['from_file']}-{shard['to_file']}) running on pod {pod['id']}")
+  return shard
+
+def start_transfer(shard, files, post_dir, ssh_key, remote_dir, streams, transfer_timeout, log=print):
+  # pull the shard's files from its pod in the background; returns None until the pod exposes SSH
+  try:
+    address = pod_ssh_address(runpod.get_pod(shard["pod_id"]))
+  except Exception:
+    address = None
+  if not address:
+    return None
+  ip, port = address
+  transport = SSHTransport("root", ip, remote_dir, ssh_key, port)
+  # pods are fresh hosts, their keys cannot be known in advance
+  transport.ssh += ["-o", "StrictHostKeyChecking=accept-new"]
+  names = set(name for name, _ in files[shard["from_file"]:shard["to_file"] + 1])
+  transfer = { "pod_id": shard["pod_id"], "error": None, "stop": threading.Event(), "transport": transport }
+
+  def run():
+    try:
+      pull(transport, post_dir, streams, timeout=transfer_timeout, names=names, state_file=f".transfer-shard-{shard['id']}.json", stop=transfer["stop"], log=log)
+    except Exception as e:
+      transfer["error"] = e
+      if not transfer["stop"].is_set():
+        log(f"S2.7   - Shard {shard['id']}: transfer from pod {transfer['pod_id']} stopped ({e})")
+    finally:
+      transport.close()
+
+  transfer["thread"] = threading.Thread(target=run, daemon=True)
+  transfer["thread"].start()
+  log(f"S2.7   - Shard {shard['id']}: pulling files from pod {shard['pod_id']} ({ip}:{port})")
+  return transfer
+
+def stop_transfer(transfer, timeout=60):
+  # end a shard's pull before another one writes the same files; closing the connection cuts off running fetches
+  transfer["stop"].set()
+  transfer["transport"].close()
+  transfer["thread"].join(timeout)
+
+def run_runpod_shards(generate_post_url, config, gpu, num_pods, post_dir, stage2_config_path, ssh_key=None, remote_dir="/workspace/post", streams=2, transfer_timeout=4 * 3600, deadline=None, poll_interval=30, max_attempts=5, log=print):
+  # Returns the shard table once every shard's files are present in post_dir, a shard ran out of attempts
+  # or `deadline` seconds passed (unfinished shards are then failed and their pods terminated)
+  files = post_files(config)
+  shards = load_shards(stage2_config_path, config, num_pods, files)
+  transfers = {}
+  started = time.monotonic()
+  log(f"S2.4 Cloud(RunPod) - {len(files)} files in {len(shards)} shards")
+
+  while True:
+    for shard in shards:
+      if shard["status"] != "complete" and shard_complete(post_dir, files, shard):
+        shard["status"] = "complete"
+        log(f"S2.5   - Shard {shard['id']} complete")
+        if shard["pod_id"]:
+          terminate_shard_pod(shard, log)
+      elif shard["status"] == "running" and pod_state(shard["pod_id"]) == "lost":
+        log(f"S2.5   - Shard {shard['id']}: pod {shard['pod_id']} was lost, reassigning")
+        # a stopped pod still bills for its disk, and its pull must end before the next pod's starts
+        terminate_shard_pod(shard, log)
+        if shard["id"] in transfers:
+          stop_transfer(transfers.pop(shard["id"]))
+        shard["status"] = "pending"
+        shard["pod_id"] = None
+      elif shard["status"] == "running":
+        transfer = transfers.get(shard["id"])
+        # (re)start the pull when the shard has no transfer yet, moved to a new pod or the last pull gave up
+        if not transfer or transfer["pod_id"] != shard["pod_id"] or not transfer["thread"].is_alive():
+          if transfer:
+            stop_transfer(transfer)
+          transfer = start_transfer(shard, files, post_dir, ssh_key, remote_dir, streams, transfer_timeout, log)
+          if transfer:
+            transfers[shard["id"]] = transfer
+
+    if deadline is not None and time.monotonic() - started > deadline:
+      for shard in shards:
+        if shard["status"] in ("pending", "running"):
+          if shard["pod_id"]:
+            terminate_shard_pod(shard, log)
+          if shard["id"] in transfers:
+            stop_transfer(transfers.pop(shard["id"]))
+          shard["status"] = "failed"
+          log(f"S2.5   - Shard {shard['id']} failed, not finished within {deadline / 3600:.1f}h")
+      save_shards(stage2_config_path, config, gpu, shards)
+      return shards
+
+    pending = [shard for shard in shards if shard["status"] == "pending"]
+    exhausted = [shard for shard in pending if shard["attempts"] >= max_attempts]
+    if exhausted:
+      for shard in exhausted:
+        shard["status"] = "failed"
+        log(f"S2.5   - Shard {shard['id']} failed after {shard['attempts']} pods")
+      pending = [shard for shard in pending if shard["status"] == "pending"]
+    if pending:
+      # pods are requested concurrently so one slow create_pod does not hold up the others
+      with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+        list(executor.map(lambda shard: launch_shard(generate_post_url, config, files, shard, gpu, log), pending))
+    save_shards(stage2_config_path, config, gpu, shards)
+
+    if all(shard["status"] in ("complete", "failed") for shard in shards):
+      return shards
+    time.sleep(poll_interval)
+
+def check_joined_post(post_dir, config):
+  # the shards must join into one directory matching the identity in stage1.json
+  problems = check_file_sizes(post_dir, post_files(config))
+  metadata_path = f"{post_dir}/postdata_metadata.json"
+  if not os.path.isfile(metadata_path):
+    problems.append("postdata_metadata.json is missing")
+  else:
+    with open(metadata_path, "r") as f:
+      metadata = json.load(f)
+    for key, config_key in [("NumUnits", "num_units"), ("LabelsPerUnit", "labels_per_unit"), ("MaxFileSize", "max_file_size")]:
+      if int(metadata.get(key, -1)) != int(config[config_key]):
+        problems.append(f"postdata_metadata.json {key} is {metadata.get(key)}, expected {config[config_key]}")
+  return problems
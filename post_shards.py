@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Split a PoST identity into postdata_N.bin file ranges (shards) and run a
+# generator process per device/CPU slot, restarting failed shards from their
+# first incomplete file.
+#
+# Used by stage2.py --local.
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import os
+import shlex
+import subprocess
+import time
+
+from stage3 import expected_files
+
+default_generator = "postcli -provider {provider} -commitmentAtxId {commitment_atx_id} -id {node_id} -labelsPerUnit {labels_per_unit} -maxFileSize {max_file_size} -numUnits {num_units} -datadir {post_dir} -fromFile {from_file} -toFile {to_file} -yes"
+
+def post_files(config):
+  # [(name, size)] for every postdata_N.bin of the identity in stage1.json
+  return expected_files({
+    "NumUnits": int(config["num_units"]),
+    "LabelsPerUnit": int(config["labels_per_unit"]),
+    "MaxFileSize": int(config["max_file_size"]),
+  })
+
+def split_shards(num_files, num_shards):
+  # contiguous, inclusive file index ranges of near-equal length
+  num_shards = max(1, min(num_shards, num_files))
+  base, extra = divmod(num_files, num_shards)
+  shards = []
+  start = 0
+  for index in range(num_shards):
+    length = base + (1 if index < extra else 0)
+    shards.append({ "id": index, "from_file": start, "to_file": start + length - 1 })
+    start += length
+  return shards
+
+def file_complete(post_dir, name, size):
+  path = f"{post_dir}/{name}"
+  return os.path.isfile(path) and os.path.getsize(path) == size
+
+def shard_progress(post_dir, files, shard):
+  # bytes written and completed file count within the shard's range
+  written = 0
+  complete = 0
+  for index in range(shard["from_file"], shard["to_file"] + 1):
+    name, size = files[index]
+    path = f"{post_dir}/{name}"
+    if os.path.isfile(path):
+      written += min(os.path.getsize(path), size)
+      if os.path.getsize(path) == size:
+        complete += 1
+  total = sum(size for _, size in files[shard["from_file"]:shard["to_file"] + 1])
+  return written, total, complete
+
+def first_incomplete_file(post_dir, files, shard):
+  for index in range(shard["from_file"], shard["to_file"] + 1):
+    name, size = files[index]
+    if not file_complete(post_dir, name, size):
+      return index
+  return None
+
+def generator_command(template, config, post_dir, provider, from_file, to_file):
+  return shlex.split(template.format(
+    provider=provider,
+    node_id=config["node_id"],
+    commitment_atx_id=config["commitment_atx_id"],
+    labels_per_unit=config["labels_per_unit"],
+    max_file_size=config["max_file_size"],
+    num_units=config["num_units"],
+    post_dir=post_dir,
+    from_file=from_file,
+    to_file=to_file,
+  ))
+
+def run_local_shards(config, post_dir, providers, generator=default_generator, num_shards=None, retries=3, poll_interval=1.0, progress_interval=10.0, on_update=None, log=print):
+  # Run shards on the given provider slots; returns the final shard list (each with a "status")
+  files = post_files(config)
+  shards = split_shards(len(files), num_shards or len(providers))
+  os.makedirs(post_dir, exist_ok=True)
+
+  queue = []
+  for shard in shards:
+    shard["attempts"] = 0
+    if first_incomplete_file(post_dir, files, shard) is None:
+      shard["status"] = "complete"
+    else:
+      shard["status"] = "pending"
+      queue.append(shard)
+  log(f"S2.2 Local Execution - {len(files)} files in {len(shards)} shards, {len(queue)} to generate on {len(providers)} slots")
+
+  slots = { slot: None for slot in range(len(providers)) }
+  started = time.monotonic()
+  start_bytes = sum(shard_progress(post_dir, files, shard)[0] for shard in shards)
+  last_progress = started
+  try:
+    while queue or any(slots.values()):
+      for slot, running in slots.items():
+        if running:
+          shard, process = running
+          code = process.poll()
+          if code is None:
+            continue
+          slots[slot] = None
+          if first_incomplete_file(post_dir, files, shard) is None:
+            shard["status"] = "complete"
+            log(f"S2.3   - Shard {shard['id']} (files {shard['from_file']}-{shard['to_file']}) complete")
+          elif shard["attempts"] > retries:
+            shard["status"] = "failed"
+            log(f"S2.3   - Shard {shard['id']} failed with exit code {code}, giving up after {shard['attempts']} attempts")
+          else:
+            shard["status"] = "pending"
+            queue.append(shard)
+            log(f"S2.3   - Shard {shard['id']} exited with code {code}, requeued")
+          if on_update:
+            on_update(shards)
+
+        if slots[slot] is None and queue:
+          shard = queue.pop(0)
+          # completed files of a retried shard are not generated again
+          from_file = first_incomplete_file(post_dir, files, shard)
+          command = generator_command(generator, config, post_dir, providers[slot], from_file, shard["to_file"])
+          shard["attempts"] += 1
+          shard["provider"] = providers[slot]
+          try:
+            process = subprocess.Popen(command)
+          except OSError as e:
+            # a generator that cannot be started counts as a failed attempt
+            if shard["attempts"] > retries:
+              shard["status"] = "failed"
+              log(f"S2.3   - Shard {shard['id']} could not start the generator ({e}), giving up after {shard['attempts']} attempts")
+            else:
+              shard["status"] = "pending"
+              queue.append(shard)
+              log(f"S2.3   - Shard {shard['id']} could not start the generator ({e}), requeued")
+            if on_update:
+              on_update(shards)
+            continue
+          shard["status"] = "running"
+          slots[slot] = (shard, process)
+          log(f"S2.3   - Shard {shard['id']} (files {from_file}-{shard['to_file']}) started on provider {providers[slot]}")
+          if on_update:
+            on_update(shards)
+
+      now = time.monotonic()
+      if now - last_progress >= progress_interval:
+        last_progress = now
+        written = 0
+        total = 0
+        for shard in shards:
+          shard_written, shard_total, shard_complete = shard_progress(post_dir, files, shard)
+          written += shard_written
+          total += shard_total
+          if shard["status"] == "running":
+            log(f"S2.3   - Shard {shard['id']}: {shard_complete}/{shard['to_file'] - shard['from_file'] + 1} files, {shard_written / shard_total:.1%}")
+        rate = (written - start_bytes) / (now - started)
+        eta = f", ETA {(total - written) / rate / 60:.0f} min" if rate > 0 else ""
+        log(f"S2.3 Progress {written / total:.1%} ({rate / 1024 ** 2:.1f} MiB/s{eta})")
+      time.sleep(poll_interval)
+
+  finally:
+    # an interrupted run must not leave generators writing into post_dir
+    processes = [running[1] for running in slots.values() if running and running[1].poll() is None]
+    for process in processes:
+      process.terminate()
+    for process in processes:
+      try:
+        process.wait(10)
+      except subprocess.TimeoutExpired:
+        process.kill()
+
+  return shards
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#
+# Generate one identity's PoST on a pool of machines reachable over SSH.
+#
+# Every host in the inventory runs as many generators as its capacity allows.
+# Each generator slot takes the next shard (a small range of postdata_N.bin
+# files) from a queue shared by all hosts, so faster hosts end up with more
+# shards. Finished shards are pulled into the local PoST directory over the
+# host's multiplexed SSH connection, generator output is streamed back as it
+# arrives and a shard that fails is requeued for any host. The transport is
+# pluggable: LocalExecTransport runs the same scheduler on this machine.
+#
+# Used by stage2.py --ssh.
+#
+# Inventory file, one host per line:
+#
+#   user@host[:port] [capacity] [provider,provider,...]
+#   local[:dir] [capacity] [provider,provider,...]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import os
+import shlex
+import subprocess
+import threading
+import time
+from collections import deque
+
+from post_shards import default_generator, file_complete, first_incomplete_file, generator_command, post_files, split_shards
+from post_transfer import LocalTransport, SSHTransport
+
+# ssh exits with 255 when the connection itself failed
+ssh_connection_error = 255
+
+class LocalExecTransport(LocalTransport):
+  # runs generators on this machine in work_dir; stands in for a remote host
+  def __init__(self, work_dir, name="local"):
+    super().__init__(work_dir)
+    self.name = name
+
+  def connect(self):
+    os.makedirs(self.source_dir, exist_ok=True)
+    return True
+
+  def start(self, command):
+    return subprocess.Popen(["bash", "-c", command], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace")
+
+  def remove(self, names):
+    for name in names:
+      path = f"{self.source_dir}/{name}"
+      if os.path.exists(path):
+        os.remove(path)
+
+class SSHExecTransport(SSHTransport):
+  # runs generators on user@host in work_dir (relative to the remote home) over one multiplexed connection
+  def __init__(self, user, host, work_dir, ssh_key=None, port=22):
+    super().__init__(user, host, work_dir, ssh_key, port)
+    self.name = self.target if port == 22 else f"{self.target}:{port}"
+
+  def connect(self):
+    # opens the master connection that every later command reuses
+    return self.run(f"mkdir -p {shlex.quote(self.source_dir)}").returncode == 0
+
+  def start(self, command):
+    return subprocess.Popen(self.ssh + [self.target, command], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace")
+
+  def remove(self, names):
+    if names:
+      self.run(f"cd {shlex.quote(self.source_dir)} && rm -f {' '.join(shlex.quote(name) for name in names)}")
+
+def parse_host(spec):
+  # "user@host[:port]" -> (user, host, port)
+  user, host = spec.split("@", 1) if "@" in spec else (None, spec)
+  port = 22
+  if ":" in host:
+    host, port = host.rsplit(":", 1)
+    port = int(port)
+  return user, host, port
+
+def load_inventory(path):
+  # [(spec, capacity, providers)] from an inventory file
+  inventory = []
+  with open(path, "r") as f:
+    for line in f:
+      fields = line.split("#", 1)[0].split()
+      if not fields:
+        continue
+      capacity = int(fields[1]) if len(fields) > 1 else 1
+      providers = fields[2].split(",") if len(fields) > 2 else ["0"] * capacity
+      inventory.append((fields[0], capacity, providers))
+  return inventory
+
+def build_hosts(inventory, work_dir, ssh_key=None):
+  hosts = []
+  for spec, capacity, providers in inventory:
+    if spec == "local" or spec.startswith("local:"):
+      transport = LocalExecTransport(spec[6:] or work_dir, spec)
+    else:
+      user, host, port = parse_host(spec)
+      transport = SSHExecTransport(user, host, work_dir, ssh_key, port)
+    hosts.append({ "name": transport.name, "transport": transport, "capacity": capacity, "providers": (providers * capacity)[:capacity] })
+  return hosts
+
+def fetch_shard(transport, post_dir, files, from_file, to_file):
+  # pull the shard's files that are not complete locally, resuming partial ones
+  for index in range(from_file, to_file + 1):
+    name, size = files[index]
+    path = f"{post_dir}/{name}"
+    if file_complete(post_dir, name, size):
+      continue
+    if os.path.isfile(path) and os.path.getsize(path) > size:
+      os.truncate(path, 0)
+    with open(path, "ab") as dest:
+      transport.fetch(name, dest.tell(), dest)
+
+def run_ssh_shards(config, post_dir, hosts, generator=default_generator, num_shards=None, retries=3, max_host_failures=2, keep_remote=False, poll_interval=1.0, progress_interval=30.0, on_update=None, log=print):
+  # Run shards on every host slot until the queue is empty; returns the final shard list (each with a "status")
+  files = post_files(config)
+  # generator output arrives from many threads at once, keep whole lines together
+  print_lock = threading.Lock()
+  unlocked_log = log
+
+  def log(line):
+    with print_lock:
+      unlocked_log(line)
+
+  slots = [(host, provider) for host in hosts for provider in host["providers"]]
+  # several shards per slot so a fast host can take over work a slow one would otherwise hold
+  shards = split_shards(len(files), num_shards or len(slots) * 4)
+  os.makedirs(post_dir, exist_ok=True)
+
+  queue = deque()
+  for shard in shards:
+    shard["attempts"] = 0
+    if first_incomplete_file(post_dir, files, shard) is None:
+      shard["status"] = "complete"
+    else:
+      shard["status"] = "pending"
+      queue.append(shard)
+  lock = threading.Lock()
+
+  for host in hosts:
+    host["failures"] = 0
+    host["completed"] = 0
+    host["running"] = []
+    host["alive"] = host["transport"].connect()
+    if not host["alive"]:
+      log(f"S2.2   - {host['name']} is unreachable, skipping it")
+  log(f"S2.2 Remote Execution - {len(files)} files in {len(shards)} shards, {len(queue)} to generate on {sum(host['capacity'] for host in hosts if host['alive'])} slots across {sum(1 for host in hosts if host['alive'])} hosts")
+
+  def updated():
+    if on_update:
+      with lock:
+        on_update(shards)
+
+  def run_shard(host, provider, shard):
+    transport = host["transport"]
+    from_file = first_incomplete_file(post_dir, files, shard)
+    command = generator_command(generator, config, transport.source_dir, provider, from_file, shard["to_file"])
+    log(f"S2.3   - Shard {shard['id']} (files {from_file}-{shard['to_file']}) started on {host['name']} provider {provider}")
+    process = transport.start(f"mkdir -p {shlex.quote(transport.source_dir)} && {shlex.join(command)}")
+    for line in process.stdout:
+      if line.strip():
+        log(f"S2.3   [{host['name']}] {line.rstrip()}")
+    code = process.wait()
+    if code == 0:
+      try:
+        fetch_shard(transport, post_dir, files, from_file, shard["to_file"])
+      except OSError as e:
+        log(f"S2.3   - Shard {shard['id']} could not be fetched from {host['name']}: {e}")
+      same_dir = isinstance(transport, LocalExecTransport) and os.path.realpath(transport.source_dir) == os.path.realpath(post_dir)
+      if not keep_remote and not same_dir and first_incomplete_file(post_dir, files, shard) is None:
+        transport.remove([name for name, _ in files[from_file:shard["to_file"] + 1]])
+    return code
+
+  def worker(host, provider):
+    while True:
+      with lock:
+        if not host["alive"] or not queue:
+          return
+        shard = queue.popleft()
+        shard["attempts"] += 1
+        shard["status"] = "running"
+        shard["host"] = host["name"]
+        shard["provider"] = provider
+        host["running"].append(shard)
+      updated()
+      code = run_shard(host, provider, shard)
+      with lock:
+        host["running"].remove(shard)
+        if first_incomplete_file(post_dir, files, shard) is None:
+          shard["status"] = "complete"
+          host["completed"] += 1
+          host["failures"] = 0
+          log(f"S2.3   - Shard {shard['id']} (files {shard['from_file']}-{shard['to_file']}) complete from {host['name']}")
+        else:
+          host["failures"] += 1
+          if code == ssh_connection_error or host["failures"] >= max_host_failures:
+            host["alive"] = False
+            log(f"S2.3   - {host['name']} failed {host['failures']} times in a row, no more shards for it")
+          if shard["attempts"] > retries:
+            shard["status"] = "failed"
+            log(f"S2.3   - Shard {shard['id']} failed with exit code {code} on {host['name']}, giving up after {shard['attempts']} attempts")
+          else:
+            shard["status"] = "pending"
+            queue.append(shard)
+            log(f"S2.3   - Shard {shard['id']} exited with code {code} on {host['name']}, requeued")
+      updated()
+
+  threads = [threading.Thread(target=worker, args=(host, provider), daemon=True) for host, provider in slots if host["alive"]]
+  for thread in threads:
+    thread.start()
+
+  started = time.monotonic()
+  start_bytes = sum(size for name, size in files if file_complete(post_dir, name, size))
+  last_progress = started
+  while any(thread.is_alive() for thread in threads):
+    time.sleep(poll_interval)
+    now = time.monotonic()
+    if now - last_progress < progress_interval:
+      continue
+    last_progress = now
+    done = sum(size for name, size in files if file_complete(post_dir, name, size))
+    in_flight = 0
+    for host in hosts:
+      with lock:
+        running = list(host["running"])
+      if not running:
+        continue
+      remote = host["transport"].sizes()
+      names = [name for shard in running for name, _ in files[shard["from_file"]:shard["to_file"] + 1]]
+      written = sum(remote.get(name, 0) for name in names)
+      in_flight += written
+      log(f"S2.3   - {host['name']}: {host['completed']} shards done, {len(running)} running, {written / 2 ** 30:.1f} GiB written")
+    total = sum(size for _, size in files)
+    rate = (done + in_flight - start_bytes) / (now - started)
+    eta = f", ETA {(total - done - in_flight) / rate / 60:.0f} min" if rate > 0 else ""
+    log(f"S2.3 Progress {(done + in_flight) / total:.1%} ({rate / 1024 ** 2:.1f} MiB/s{eta})")
+
+  for host in hosts:
+    host["transport"].close()
+  return shards
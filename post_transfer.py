@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+#
+# Move generated PoST files from the machine that produced them to the machine
+# that will smesh.
+#
+# The producer keeps a postdata_manifest.json with the size and sha256 of every
+# finished file. The consumer pulls manifest entries over several parallel
+# streams, resumes partial files at their current byte offset and verifies each
+# file against the manifest, so finished files move while later ones are still
+# being generated. Producers that do not run the manifest writer (pods, SSH
+# hosts) are pulled by size alone: a file is taken once it has the size
+# postdata_metadata.json gives it and the generator has moved on to the next
+# file, and is fetched again if it changed meanwhile. The pull gives up when no
+# new file arrived for the idle timeout.
+#
+# Usage:
+#
+#   post_transfer.py manifest <post dir> [--watch]
+#   post_transfer.py pull --source <dir | user@host:dir> --dest <dir> [--ssh-key KEY] [--streams N] [--timeout SECONDS]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from stage3 import expected_files, load_metadata
+
+manifest_name = "postdata_manifest.json"
+state_name = ".transfer.json"
+chunk_size = 4 << 20
+
+def file_sha256(path):
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    while True:
+      chunk = f.read(chunk_size)
+      if not chunk:
+        return digest
+      digest.update(chunk)
+
+# Producer side
+
+def update_manifest(post_dir):
+  # add every finished postdata_N.bin that is not in the manifest yet; returns (manifest, all files done)
+  manifest_path = f"{post_dir}/{manifest_name}"
+  manifest = {}
+  if os.path.isfile(manifest_path):
+    with open(manifest_path, "r") as f:
+      manifest = json.load(f)
+  files = expected_files(load_metadata(post_dir))
+  changed = False
+  for index, (name, size) in enumerate(files):
+    path = f"{post_dir}/{name}"
+    if name in manifest or not os.path.isfile(path) or os.path.getsize(path) != size:
+      continue
+    # a full-size file is only final once the generator has moved on to the next one
+    next_path = f"{post_dir}/{files[index + 1][0]}" if index + 1 < len(files) else None
+    if next_path and not os.path.exists(next_path):
+      continue
+    manifest[name] = { "size": size, "sha256": file_sha256(path).hexdigest() }
+    changed = True
+  if changed:
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+      json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+  return manifest, len(manifest) == len(files)
+
+# Transports
+
+class LocalTransport:
+  def __init__(self, source_dir):
+    self.source_dir = source_dir
+
+  def read_file(self, name):
+    path = f"{self.source_dir}/{name}"
+    if not os.path.isfile(path):
+      return None
+    with open(path, "rb") as f:
+      return f.read()
+
+  def stats(self):
+    # {name: (size, mtime)} of the postdata files
+    if not os.path.isdir(self.source_dir):
+      return {}
+    stats = {}
+    for name in os.listdir(self.source_dir):
+      if name.startswith("postdata_") and name.endswith(".bin"):
+        stat = os.stat(f"{self.source_dir}/{name}")
+        stats[name] = (stat.st_size, stat.st_mtime)
+    return stats
+
+  def sizes(self):
+    return { name: size for name, (size, _) in self.stats().items() }
+
+  def fetch(self, name, offset, dest):
+    with open(f"{self.source_dir}/{name}", "rb") as f:
+      f.seek(offset)
+      while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+          return
+        dest.write(chunk)
+
+  def close(self):
+    pass
+
+class SSHTransport:
+  def __init__(self, user, host, source_dir, ssh_key=None, port=22):
+    self.target = f"{user}@{host}" if user else host
+    self.source_dir = source_dir
+    # one multiplexed connection shared by all streams
+    self.ssh = ["ssh", "-p", str(port), "-o", "BatchMode=yes", "-o", "ControlMaster=auto", "-o", "ControlPath=/tmp/auto-spacemesh-%r@%h:%p", "-o", "ControlPersist=120"]
+    if ssh_key:
+      self.ssh += ["-i", ssh_key]
+
+  def run(self, command, stdout=subprocess.PIPE):
+    return subprocess.run(self.ssh + [self.target, command], stdout=stdout, stderr=subprocess.PIPE)
+
+  def read_file(self, name):
+    result = self.run(f"cat {shlex.quote(self.source_dir + '/' + name)}")
+    return result.stdout if result.returncode == 0 else None
+
+  def stats(self):
+    result = self.run(f"cd {shlex.quote(self.source_dir)} 2>/dev/null && stat -c '%n %s %Y' postdata_*.bin 2>/dev/null")
+    stats = {}
+    for line in result.stdout.decode("utf-8", "replace").splitlines():
+      fields = line.rsplit(" ", 2)
+      if len(fields) == 3 and fields[1].isdigit() and fields[2].isdigit():
+        stats[fields[0]] = (int(fields[1]), int(fields[2]))
+    return stats
+
+  def sizes(self):
+    return { name: size for name, (size, _) in self.stats().items() }
+
+  def fetch(self, name, offset, dest):
+    path = shlex.quote(f"{self.source_dir}/{name}")
+    result = self.run(f"tail -c +{offset + 1} {path}", stdout=dest)
+    if result.returncode != 0:
+      raise OSError(f"ssh fetch of {name} failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+
+  def close(self):
+    subprocess.run(self.ssh + ["-O", "exit", self.target], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def transport_from_source(source, ssh_key=None):
+  # "user@host:dir" or "host:dir" is SSH, anything else a local directory
+  if ":" in source and not os.path.exists(source):
+    target, source_dir = source.split(":", 1)
+    user, host = target.split("@", 1) if "@" in target else (None, target)
+    return SSHTransport(user, host, source_dir, ssh_key)
+  return LocalTransport(source)
+
+# Consumer side
+
+def load_state(dest_dir, name=state_name):
+  path = f"{dest_dir}/{name}"
+  if os.path.isfile(path):
+    with open(path, "r") as f:
+      return json.load(f)
+  return {}
+
+def save_state(dest_dir, state, name=state_name):
+  path = f"{dest_dir}/{name}"
+  with open(f"{path}.tmp", "w") as f:
+    json.dump(state, f, indent=2)
+  os.replace(f"{path}.tmp", path)
+
+def pull_file(transport, dest_dir, name, entry, retries=3, log=print):
+  path = f"{dest_dir}/{name}"
+  for attempt in range(retries + 1):
+    offset = os.path.getsize(path) if os.path.isfile(path) else 0
+    if offset > entry["size"]:
+      os.remove(path)
+      offset = 0
+    if offset < entry["size"]:
+      with open(path, "ab") as dest:
+        transport.fetch(name, offset, dest)
+    # entries without a checksum come from a producer that has no manifest, their size is all there is to check
+    if os.path.getsize(path) == entry["size"] and (entry["sha256"] is None or file_sha256(path).hexdigest() == entry["sha256"]):
+      return entry["size"] - offset
+    log(f"S2.7   - {name} failed verification (attempt {attempt + 1}), fetching again")
+    os.remove(path)
+  raise OSError(f"{name} failed checksum verification after {retries + 1} attempts")
+
+def size_manifest(stats, files, previous=None):
+  # manifest entries (without checksum) for the finished files of a producer without a manifest, from its
+  # {name: (size, mtime)}. As in update_manifest a full-size file is only final once the generator has moved
+  # on to the next file; the last one once every other file is full size and it did not change since `previous`.
+  manifest = {}
+  for index, (name, size) in enumerate(files):
+    stat = stats.get(name)
+    if not stat or stat[0] != size:
+      continue
+    if index + 1 < len(files):
+      if files[index + 1][0] not in stats:
+        continue
+    elif not previous or previous.get(name) != stat or any(stats.get(other, (None,))[0] != other_size for other, other_size in files[:-1]):
+      continue
+    manifest[name] = { "size": size, "sha256": None, "mtime": stat[1] }
+  return manifest
+
+def pull(transport, dest_dir, streams=4, poll_interval=30, timeout=None, names=None, state_file=state_name, stop=None, log=print):
+  # Pull until every file is verified locally; raises TimeoutError when nothing new arrived for `timeout` seconds.
+  # `names` limits the pull to a subset of the files (a shard), with its own `state_file` so shards can share dest_dir.
+  # Setting the `stop` event ends the pull early, returning the files verified so far.
+  os.makedirs(dest_dir, exist_ok=True)
+  state = load_state(dest_dir, state_file)
+  state_lock = threading.Lock()
+  metadata = None
+  files = None
+  total_files = None
+  transferred = 0
+  previous_stats = None
+  started = time.monotonic()
+  last_file = started
+
+  with ThreadPoolExecutor(max_workers=streams) as executor:
+    while True:
+      if stop is not None and stop.is_set():
+        return state
+      if metadata is None:
+        data = transport.read_file("postdata_metadata.json")
+        if data:
+          metadata = json.loads(data)
+          files = [(name, size) for name, size in expected_files(metadata) if names is None or name in names]
+          total_files = len(files)
+          with open(f"{dest_dir}/postdata_metadata.json", "wb") as f:
+            f.write(data)
+      manifest_data = transport.read_file(manifest_name)
+      if manifest_data:
+        manifest = json.loads(manifest_data)
+      else:
+        stats = transport.stats()
+        manifest = size_manifest(stats, files, previous_stats) if files else {}
+        previous_stats = stats
+
+      pending = {}
+      for name, entry in manifest.items():
+        if names is not None and name not in names:
+          continue
+        verified = state.get(name)
+        if verified and verified["sha256"] == entry["sha256"] and os.path.isfile(f"{dest_dir}/{name}") and os.path.getsize(f"{dest_dir}/{name}") == entry["size"]:
+          continue
+        pending[executor.submit(pull_file, transport, dest_dir, name, entry, log=log)] = (name, entry)
+
+      for future in as_completed(pending):
+        name, entry = pending[future]
+        transferred += future.result()
+        # a size-only file that changed while it was fetched was not final after all, it is fetched again later
+        if entry["sha256"] is None and transport.stats().get(name) != (entry["size"], entry["mtime"]):
+          log(f"S2.7   - {name} changed on the source while it was fetched, fetching again")
+          os.remove(f"{dest_dir}/{name}")
+          continue
+        last_file = time.monotonic()
+        with state_lock:
+          state[name] = entry
+          save_state(dest_dir, state, state_file)
+        elapsed = time.monotonic() - started
+        log(f"S2.7   - {name} verified ({len(state)}/{total_files or '?'} files, {transferred / elapsed / 1024 ** 2:.1f} MiB/s)")
+
+      if total_files is not None and len(state) >= total_files:
+        if names is not None:
+          return state
+        with open(f"{dest_dir}/{manifest_name}", "w") as f:
+          json.dump(manifest, f, indent=2)
+        return state
+      if timeout is not None and time.monotonic() - last_file > timeout:
+        raise TimeoutError(f"No new PoST file from the source for {timeout:.0f}s ({len(state)}/{total_files or '?'} files)")
+      if stop is not None:
+        stop.wait(poll_interval)
+      else:
+        time.sleep(poll_interval)
+
+def main():
+  parser = argparse.ArgumentParser(description="Transfer PoST data")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  manifest_parser = subparsers.add_parser("manifest", help="Write the checksum manifest on the producer")
+  manifest_parser.add_argument("post_dir", help="PoST data directory")
+  manifest_parser.add_argument("--watch", action="store_true", help="Keep updating until every file is in the manifest")
+  manifest_parser.add_argument("--interval", help="Seconds between updates with --watch", default=30, type=float)
+  pull_parser = subparsers.add_parser("pull", help="Pull PoST data to this machine")
+  pull_parser.add_argument("--source", help="Source directory or user@host:dir", required=True)
+  pull_parser.add_argument("--dest", help="Destination directory", required=True)
+  pull_parser.add_argument("--ssh-key", help="SSH key for remote sources")
+  pull_parser.add_argument("--streams", help="Parallel transfer streams", default=4, type=int)
+  pull_parser.add_argument("--interval", help="Seconds between manifest polls", default=30, type=float)
+  pull_parser.add_argument("--timeout", help="Give up after this many seconds without a new file", type=float)
+  args = parser.parse_args()
+
+  if args.command == "manifest":
+    while True:
+      manifest, done = update_manifest(args.post_dir)
+      print(f"{len(manifest)} files in manifest")
+      if done or not args.watch:
+        return
+      time.sleep(args.interval)
+
+  transport = transport_from_source(args.source, args.ssh_key)
+  try:
+    state = pull(transport, args.dest, args.streams, args.interval, args.timeout)
+  except OSError as e:
+    print(f"Error: {e}")
+    sys.exit(1)
+  finally:
+    transport.close()
+  print(f"Transferred and verified {len(state)} files to {args.dest}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#
+# Cloud providers for PoST generation and a race for the first usable capacity.
+#
+# Every provider lists priced options (GPU type, market, $/TiB), provisions one
+# of them, tells whether what it provisioned is usable yet, cancels it and
+# follows the job to the end. race_for_capacity() asks all providers at the
+# same time, each working down its own options under the price ceiling; the
+# first provider with usable capacity wins and everything the others have
+# provisioned or are still waiting on is cancelled right away.
+#
+#   RunPodProvider  RunPod pods (spot or on-demand), see gpu_selector.py
+#   LocalProvider   runs the job as a local process, for tests and own hardware
+#
+# Used by stage2.py --cloud PROVIDER[,PROVIDER...].
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import os
+import subprocess
+import threading
+import time
+
+import runpod
+
+from gpu_selector import backoff_delays, cost_per_tib, create_pod_for_option, label_size, rank_gpu_options
+from pod_tracker import ssh_log_reader, track_pod
+
+class ProvisionFailed(Exception):
+  # raised by ready() when what was provisioned can never become usable
+  pass
+
+class RunPodProvider:
+  name = "runpod"
+
+  def __init__(self, pod_args, market="any", gpu_type=None, log_path=None, ssh_key=None):
+    self.pod_args = pod_args
+    self.market = market
+    self.gpu_type = gpu_type
+    self.log_path = log_path
+    self.ssh_key = ssh_key
+
+  def options(self, quantity, total_bytes, max_cost_per_tib=None):
+    options = rank_gpu_options(runpod.get_gpus(), quantity, total_bytes, self.market, max_cost_per_tib, self.gpu_type)
+    return [dict(option, provider=self.name) for option in options]
+
+  def provision(self, option):
+    return create_pod_for_option(option, **self.pod_args)
+
+  def ready(self, pod):
+    # the container is up once the pod reports a runtime
+    pod = runpod.get_pod(pod["id"])
+    if pod and pod.get("desiredStatus") in ("EXITED", "TERMINATED"):
+      raise ProvisionFailed(f"pod {pod['desiredStatus'].lower()}")
+    return bool(pod and pod.get("desiredStatus") == "RUNNING" and pod.get("runtime"))
+
+  def cancel(self, pod):
+    runpod.terminate_pod(pod["id"])
+
+  def describe(self, pod):
+    return { "pod_id": pod["id"], "pod_host_id": (pod.get("machine") or {}).get("podHostId") }
+
+  def track(self, pod, total_labels, is_complete=None, is_failed=None, on_update=None, log=print):
+    read_log = ssh_log_reader(self.log_path, self.ssh_key) if self.log_path else None
+    return track_pod(pod["id"], total_labels, read_log, is_complete, is_failed, on_update=on_update, log=log)
+
+class LocalProvider:
+  # capacity_delay simulates a provider that has nothing to offer for the first seconds
+  name = "local"
+
+  def __init__(self, command, post_dir, price=0.0, labels_per_second=100_000, capacity_delay=0, startup_seconds=2):
+    self.command = command
+    self.startup_seconds = startup_seconds
+    self.post_dir = post_dir
+    self.price = price
+    self.labels_per_second = labels_per_second
+    self.available_at = time.monotonic() + capacity_delay
+
+  def options(self, quantity, total_bytes, max_cost_per_tib=None):
+    option = {
+      "provider": self.name,
+      "id": "local",
+      "quantity": 1,
+      "market": "on-demand",
+      "price": self.price,
+      "lowest_price": None,
+      "ondemand_price": self.price,
+      "labels_per_second": self.labels_per_second,
+      "cost_per_tib": cost_per_tib(self.price, self.labels_per_second),
+      "hours": total_bytes / (self.labels_per_second * label_size * 3600),
+    }
+    option["total_cost"] = option["price"] * option["hours"]
+    if max_cost_per_tib is not None and option["cost_per_tib"] > max_cost_per_tib:
+      return []
+    return [option]
+
+  def provision(self, option):
+    if time.monotonic() < self.available_at:
+      raise RuntimeError("No local capacity yet")
+    os.makedirs(self.post_dir, exist_ok=True)
+    process = subprocess.Popen(self.command)
+    return { "id": f"local-{process.pid}", "process": process, "started": time.monotonic() }
+
+  def ready(self, handle):
+    code = handle["process"].poll()
+    if code not in (None, 0):
+      raise ProvisionFailed(f"generator exited with status {code}")
+    # a generator that crashes on startup must not win the race
+    return code == 0 or time.monotonic() - handle["started"] >= self.startup_seconds
+
+  def cancel(self, handle):
+    if handle["process"].poll() is None:
+      handle["process"].terminate()
+      handle["process"].wait()
+
+  def describe(self, handle):
+    return { "pid": handle["process"].pid }
+
+  def labels_written(self):
+    names = [name for name in os.listdir(self.post_dir) if name.startswith("postdata_") and name.endswith(".bin")]
+    return sum(os.path.getsize(f"{self.post_dir}/{name}") for name in names) // label_size
+
+  def track(self, handle, total_labels, is_complete=None, is_failed=None, on_update=None, log=print, interval=5):
+    while True:
+      code = handle["process"].poll()
+      labels_written = self.labels_written()
+      runtime = time.monotonic() - handle["started"]
+      rate = labels_written / runtime if runtime else 0
+      eta = (total_labels - labels_written) / rate if rate else None
+      if on_update:
+        on_update(handle, labels_written, eta)
+      if code is not None:
+        complete = code == 0 and (is_complete() if is_complete else labels_written >= total_labels)
+        # a finished generator whose output is still being transferred is waited for
+        if code == 0 and not complete and is_complete and not (is_failed and is_failed()):
+          time.sleep(interval)
+          continue
+        return { "status": "complete" if complete else "failed", "labels_written": labels_written, "runtime_seconds": runtime, "cost": self.price * runtime / 3600, "pod_kept": False, "ssh": None }
+      if eta is not None:
+        log(f"S2.5   - {labels_written / total_labels:.1%} ({rate:,.0f} labels/s, ETA {eta / 60:.0f} min)")
+      time.sleep(interval)
+
+def race_for_capacity(providers, quantity, total_bytes, max_cost_per_tib=None, ready_timeout=600, poll_interval=5, retry_interval=15, max_rounds=None, unreleased=None, log=print):
+  # Returns (provider, option, handle) of the first usable capacity, or (None, None, None) when every provider gave up.
+  # Capacity whose cancel failed is still billed; it is appended to `unreleased` as {"provider", "option", "id", "error"}.
+  won = threading.Event()
+  lock = threading.Lock()
+  winner = []
+
+  def race(provider):
+    rounds = 0
+    for delay in backoff_delays(initial=retry_interval):
+      rounds += 1
+      try:
+        options = provider.options(quantity, total_bytes, max_cost_per_tib)
+      except Exception as e:
+        log(f"S2.4   - {provider.name}: could not list options: {e}")
+        options = []
+      if rounds == 1 and options:
+        best = options[0]
+        log(f"S2.3   - {provider.name}: {len(options)} options, best {best['id']} ({best['market']}) at ${best['cost_per_tib']:.2f}/TiB")
+      for option in options:
+        if won.is_set():
+          return
+        try:
+          handle = provider.provision(option)
+        except Exception as e:
+          log(f"S2.4   - {provider.name} {option['id']} ({option['market']}) not available: {e}")
+          continue
+        if not handle:
+          continue
+        log(f"S2.4   - {provider.name} accepted {option['id']} ({option['market']}), waiting for it to start")
+        usable = False
+        failure = None
+        deadline = time.monotonic() + ready_timeout
+        while not won.is_set() and time.monotonic() < deadline:
+          try:
+            usable = provider.ready(handle)
+          except ProvisionFailed as e:
+            failure = e
+            break
+          except Exception:
+            usable = False
+          if usable:
+            break
+          won.wait(poll_interval)
+        with lock:
+          if usable and not winner:
+            winner.append((provider, option, handle))
+            won.set()
+            log(f"S2.4   - {provider.name} {option['id']} is usable first, cancelling the other providers")
+            return
+        reason = "lost the race" if won.is_set() else f"failed: {failure}" if failure else "did not start in time"
+        try:
+          provider.cancel(handle)
+        except Exception as e:
+          log(f"S2.4   - Could not cancel {provider.name} {option['id']} ({reason}): {e}")
+          if unreleased is not None:
+            with lock:
+              unreleased.append({ "provider": provider.name, "option": option["id"], "id": handle.get("id"), "error": str(e) })
+        else:
+          log(f"S2.4   - Cancelled {provider.name} {option['id']} ({reason})")
+        if won.is_set():
+          return
+      if max_rounds is not None and rounds >= max_rounds:
+        return
+      log(f"S2.4   - {provider.name}: no capacity, retrying in {delay}s")
+      if won.wait(delay):
+        return
+
+  threads = [threading.Thread(target=race, args=(provider,), daemon=True) for provider in providers]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return winner[0] if winner else (None, None, None)
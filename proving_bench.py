@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+#
+# Measure how fast this host can read and hash its PoST data and tune the
+# proving options in config.json accordingly.
+#
+# Reads the real postdata_*.bin files (or a synthetic set) with every
+# combination of thread count, block size and readahead, measures sustained
+# read, hash and combined throughput, then picks proving threads/nonces and
+# predicts the duration of one proving pass over num_units.
+#
+# Usage:
+#
+#   proving_bench.py [--data-dir DIR] [--post-dir DIR] [--threads 1,2,4,8] [--block-sizes 1M,4M] [--readahead 0,16M] [--write-config]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from stage3 import generate_synthetic_post
+
+label_size = 16
+# proving nonces are processed in groups of 16 (one AES block per label per group)
+nonces_per_group = 16
+max_nonces = 512
+# measured proving rate and options, next to stage1.json (which stays an unchanged stage 2 input)
+proving_name = "proving.json"
+
+def parse_size(value):
+  units = { "K": 1 << 10, "M": 1 << 20, "G": 1 << 30 }
+  value = value.strip().upper()
+  if value and value[-1] in units:
+    return int(float(value[:-1]) * units[value[-1]])
+  return int(value)
+
+def drop_cache(paths):
+  # ask the kernel to forget cached pages so every run measures the disk
+  for path in paths:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+      os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+      os.close(fd)
+
+def measure(paths, threads, block_size, readahead, duration, hash_data=True):
+  # bytes/sec read (and hashed) by `threads` readers pulling blocks from a shared cursor
+  blocks = []
+  for path in paths:
+    size = os.path.getsize(path)
+    blocks += [(path, offset) for offset in range(0, size, block_size)]
+  drop_cache(paths)
+  cursor = iter(blocks)
+  cursor_lock = threading.Lock()
+  total = [0] * threads
+  deadline = time.monotonic() + duration
+
+  def reader(index):
+    fds = {}
+    try:
+      while time.monotonic() < deadline:
+        with cursor_lock:
+          block = next(cursor, None)
+        if block is None:
+          return
+        path, offset = block
+        if path not in fds:
+          fds[path] = os.open(path, os.O_RDONLY)
+          os.posix_fadvise(fds[path], 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        fd = fds[path]
+        if readahead:
+          os.posix_fadvise(fd, offset + block_size, readahead, os.POSIX_FADV_WILLNEED)
+        data = os.pread(fd, block_size, offset)
+        if hash_data:
+          hashlib.sha256(data).digest()
+        total[index] += len(data)
+    finally:
+      for fd in fds.values():
+        os.close(fd)
+
+  started = time.monotonic()
+  workers = [threading.Thread(target=reader, args=(index,)) for index in range(threads)]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  return sum(total) / (time.monotonic() - started)
+
+def measure_hash(threads, block_size, duration):
+  # in-memory hash throughput, the CPU side of proving
+  data = os.urandom(block_size)
+  total = [0] * threads
+  deadline = time.monotonic() + duration
+
+  def hasher(index):
+    while time.monotonic() < deadline:
+      hashlib.sha256(data).digest()
+      total[index] += block_size
+
+  started = time.monotonic()
+  workers = [threading.Thread(target=hasher, args=(index,)) for index in range(threads)]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  return sum(total) / (time.monotonic() - started)
+
+def tune_nonces(read_rate, hash_rate):
+  # spend spare CPU on more nonces per pass until hashing would become the bottleneck
+  groups = max(1, min(max_nonces // nonces_per_group, int(hash_rate // read_rate) if read_rate else 1))
+  return groups * nonces_per_group
+
+def proving_rate(read_rate, hash_rate, nonces):
+  return min(read_rate, hash_rate * nonces_per_group / nonces)
+
+def run_benchmark(paths, thread_counts, block_sizes, readaheads, duration, log=print):
+  results = []
+  log(f"{'Threads':>7} {'Block':>7} {'Readahead':>9} {'Read MiB/s':>10} {'Read+hash MiB/s':>15}")
+  for threads in thread_counts:
+    for block_size in block_sizes:
+      for readahead in readaheads:
+        read_rate = measure(paths, threads, block_size, readahead, duration, hash_data=False)
+        combined_rate = measure(paths, threads, block_size, readahead, duration)
+        results.append({ "threads": threads, "block_size": block_size, "readahead": readahead, "read_rate": read_rate, "combined_rate": combined_rate })
+        log(f"{threads:7} {block_size >> 10:6}K {readahead >> 10:8}K {read_rate / 2 ** 20:10.1f} {combined_rate / 2 ** 20:15.1f}")
+  return results
+
+def write_proving_options(config_path, threads, nonces):
+  with open(config_path, "r") as f:
+    config = json.load(f)
+  proving_opts = config.setdefault("smeshing", {}).setdefault("smeshing-proving-opts", {})
+  proving_opts["smeshing-opts-proving-threads"] = threads
+  proving_opts["smeshing-opts-proving-nonces"] = nonces
+  with open(config_path, "w") as f:
+    json.dump(config, f, indent=2)
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark PoST proving throughput and tune proving options")
+  parser.add_argument("--data-dir", help="Directory for data files", default="data")
+  parser.add_argument("--post-dir", help="PoST data directory (default: <data-dir>/stage1)")
+  parser.add_argument("--threads", help="Comma-separated reader thread counts", default=f"1,2,4,{os.cpu_count()}")
+  parser.add_argument("--block-sizes", help="Comma-separated read block sizes", default="1M,4M,16M")
+  parser.add_argument("--readahead", help="Comma-separated readahead windows (0 disables)", default="0,64M")
+  parser.add_argument("--duration", help="Seconds per measurement", default=5, type=float)
+  parser.add_argument("--synthetic-mb", help="Size of the synthetic data set when no PoST files exist", default=1024, type=int)
+  parser.add_argument("--write-config", action="store_true", help="Write the tuned proving options into config.json")
+  args = parser.parse_args()
+
+  data_dir = args.data_dir
+  stage1_path = f"{data_dir}/stage1"
+  post_dir = args.post_dir or stage1_path
+  config_path = f"{stage1_path}/config.json"
+  stage1_config_path = f"{stage1_path}/stage1.json"
+
+  paths = sorted(glob.glob(f"{post_dir}/postdata_*.bin"), key=lambda path: int(path.rsplit("_", 1)[1].split(".")[0]))
+  synthetic_dir = None
+  if not paths:
+    synthetic_dir = tempfile.mkdtemp(prefix="proving-bench-")
+    print(f"No PoST files in {post_dir}, using {args.synthetic_mb} MiB of synthetic data in {synthetic_dir}")
+    generate_synthetic_post(synthetic_dir, 1, (args.synthetic_mb << 20) // label_size, 256 << 20)
+    paths = sorted(glob.glob(f"{synthetic_dir}/postdata_*.bin"))
+
+  thread_counts = sorted(set(int(value) for value in args.threads.split(",")))
+  block_sizes = [parse_size(value) for value in args.block_sizes.split(",")]
+  readaheads = [parse_size(value) for value in args.readahead.split(",")]
+  try:
+    results = run_benchmark(paths, thread_counts, block_sizes, readaheads, args.duration)
+  finally:
+    if synthetic_dir:
+      for path in paths + glob.glob(f"{synthetic_dir}/*"):
+        if os.path.exists(path):
+          os.remove(path)
+      os.rmdir(synthetic_dir)
+
+  best = max(results, key=lambda result: result["combined_rate"])
+  hash_rate = measure_hash(best["threads"], best["block_size"], args.duration)
+  nonces = tune_nonces(best["read_rate"], hash_rate)
+  rate = proving_rate(best["read_rate"], hash_rate, nonces)
+  print()
+  print(f"Best: {best['threads']} threads, {best['block_size'] >> 10}K blocks, {best['readahead'] >> 10}K readahead")
+  print(f"  - Read: {best['read_rate'] / 2 ** 20:.1f} MiB/s, hash: {hash_rate / 2 ** 20:.1f} MiB/s")
+  print(f"  - Proving options: threads={best['threads']}, nonces={nonces}")
+
+  if os.path.isfile(stage1_config_path):
+    stage1_config = json.load(open(stage1_config_path, "r"))
+    total_bytes = int(stage1_config["num_units"]) * int(stage1_config["labels_per_unit"]) * label_size
+    print(f"  - Predicted proving pass over {stage1_config['num_units']} units ({total_bytes / 2 ** 30:.0f} GiB): {total_bytes / rate / 3600:.2f} h")
+    # epoch_scheduler.py and proving_coordinator.py plan proving passes with the measured rate
+    with open(f"{stage1_path}/{proving_name}", "w") as f:
+      json.dump({ "proving_rate": rate, "threads": best["threads"], "nonces": nonces, "measured_at": int(time.time()) }, f, indent=2)
+
+  if args.write_config:
+    if not os.path.isfile(config_path):
+      print(f"Error: {config_path} does not exist, run stage 1 first.")
+      sys.exit(1)
+    write_proving_options(config_path, best["threads"], nonces)
+    print(f"Proving options written to {config_path}")
+
+if __name__ == "__main__":
+  main()
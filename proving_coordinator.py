@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+#
+# Coordinate the proving passes of several identities that share disks.
+#
+# Every identity on this host runs its own stage4.py node, and all of them
+# start reading their whole PoST at the same moment of the cycle gap. When
+# their files share a disk the reads interleave, the disk seeks instead of
+# streaming and every proof takes longer than all of them in a row would.
+#
+# The coordinator maps each identity's postdata_N.bin files (following the
+# symlinks of post_layout.py) to the physical disks holding them and takes the
+# read rate of every disk from --device-rate, the rate post_layout.py recorded
+# or a short measurement. It follows each node's go-spacemesh.log, and once a
+# proving pass starts it either lets one identity per disk read at full speed
+# while the others wait their turn (stagger), or splits each disk's rate
+# between the identities reading from it (share). Limits are cgroup v2 io.max
+# read limits on the node process; without cgroup I/O control the waiting
+# nodes drop to the idle I/O class instead.
+#
+# `plan` predicts when each identity's proof completes in the next cycle gap,
+# compares it with the registration deadline and shows how much room every
+# disk has left for more identities.
+#
+# Usage:
+#
+#   proving_coordinator.py plan --data-dir DIR --data-dir DIR ... [--mode stagger|share] [--device-rate sda=450]
+#   proving_coordinator.py run --data-dir DIR --data-dir DIR ... [--mode stagger|share] [--dry-run]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from epoch_scheduler import cycle_gaps, format_hours, format_time, layer_at, load_network, load_proving_rate, network_time
+from log_follower import LogFollower
+from post_shards import post_files
+from proving_bench import measure
+
+cgroup_root = "/sys/fs/cgroup"
+# read limit (bytes/sec) of an identity waiting for its turn on a disk, enough to keep its node responsive
+waiting_rbps = 1 << 20
+# a proving pass that never logged its end is released after this many times its predicted duration
+hold_factor = 3
+
+def block_device(path):
+  # ("major:minor", name) of the disk holding path; partitions map to their disk, filesystems without one keep their own device
+  st_dev = os.stat(path).st_dev
+  devno = f"{os.major(st_dev)}:{os.minor(st_dev)}"
+  sys_path = f"/sys/dev/block/{devno}"
+  if not os.path.exists(sys_path):
+    return devno, f"dev-{devno.replace(':', '-')}"
+  sys_path = os.path.realpath(sys_path)
+  if os.path.exists(f"{sys_path}/partition"):
+    sys_path = os.path.dirname(sys_path)
+  with open(f"{sys_path}/dev", "r") as f:
+    return f.read().strip(), os.path.basename(sys_path)
+
+def load_identity(data_dir):
+  # the identity in data_dir with the bytes and files it keeps on every disk
+  stage1_path = f"{data_dir}/stage1"
+  stage4_path = f"{data_dir}/stage4"
+  config = json.load(open(f"{stage1_path}/stage1.json", "r"))
+  devices = {}
+  for name, size in post_files(config):
+    path = f"{stage1_path}/{name}"
+    if not os.path.exists(path):
+      continue
+    devno, device_name = block_device(os.path.realpath(path))
+    device = devices.setdefault(devno, { "name": device_name, "bytes": 0, "paths": [] })
+    device["bytes"] += min(size, os.path.getsize(path))
+    device["paths"].append(path)
+  # read rates post_layout.py measured for its disks
+  layout_rates = {}
+  for disk in config.get("post_layout", {}).get("disks", []):
+    if os.path.isdir(disk["path"]):
+      layout_rates[block_device(disk["path"])[0]] = disk["read_rate"]
+  return {
+    "name": config["node_id_first_8"],
+    "data_dir": data_dir,
+    "total_bytes": sum(device["bytes"] for device in devices.values()),
+    "proving_rate": load_proving_rate(stage1_path),
+    "devices": devices,
+    "layout_rates": layout_rates,
+    "log_path": f"{stage4_path}/go-spacemesh.log",
+    "pid_path": f"{stage4_path}/go-spacemesh.pid",
+  }
+
+def parse_device_rates(values):
+  # ["sda=450", "8:16=300"] -> { name or devno: bytes/sec }
+  rates = {}
+  for value in values or []:
+    device, _, rate = value.partition("=")
+    rates[device] = float(rate) * (1 << 20)
+  return rates
+
+def device_rates(identities, state, overrides=None, duration=5, remeasure=False, log=print):
+  # { devno: read bytes/sec }: --device-rate, then post_layout.py's or an earlier run's rate, then a measurement
+  overrides = overrides or {}
+  known = state.setdefault("devices", {})
+  rates = {}
+  for identity in identities:
+    for devno, device in identity["devices"].items():
+      if devno in rates:
+        continue
+      override = overrides.get(device["name"], overrides.get(devno))
+      if override:
+        rates[devno] = override
+      elif devno in identity["layout_rates"] and not remeasure:
+        rates[devno] = identity["layout_rates"][devno]
+      elif devno in known and not remeasure:
+        rates[devno] = known[devno]["read_rate"]
+      else:
+        log(f"S4.4   - Measuring {device['name']} ({devno}) for {duration:.0f}s")
+        rates[devno] = measure(device["paths"], 1, 4 << 20, 0, duration, hash_data=False)
+      known[devno] = { "name": device["name"], "read_rate": rates[devno] }
+  return rates
+
+def proof_seconds(identity, rates):
+  # one proving pass on its own: the disks are read one after the other, never faster than the CPU hashes
+  read_seconds = sum(device["bytes"] / rates[devno] for devno, device in identity["devices"].items())
+  return max(read_seconds, identity["total_bytes"] / identity["proving_rate"])
+
+def proving_order(identities):
+  # smallest proofs first, so the most identities are done early
+  return sorted(identities, key=lambda identity: (identity["total_bytes"], identity["name"]))
+
+def plan_proofs(identities, rates, mode="stagger", start=0):
+  # { name: {"start", "finish", "seconds"} } when every identity begins proving at `start`
+  plans = {}
+  if mode == "share":
+    # each disk is split evenly between the identities still reading from it, so the smaller parts finish
+    # first and hand their share to the rest
+    read_seconds = { identity["name"]: 0 for identity in identities }
+    for devno in { devno for identity in identities for devno in identity["devices"] }:
+      parts = sorted((identity["devices"][devno]["bytes"], identity["name"]) for identity in identities if devno in identity["devices"])
+      done = 0
+      for index, (size, name) in enumerate(parts):
+        done += size
+        read_seconds[name] += (done + (len(parts) - index - 1) * size) / rates[devno]
+    for identity in identities:
+      seconds = max(read_seconds[identity["name"]], identity["total_bytes"] / identity["proving_rate"])
+      plans[identity["name"]] = { "start": start, "finish": start + seconds, "seconds": seconds }
+    return plans
+  free_at = {}
+  for identity in proving_order(identities):
+    begin = max([free_at.get(devno, start) for devno in identity["devices"]], default=start)
+    seconds = proof_seconds(identity, rates)
+    plans[identity["name"]] = { "start": begin, "finish": begin + seconds, "seconds": seconds }
+    for devno in identity["devices"]:
+      free_at[devno] = begin + seconds
+  return plans
+
+def device_report(identities, rates, plans, window_start, deadline):
+  # per disk: identities, bytes, busy time in the window and how many more identities of the average size would still fit
+  devices = {}
+  for identity in identities:
+    for devno, device in identity["devices"].items():
+      entry = devices.setdefault(devno, { "name": device["name"], "identities": 0, "bytes": 0, "busy_until": window_start })
+      entry["identities"] += 1
+      entry["bytes"] += device["bytes"]
+      entry["busy_until"] = max(entry["busy_until"], plans[identity["name"]]["finish"])
+  for devno, entry in devices.items():
+    average = entry["bytes"] / entry["identities"]
+    entry["read_rate"] = rates[devno]
+    entry["room"] = max(0, int((deadline - entry["busy_until"]) * rates[devno] // average)) if average else 0
+  return devices
+
+class CgroupThrottle:
+  # cgroup v2 io.max read limits, one group per identity
+  name = "cgroup io.max"
+
+  def __init__(self, group=f"{cgroup_root}/auto-spacemesh"):
+    self.group = group
+    self.ready = False
+
+  @staticmethod
+  def available():
+    try:
+      with open(f"{cgroup_root}/cgroup.controllers", "r") as f:
+        return "io" in f.read().split() and os.access(cgroup_root, os.W_OK)
+    except OSError:
+      return False
+
+  def write(self, path, value):
+    with open(path, "w") as f:
+      f.write(value)
+
+  def apply(self, name, pid, limits):
+    if not self.ready:
+      os.makedirs(self.group, exist_ok=True)
+      self.write(f"{cgroup_root}/cgroup.subtree_control", "+io")
+      self.write(f"{self.group}/cgroup.subtree_control", "+io")
+      self.ready = True
+    path = f"{self.group}/{name}"
+    os.makedirs(path, exist_ok=True)
+    self.write(f"{path}/cgroup.procs", str(pid))
+    for devno, rbps in limits.items():
+      self.write(f"{path}/io.max", f"{devno} rbps={int(rbps) if rbps else 'max'}")
+
+class IoniceThrottle:
+  # without cgroup I/O control: waiting nodes drop to the idle I/O class (honoured by the BFQ scheduler), shares are not enforced
+  name = "ionice"
+
+  def apply(self, name, pid, limits):
+    idle = any(rbps is not None and rbps <= waiting_rbps for rbps in limits.values())
+    for tid in os.listdir(f"/proc/{pid}/task"):
+      subprocess.run(["ionice", "-c", "3" if idle else "2", "-p", tid], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+class DryRunThrottle:
+  name = "dry run"
+
+  def apply(self, name, pid, limits):
+    pass
+
+class ProvingCoordinator:
+  def __init__(self, identities, rates, mode="stagger", throttle=None, log=print):
+    self.identities = { identity["name"]: identity for identity in identities }
+    self.order = [identity["name"] for identity in proving_order(identities)]
+    self.rates = rates
+    self.mode = mode
+    self.throttle = throttle or DryRunThrottle()
+    self.log = log
+    # name -> time its node started proving, and -> time it got its disks (stagger)
+    self.proving = {}
+    self.granted = {}
+    self.applied = {}
+
+  def started(self, name, now=None):
+    if name not in self.proving:
+      self.proving[name] = now or time.time()
+      self.log(f"S4.4 {name} started proving ({len(self.proving)} identities proving)")
+
+  def finished(self, name, now=None):
+    now = now or time.time()
+    if name in self.proving:
+      self.log(f"S4.4 {name} finished proving after {format_hours(now - self.proving.pop(name))}")
+    self.granted.pop(name, None)
+
+  def release_stuck(self, now):
+    # a node that restarted mid-proof never logs the end of its pass
+    for name, started in list(self.proving.items()):
+      if now - started > hold_factor * proof_seconds(self.identities[name], self.rates) + 3600:
+        self.log(f"S4.4 {name} has been proving for {format_hours(now - started)}, releasing its disks")
+        self.finished(name, now)
+
+  def limits(self, now=None):
+    # { name: { devno: bytes/sec or None } } for every identity; None lifts the limit
+    now = now or time.time()
+    limits = { name: { devno: None for devno in identity["devices"] } for name, identity in self.identities.items() }
+    if self.mode == "share":
+      readers = {}
+      for name in self.proving:
+        for devno in self.identities[name]["devices"]:
+          readers[devno] = readers.get(devno, 0) + 1
+      for name in self.proving:
+        for devno in self.identities[name]["devices"]:
+          if readers[devno] > 1:
+            limits[name][devno] = self.rates[devno] / readers[devno]
+      return limits
+    held = { devno for name in self.granted for devno in self.identities[name]["devices"] }
+    for name in self.order:
+      if name not in self.proving or name in self.granted:
+        continue
+      devices = self.identities[name]["devices"]
+      if not devices:
+        continue
+      if held.isdisjoint(devices):
+        self.granted[name] = now
+        held.update(devices)
+        finish = now + proof_seconds(self.identities[name], self.rates)
+        self.log(f"S4.4 {name} reads {', '.join(device['name'] for device in devices.values())} at full speed, done around {format_time(finish)}")
+      else:
+        limits[name] = { devno: waiting_rbps for devno in devices }
+    return limits
+
+  def enforce(self, now=None):
+    now = now or time.time()
+    self.release_stuck(now)
+    for name, limit in self.limits(now).items():
+      pid = read_pid(self.identities[name]["pid_path"])
+      if not pid or self.applied.get(name) == (pid, limit):
+        continue
+      try:
+        self.throttle.apply(name, pid, limit)
+      except OSError as e:
+        self.log(f"S4.4 Could not limit {name} (pid {pid}) with {self.throttle.name}: {e}")
+      self.applied[name] = (pid, limit)
+      waiting = [self.identities[name]["devices"][devno]["name"] for devno, rbps in limit.items() if rbps is not None]
+      if waiting:
+        self.log(f"S4.4 {name} limited on {', '.join(waiting)} ({self.mode})")
+
+  def predictions(self, now=None):
+    # { name: predicted finish } of the identities that are proving or waiting to
+    now = now or time.time()
+    proving = [self.identities[name] for name in self.order if name in self.proving]
+    if self.mode == "share":
+      plans = plan_proofs(proving, self.rates, "share", now)
+      return { name: plans[name]["finish"] for name in plans }
+    free_at = {}
+    predictions = {}
+    for name in sorted(self.granted, key=self.granted.get) + [identity["name"] for identity in proving if identity["name"] not in self.granted]:
+      identity = self.identities[name]
+      begin = self.granted.get(name) or max([free_at.get(devno, now) for devno in identity["devices"]], default=now)
+      predictions[name] = begin + proof_seconds(identity, self.rates)
+      for devno in identity["devices"]:
+        free_at[devno] = max(free_at.get(devno, now), predictions[name])
+    return predictions
+
+def read_pid(pid_path):
+  # pid of the running node stage4.py wrote, None when it is not running
+  try:
+    with open(pid_path, "r") as f:
+      pid = int(f.read().strip())
+  except (OSError, ValueError):
+    return None
+  return pid if os.path.exists(f"/proc/{pid}") else None
+
+def select_throttle(dry_run=False):
+  if dry_run:
+    return DryRunThrottle()
+  if CgroupThrottle.available():
+    return CgroupThrottle()
+  return IoniceThrottle()
+
+def print_plan(identities, rates, mode, gap, now):
+  plans = plan_proofs(identities, rates, mode, gap["start"])
+  deadline = gap["registration_deadline"]
+  print(f"Epoch {gap['epoch']} cycle gap {format_time(gap['start'])}, register by {format_time(deadline)} ({mode})")
+  late = 0
+  for identity in proving_order(identities):
+    plan = plans[identity["name"]]
+    disks = ", ".join(device["name"] for device in identity["devices"].values())
+    margin = deadline - plan["finish"]
+    status = f"{format_hours(margin)} to spare" if margin >= 0 else f"LATE by {format_hours(-margin)}"
+    late += margin < 0
+    print(f"  - {identity['name']}: {identity['total_bytes'] / 2 ** 30:.0f} GiB on {disks or 'no disk'}, proves {format_time(plan['start'])} - {format_time(plan['finish'])} ({format_hours(plan['seconds'])}), {status}")
+  print("Disks:")
+  for devno, device in device_report(identities, rates, plans, gap["start"], deadline).items():
+    print(f"  - {device['name']} ({devno}): {device['identities']} identities, {device['bytes'] / 2 ** 30:.0f} GiB at {device['read_rate'] / 2 ** 20:.0f} MiB/s, busy until {format_time(device['busy_until'])}, room for {device['room']} more")
+  return late
+
+def main():
+  parser = argparse.ArgumentParser(description="Coordinate the proving passes of identities that share disks")
+  parser.add_argument("command", choices=["plan", "run"])
+  parser.add_argument("--data-dir", help="Identity data directory (repeatable)", action="append", required=True)
+  parser.add_argument("--mode", help="stagger: one identity per disk at a time, share: split each disk's rate", choices=["stagger", "share"], default="stagger")
+  parser.add_argument("--device-rate", help="Read rate of a disk in MiB/s, e.g. sda=450 or 8:0=450 (repeatable)", action="append")
+  parser.add_argument("--state", help="Where measured disk rates are kept", default="proving-coordinator.json")
+  parser.add_argument("--remeasure", action="store_true", help="Measure every disk again")
+  parser.add_argument("--measure-seconds", help="Seconds per disk measurement", default=5, type=float)
+  parser.add_argument("--config", help="go-spacemesh config with the network timing (default: <data-dir>/stage1/config.mainnet.json)")
+  parser.add_argument("--offline", action="store_true", help="Use the local clock instead of asking nodes for the current layer")
+  parser.add_argument("--interval", help="Seconds between checks (run)", default=5, type=float)
+  parser.add_argument("--dry-run", action="store_true", help="Only log the limits instead of applying them (run)")
+  args = parser.parse_args()
+
+  identities = []
+  for data_dir in args.data_dir:
+    if not os.path.isfile(f"{data_dir}/stage1/stage1.json"):
+      print(f"Error: {data_dir}/stage1/stage1.json does not exist, run stage 1 first.")
+      sys.exit(1)
+    identities.append(load_identity(data_dir))
+  state = json.load(open(args.state, "r")) if os.path.isfile(args.state) else {}
+  rates = device_rates(identities, state, parse_device_rates(args.device_rate), args.measure_seconds, args.remeasure)
+  with open(args.state, "w") as f:
+    json.dump(state, f, indent=2)
+
+  network = load_network(args.config or f"{args.data_dir[0]}/stage1/config.mainnet.json")
+  if args.offline:
+    now = time.time()
+  else:
+    now, _, _ = network_time(network)
+  # clock offset, so the live loop keeps following the network's time
+  offset = now - time.time()
+  gap = cycle_gaps(network, now, 1)[0]
+
+  if args.command == "plan":
+    if print_plan(identities, rates, args.mode, gap, now):
+      sys.exit(2)
+    return
+
+  throttle = select_throttle(args.dry_run)
+  coordinator = ProvingCoordinator(identities, rates, args.mode, throttle)
+  follower = LogFollower()
+  names = {}
+  for identity in identities:
+    follower.add(identity["log_path"])
+    names[os.path.abspath(identity["log_path"])] = identity["name"]
+  print(f"S4.4 Coordinating {len(identities)} identities on {len(rates)} disks ({args.mode}, {throttle.name}), layer {layer_at(network, now)}")
+  last_report = 0
+  try:
+    while True:
+      events = follower.poll(args.interval)
+      now = time.time() + offset
+      for event in events:
+        if event.kind == "proving":
+          coordinator.started(names[event.path], now)
+        elif event.kind == "proven":
+          coordinator.finished(names[event.path], now)
+      coordinator.enforce(now)
+      if coordinator.proving and now - last_report >= 600:
+        last_report = now
+        gap = cycle_gaps(network, now, 1)[0]
+        for name, finish in coordinator.predictions(now).items():
+          margin = gap["registration_deadline"] - finish
+          status = f"{format_hours(margin)} before the deadline" if margin >= 0 else f"LATE by {format_hours(-margin)}"
+          print(f"S4.4   - {name}: proof done around {format_time(finish)}, {status}")
+  except KeyboardInterrupt:
+    pass
+  finally:
+    follower.close()
+
+if __name__ == "__main__":
+  main()
@@ -1,24 +1,24 @@
 #!/usr/bin/env python3
 
 import sys
-import os
-import subprocess
 import argparse
-import json
-import urllib.request
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from endpoint_selector import EndpointSelector, public_nodes, sync_status
+from spacemesh_api import SpacemeshClient
+from tracing import Tracer
 
 version = "1.0.0"
-nodes = [
-  "public.smesh.cloud:9092",
-  "pub-node1.smesh.cloud:9092",
-  "pub-node2.smesh.cloud:9092",
-  "pub-node3.smesh.cloud:9092",
-  "pub-node4.smesh.cloud:9092",
-  "pub-node5.smesh.cloud:9092",
-  "pub-node6.smesh.cloud:9092",
-  "pub-node7.smesh.cloud:9092",
-  "pub-node8.smesh.cloud:9092"
-]
+nodes = public_nodes
+metrics_rows = {}
+metrics_lock = threading.Lock()
+tracer = None
+# every probe feeds the selector, so its latency averages and ejections rank the nodes for the summary
+selector = None
 
 def display_version():
   print("public-nodes.py version", version)
@@ -27,6 +27,14 @@ def parse_options():
   parser = argparse.ArgumentParser()
   # add argument to embed the remote server version in the status output
   parser.add_argument("--node-version", help="Embed the remote server version in the status output", action="store_true")
+  parser.add_argument("--timeout", help="Per-node timeout in seconds", default=5.0, type=float)
+  parser.add_argument("--deadline", help="Global deadline in seconds for the whole health check", default=15.0, type=float)
+  parser.add_argument("--workers", help="Maximum number of nodes probed concurrently", default=32, type=int)
+  parser.add_argument("--watch", help="Keep running and refresh every INTERVAL seconds", metavar="INTERVAL", type=float)
+  parser.add_argument("--history", help="Number of samples kept per node in watch mode", default=60, type=int)
+  parser.add_argument("--metrics-port", help="Serve Prometheus/OpenMetrics data on this port", type=int)
+  parser.add_argument("--profile", action="store_true", help="Print the slowest probes at the end")
+  parser.add_argument("--data-dir", help="Write probe traces to <data-dir>/traces")
   parser.add_argument("-v", "--version", help="Display version information and exit", action="store_true")
   args = parser.parse_args()
 
@@ -34,69 +42,151 @@ def parse_options():
       display_version()
       sys.exit(0)
 
+  if args.metrics_port and not args.watch:
+    print("Error: --metrics-port needs --watch, a single check exits before anything could be scraped.")
+    sys.exit(1)
+
   return args
 
-def download_grpcurl():
-    # Download latest grpcurl from GitHub
-    url = "https://github.com/fullstorydev/grpcurl/releases/latest/download/grpcurl_$(uname -s)_$(uname -m).tar.gz"
-    try:
-        response = urllib.request.urlopen(url)
-        data = response.read()
-        with open("/tmp/grpcurl.tar.gz", "wb") as file:
-            file.write(data)
-        print("Downloaded grpcurl successfully.")
-    except:
-        print("Error: Failed to download grpcurl from GitHub.")
-        sys.exit(1)
+def node_status_dict(status):
+  # same shape as the grpcurl JSON output consumed by column_data_from_node
+  return {
+    'connectedPeers': status.connected_peers,
+    'isSynced': status.is_synced,
+    'syncedLayer': { 'number': status.synced_layer },
+    'topLayer': { 'number': status.top_layer },
+    'verifiedLayer': { 'number': status.verified_layer },
+  }
 
-    # Extract grpcurl
+def probe_node(node, node_version, timeout, deadline_at):
+  node_name, node_port = node.split(':')
+  status = { 'name': node_name, 'port': node_port }
+  start = time.time()
+  started = time.monotonic()
+  try:
+    # never let a single node run past the global deadline
+    remaining = min(timeout, deadline_at - started)
+    if remaining <= 0:
+      return status
+    client = SpacemeshClient(node)
+    node_status = client.status(timeout=remaining)
+    status = node_status_dict(node_status)
+    status['name'] = node_name
+    status['port'] = node_port
+    status['latency'] = (time.monotonic() - started) * 1000
+    if selector:
+      selector.record_success(node, status['latency'] / 1000, node_status)
+  except:
+    if selector:
+      selector.record_failure(node)
+    if tracer:
+      tracer.record(node, "Probe", start, time.monotonic() - started, "error")
+    return status
+  if tracer:
+    tracer.record(node, "Probe", start, time.monotonic() - started)
+
+  if node_version:
     try:
-        subprocess.run(["tar", "-xzf", "/tmp/grpcurl.tar.gz", "-C", "/tmp/"], check=True)
-        print("Extracted grpcurl successfully.")
+      remaining = min(timeout, deadline_at - time.monotonic())
+      if remaining > 0:
+        status['version'] = client.version(timeout=remaining)
     except:
-        print("Error: Failed to extract grpcurl.")
-        sys.exit(1)
+      print(f"Error: Failed to retrieve version from {node}.")
+  return status
+
+def probe_all_nodes(nodes, node_version, timeout, deadline, workers):
+  # Probe every node at once, so the check takes as long as the slowest reply (bounded by the deadline)
+  deadline_at = time.monotonic() + deadline
+  node_status = {}
+  with ThreadPoolExecutor(max_workers=max(1, min(workers, len(nodes)))) as executor:
+    futures = { executor.submit(probe_node, node, node_version, timeout, deadline_at): node for node in nodes }
+    wait(futures, timeout=max(0, deadline_at - time.monotonic()))
+    for future, node in futures.items():
+      if future.done():
+        node_status[node] = future.result()
+      else:
+        node_name, node_port = node.split(':')
+        node_status[node] = { 'name': node_name, 'port': node_port }
+  # keep the report in the configured node order
+  return { node: node_status[node] for node in nodes }
+
+def layer_number(node, key):
+  # a node that has not reached a layer yet (e.g. nothing verified) leaves the field out; count it as layer 0
+  return int((node.get(key) or {}).get('number') or 0)
+
+def record_history(history, node_status, size):
+  # ring buffer of layer/peer samples per node, used for the lag rate in watch mode
+  now = time.time()
+  for node, status in node_status.items():
+    samples = history.setdefault(node, deque(maxlen=size))
+    if 'topLayer' in status and 'syncedLayer' in status and 'verifiedLayer' in status:
+      samples.append({
+        'time': now,
+        'topLayer': layer_number(status, 'topLayer'),
+        'syncedLayer': layer_number(status, 'syncedLayer'),
+        'verifiedLayer': layer_number(status, 'verifiedLayer'),
+        'peers': int(status['connectedPeers'] or 0),
+      })
 
-    # Add grpcurl to PATH
-    os.environ["PATH"] += ":/tmp/grpcurl"
-    print("Added grpcurl to PATH.")
+def layer_lag_rate(samples):
+  # change of the top/synced lag in layers per minute over the history window (positive = falling behind)
+  if not samples or len(samples) < 2:
+    return None
+  first, last = samples[0], samples[-1]
+  elapsed = last['time'] - first['time']
+  if elapsed <= 0:
+    return None
+  first_lag = first['topLayer'] - first['syncedLayer']
+  last_lag = last['topLayer'] - last['syncedLayer']
+  return (last_lag - first_lag) * 60 / elapsed
 
-def column_data_from_node(node):
+def column_data_from_node(node, samples=None, latency_step=1):
+  # latency_step coarsens the displayed latency so watch mode does not redraw a row for every millisecond of jitter
   data = {
     'name': node['name'],
     'port': node['port'],
     'version': node['version'] if 'version' in node else None,
+    'latency': f"{round(node['latency'] / latency_step) * latency_step:.0f}ms" if node.get('latency') is not None else None,
+    'latencySeconds': node['latency'] / 1000 if node.get('latency') is not None else None,
     'peers': None,
     'topLayer': None,
     'syncedLayer': None,
-    'verifiedLayer': None
+    'verifiedLayer': None,
+    'lag': None,
+    'lagRate': None,
+    'lagRatePerMinute': None
   }
 
   if 'topLayer' in node and 'syncedLayer' in node and 'verifiedLayer' in node:
-    data['status'] = 'SYNCED & VERIFIED' if abs(int(node['topLayer']['number']) - int(node['syncedLayer']['number'])) < 3 and abs(int(node['verifiedLayer']['number']) - int(node['syncedLayer']['number'])) < 3 else 'SYNCED' if abs(int(node['topLayer']['number']) - int(node['syncedLayer']['number'])) < 3 else 'NOT SYNCED'
-    data['peers'] = node['connectedPeers']
-    data['topLayer'] = node['topLayer']['number'] if node and node['topLayer'] else None
-    data['syncedLayer'] = node['syncedLayer']['number'] if node and node['syncedLayer'] else None
-    data['verifiedLayer'] = node['verifiedLayer']['number'] if node and node['verifiedLayer'] else None
+    data['topLayer'] = layer_number(node, 'topLayer')
+    data['syncedLayer'] = layer_number(node, 'syncedLayer')
+    data['verifiedLayer'] = layer_number(node, 'verifiedLayer')
+    data['status'] = sync_status(data['topLayer'], data['syncedLayer'], data['verifiedLayer'])
+    data['peers'] = node['connectedPeers'] or 0
+    data['lag'] = data['topLayer'] - data['syncedLayer']
+    data['lagRatePerMinute'] = layer_lag_rate(samples)
+    if data['lagRatePerMinute'] is not None:
+      data['lagRate'] = f"{data['lagRatePerMinute']:+.1f}"
   else:
     data['status'] = 'OFFLINE'
 
   return data
 
-def print_node_status(node):
-  global args, not_synced_nodes, synced_nodes, verified_nodes, offline_nodes, columns
-  if node and 'topLayer' in node:
-    if abs(int(node['topLayer']['number']) - int(node['syncedLayer']['number'])) < 3 and abs(int(node['verifiedLayer']['number']) - int(node['syncedLayer']['number'])) < 3:
-      synced_nodes += 1
-      verified_nodes += 1
-    elif abs(int(node['topLayer']['number']) - int(node['syncedLayer']['number'])) < 3:
-      synced_nodes += 1
-    else:
-      not_synced_nodes += 1
-  else:
-    offline_nodes += 1
+def update_column_widths(rows):
+  # widen columns to fit the cached column data; returns True when the layout changed
+  global columns
+  changed = False
+  for column in columns:
+    if column['enabled']:
+      for column_data in rows.values():
+        column_width = len(str(column_data[column['key']])) if column_data.get(column['key']) is not None else 0
+        if column_width > column['width']:
+          column['width'] = column_width
+          changed = True
+  return changed
 
-  column_data = column_data_from_node(node)
+def format_node_row(column_data):
+  global columns
   node_row = ""
   for column in columns:
     if column['enabled']:
@@ -104,9 +194,12 @@ def print_node_status(node):
         node_row += f"{column_data[column['key']]:{column['width']}} "
       else:
         node_row += f"{'':{column['width']}} "
-  print(node_row)
+  return node_row
+
+def print_node_status(column_data):
+  print(format_node_row(column_data))
 
-def print_all_node_status(nodes):
+def print_all_node_status(rows):
   global columns
   print("PUBLIC NODES HEALTH CHECK")
   print()
@@ -114,16 +207,7 @@ def print_all_node_status(nodes):
   print("Offline nodes will not be included in rotation.")
   print()
 
-  # cycle through columns and update the width of each column to match the width of the max value in that column
-  for column in columns:
-    if column['enabled']:
-      for node_id in nodes.keys():
-        node = nodes[node_id]
-        column_data = column_data_from_node(node)
-        if column['key'] in column_data:
-          column_width = len(str(column_data[column['key']]))
-          if column_width > column['width']:
-            column['width'] = column_width
+  update_column_widths(rows)
 
   title_row = ""
   for column in columns:
@@ -137,19 +221,110 @@ def print_all_node_status(nodes):
 
   print(title_row)
   print(separator_row)
-  for node in nodes.values():
-    print_node_status(node)
+  for column_data in rows.values():
+    print_node_status(column_data)
+
+def nodes_summary(rows):
+  total_nodes = len(rows)
+  offline_nodes = sum(1 for data in rows.values() if data['status'] == 'OFFLINE')
+  not_synced_nodes = sum(1 for data in rows.values() if data['status'] == 'NOT SYNCED')
+  synced_nodes = sum(1 for data in rows.values() if data['status'] in ('SYNCED', 'SYNCED & VERIFIED'))
+  verified_nodes = sum(1 for data in rows.values() if data['status'] == 'SYNCED & VERIFIED')
+  return f"Offline: {offline_nodes}/{total_nodes}, Not synced: {not_synced_nodes}/{total_nodes}, Synced: {synced_nodes}/{total_nodes}, Verified: {verified_nodes}/{total_nodes}"
 
-def print_all_nodes_summary():
-  global not_synced_nodes, synced_nodes, verified_nodes, total_nodes
+def best_node_summary(rows):
+  # the node the endpoint selector would send calls to, when any node answered
+  if not selector or all(data['status'] == 'OFFLINE' for data in rows.values()):
+    return ""
+  return f", best: {selector.best()}"
+
+def print_all_nodes_summary(rows):
   print()
-  print(f"Offline: {offline_nodes}/{total_nodes}, Not synced: {not_synced_nodes}/{total_nodes}, Synced: {synced_nodes}/{total_nodes}, Verified: {verified_nodes}/{total_nodes}")
+  print(nodes_summary(rows) + best_node_summary(rows))
+
+def render_metrics(rows):
+  gauges = [
+    ("spacemesh_node_up", "Whether the node answered the last probe", lambda data: 0 if data['status'] == 'OFFLINE' else 1),
+    ("spacemesh_node_synced", "Whether the node is synced", lambda data: 1 if data['status'] in ('SYNCED', 'SYNCED & VERIFIED') else 0),
+    ("spacemesh_node_connected_peers", "Connected peers", lambda data: data['peers']),
+    ("spacemesh_node_top_layer", "Top layer", lambda data: data['topLayer']),
+    ("spacemesh_node_synced_layer", "Synced layer", lambda data: data['syncedLayer']),
+    ("spacemesh_node_verified_layer", "Verified layer", lambda data: data['verifiedLayer']),
+    ("spacemesh_node_layer_lag", "Top layer minus synced layer", lambda data: data['lag']),
+    ("spacemesh_node_layer_lag_rate", "Change of the layer lag in layers per minute", lambda data: data['lagRatePerMinute']),
+    ("spacemesh_node_probe_latency_seconds", "Latency of the last NodeService.Status call", lambda data: data['latencySeconds']),
+  ]
+  lines = []
+  for name, help_text, value in gauges:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} gauge")
+    for data in rows.values():
+      metric_value = value(data)
+      if metric_value is not None:
+        lines.append(f'{name}{{node="{data["name"]}",port="{data["port"]}"}} {metric_value}')
+  lines.append("# EOF")
+  return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path != "/metrics":
+      self.send_error(404)
+      return
+    with metrics_lock:
+      body = render_metrics(metrics_rows).encode("utf-8")
+    self.send_response(200)
+    self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
 
+def start_metrics_server(port):
+  server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+def watch(interval):
+  global args, metrics_rows
+  # rows start below the 5 banner lines and the title/separator rows
+  first_row_line = 8
+  history = {}
+  screen_rows = None
+  while True:
+    started = time.monotonic()
+    node_status = probe_all_nodes(nodes, args.node_version, args.timeout, min(args.deadline, interval), args.workers)
+    record_history(history, node_status, args.history)
+    rows = { node: column_data_from_node(status, history.get(node), latency_step=10) for node, status in node_status.items() }
+    with metrics_lock:
+      metrics_rows = rows
+
+    summary = f"{nodes_summary(rows)}{best_node_summary(rows)} (updated {time.strftime('%H:%M:%S')})"
+    if screen_rows is None or update_column_widths(rows):
+      sys.stdout.write("\x1b[2J\x1b[H")
+      print_all_node_status(rows)
+      print()
+      print(summary)
+    else:
+      # only rewrite the rows whose rendered text changed since the last refresh
+      for index, node in enumerate(rows):
+        line = format_node_row(rows[node])
+        if line != screen_rows[index]:
+          sys.stdout.write(f"\x1b[{first_row_line + index};1H{line}\x1b[K")
+      summary_line = first_row_line + len(rows) + 1
+      sys.stdout.write(f"\x1b[{summary_line};1H{summary}\x1b[K\x1b[{summary_line + 1};1H")
+    sys.stdout.flush()
+    screen_rows = [format_node_row(column_data) for column_data in rows.values()]
+
+    time.sleep(max(0, interval - (time.monotonic() - started)))
 
 def main():
-  global args, not_synced_nodes, synced_nodes, verified_nodes, total_nodes, offline_nodes, columns
+  global args, columns, tracer, selector
 
   args = parse_options()
+  tracer = Tracer("public-nodes", args.data_dir, args.profile)
+  selector = EndpointSelector(nodes, timeout=args.timeout, workers=args.workers)
   columns = [
     { "name": "Node", "key": "name", "width": 4, "align": "left", "align_char": " ", "enabled": True },
     { "name": "Port", "key": "port", "width": 4, "align": "right", "align_char": " ", "enabled": True },
@@ -158,44 +333,30 @@ def main():
     { "name": "Peers", "key": "peers", "width": 5, "align": "right", "align_char": " ", "enabled": True },
     { "name": "Top", "key": "topLayer", "width": 3, "align": "right", "align_char": " ", "enabled": True },
     { "name": "Synced", "key": "syncedLayer", "width": 6, "align": "right", "align_char": " ", "enabled": True },
-    { "name": "Verified", "key": "verifiedLayer", "width": 8, "align": "right", "align_char": " ", "enabled": True }
+    { "name": "Verified", "key": "verifiedLayer", "width": 8, "align": "right", "align_char": " ", "enabled": True },
+    { "name": "Lag", "key": "lag", "width": 3, "align": "right", "align_char": " ", "enabled": bool(args.watch) },
+    { "name": "Lag/min", "key": "lagRate", "width": 7, "align": "right", "align_char": " ", "enabled": bool(args.watch) },
+    { "name": "Latency", "key": "latency", "width": 7, "align": "right", "align_char": " ", "enabled": True }
   ]
 
-  # Check if grpcurl is installed
-  try:
-      result = subprocess.run(["grpcurl", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-  except:
-      download_grpcurl()
+  if args.metrics_port:
+    start_metrics_server(args.metrics_port)
 
-  node_status = {}
-  for node in nodes:
-      node_name, node_port = node.split(':')
-      node_status[node] = { 'name': node_name, 'port': node_port }
-      try:
-        result = subprocess.run(["grpcurl", "-plaintext", "-d", "", node, "spacemesh.v1.NodeService.Status"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        node_status[node] = json.loads(result.stdout.decode('utf-8'))['status']
-        node_status[node]['name'] = node_name
-        node_status[node]['port'] = node_port
-      except:
-        continue
-
-      if args.node_version:
-        try:
-          result = subprocess.run(["grpcurl", "-plaintext", "-d", "", node, "spacemesh.v1.NodeService.Version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        except:
-          print(f"Error: Failed to connect to {node}.")
-          sys.exit(1)
-        version = json.loads(result.stdout.decode('utf-8'))['versionString']['value']
-        node_status[node]['version'] = version
-
-  not_synced_nodes = 0
-  synced_nodes = 0
-  verified_nodes = 0
-  offline_nodes = 0
-  total_nodes = len(node_status.keys())
-
-  print_all_node_status(node_status)
-  print_all_nodes_summary()
+  if args.watch:
+    try:
+      watch(args.watch)
+    except KeyboardInterrupt:
+      print()
+      tracer.finish()
+      sys.exit(0)
+
+  with tracer.span("check", "Health check of all nodes"):
+    node_status = probe_all_nodes(nodes, args.node_version, args.timeout, args.deadline, args.workers)
+  rows = { node: column_data_from_node(status) for node, status in node_status.items() }
+
+  print_all_node_status(rows)
+  print_all_nodes_summary(rows)
+  tracer.finish()
 
 if __name__ == "__main__":
   main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+#
+# In-process client for the Spacemesh v1 gRPC API.
+#
+# Keeps one persistent channel per endpoint and encodes/decodes the handful of
+# protobuf messages auto-spacemesh needs by hand, so no generated stubs or
+# grpcurl binary are required.
+#
+# Usage:
+#
+#   spacemesh_api.py status <endpoint>
+#   spacemesh_api.py wait-peers <endpoint>
+#   spacemesh_api.py start-smeshing <endpoint> --coinbase ADDR --data-dir DIR --num-units N --max-file-size BYTES
+#   spacemesh_api.py wait-post-state <endpoint> STATE [STATE ...]
+#   spacemesh_api.py stop-smeshing <endpoint>
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent import futures
+
+import grpc
+
+NodeStatus = namedtuple("NodeStatus", ["connected_peers", "is_synced", "synced_layer", "top_layer", "verified_layer"])
+PostSetupStatus = namedtuple("PostSetupStatus", ["state", "num_labels_written"])
+Activation = namedtuple("Activation", ["id", "layer", "smesher_id", "coinbase", "num_units", "sequence"])
+
+post_setup_states = [
+  "STATE_UNSPECIFIED",
+  "STATE_NOT_STARTED",
+  "STATE_PREPARED",
+  "STATE_IN_PROGRESS",
+  "STATE_PAUSED",
+  "STATE_COMPLETE",
+  "STATE_ERROR",
+]
+
+# Protobuf wire format (only varint and length-delimited fields are used by these messages)
+
+def encode_varint(value):
+  out = bytearray()
+  while True:
+    byte = value & 0x7f
+    value >>= 7
+    if value:
+      out.append(byte | 0x80)
+    else:
+      out.append(byte)
+      return bytes(out)
+
+def encode_message(fields):
+  # fields is a list of (field_number, value) pairs; ints/bools become varints, str/bytes length-delimited
+  out = bytearray()
+  for number, value in fields:
+    if value is None:
+      continue
+    if isinstance(value, (bool, int)):
+      out += encode_varint(number << 3 | 0)
+      out += encode_varint(int(value))
+    else:
+      if isinstance(value, str):
+        value = value.encode("utf-8")
+      out += encode_varint(number << 3 | 2)
+      out += encode_varint(len(value))
+      out += value
+  return bytes(out)
+
+def decode_message(data):
+  # returns {field_number: value}, keeping the last value of repeated fields
+  fields = {}
+  pos = 0
+  while pos < len(data):
+    key, pos = _decode_varint(data, pos)
+    number, wire_type = key >> 3, key & 0x7
+    if wire_type == 0:
+      value, pos = _decode_varint(data, pos)
+    elif wire_type == 2:
+      length, pos = _decode_varint(data, pos)
+      value, pos = data[pos:pos + length], pos + length
+    elif wire_type == 1:
+      value, pos = data[pos:pos + 8], pos + 8
+    elif wire_type == 5:
+      value, pos = data[pos:pos + 4], pos + 4
+    else:
+      raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+    fields[number] = value
+  return fields
+
+def _decode_varint(data, pos):
+  result = 0
+  shift = 0
+  while True:
+    byte = data[pos]
+    pos += 1
+    result |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return result, pos
+    shift += 7
+
+def _layer(data):
+  return decode_message(data).get(1, 0) if data is not None else None
+
+# Message codecs
+
+def encode_node_status(status):
+  return encode_message([
+    (1, status.connected_peers),
+    (2, status.is_synced),
+    (3, encode_message([(1, status.synced_layer)])),
+    (4, encode_message([(1, status.top_layer)])),
+    (5, encode_message([(1, status.verified_layer)])),
+  ])
+
+def decode_node_status(data):
+  fields = decode_message(data)
+  return NodeStatus(
+    connected_peers=fields.get(1, 0),
+    is_synced=bool(fields.get(2, 0)),
+    synced_layer=_layer(fields.get(3)),
+    top_layer=_layer(fields.get(4)),
+    verified_layer=_layer(fields.get(5)),
+  )
+
+def encode_status_response(status):
+  return encode_message([(1, encode_node_status(status))])
+
+def decode_status_response(data):
+  return decode_node_status(decode_message(data).get(1, b""))
+
+def encode_version_response(version):
+  return encode_message([(1, encode_message([(1, version)]))])
+
+def decode_version_response(data):
+  return decode_message(decode_message(data).get(1, b"")).get(1, b"").decode("utf-8")
+
+def encode_post_setup_status_response(status):
+  return encode_message([(1, encode_message([(1, post_setup_states.index(status.state)), (2, status.num_labels_written)]))])
+
+def decode_post_setup_status_response(data):
+  fields = decode_message(decode_message(data).get(1, b""))
+  state = fields.get(1, 0)
+  return PostSetupStatus(
+    state=post_setup_states[state] if state < len(post_setup_states) else "STATE_UNSPECIFIED",
+    num_labels_written=fields.get(2, 0),
+  )
+
+def encode_highest_response(atx):
+  return encode_message([(1, encode_message([
+    (1, encode_message([(1, bytes.fromhex(atx.id))])),
+    (2, encode_message([(1, atx.layer)])),
+    (3, encode_message([(1, bytes.fromhex(atx.smesher_id))])),
+    (4, encode_message([(1, atx.coinbase)])),
+    (6, atx.num_units),
+    (7, atx.sequence),
+  ]))])
+
+def decode_highest_response(data):
+  fields = decode_message(decode_message(data).get(1, b""))
+  return Activation(
+    id=decode_message(fields.get(1, b"")).get(1, b"").hex(),
+    layer=_layer(fields.get(2)),
+    smesher_id=decode_message(fields.get(3, b"")).get(1, b"").hex(),
+    coinbase=decode_message(fields.get(4, b"")).get(1, b"").decode("utf-8"),
+    num_units=fields.get(6, 0),
+    sequence=fields.get(7, 0),
+  )
+
+def encode_start_smeshing_request(coinbase, data_dir, num_units, max_file_size, provider_id=0, throttle=False):
+  return encode_message([
+    (1, encode_message([(1, coinbase)])),
+    (2, encode_message([(1, data_dir), (2, num_units), (3, max_file_size), (4, provider_id), (5, throttle)])),
+  ])
+
+def encode_stop_smeshing_request(delete_files=False):
+  return encode_message([(1, delete_files)])
+
+def _identity(data):
+  return data
+
+# Channel pool
+
+channels = {}
+channels_lock = threading.Lock()
+
+def get_channel(endpoint):
+  with channels_lock:
+    channel = channels.get(endpoint)
+    if channel is None:
+      channel = grpc.insecure_channel(endpoint, options=[("grpc.keepalive_time_ms", 30000)])
+      channels[endpoint] = channel
+    return channel
+
+def close_channel(endpoint):
+  with channels_lock:
+    channel = channels.pop(endpoint, None)
+  if channel is not None:
+    channel.close()
+
+def close_all_channels():
+  with channels_lock:
+    pooled = list(channels.values())
+    channels.clear()
+  for channel in pooled:
+    channel.close()
+
+class SpacemeshClient:
+  def __init__(self, endpoint, timeout=5.0):
+    self.endpoint = endpoint
+    self.timeout = timeout
+    self.channel = get_channel(endpoint)
+
+  def call(self, method, request, deserializer, timeout=None):
+    rpc = self.channel.unary_unary(f"/spacemesh.v1.{method}", request_serializer=_identity, response_deserializer=deserializer)
+    return rpc(request, timeout=timeout if timeout is not None else self.timeout)
+
+  def status(self, timeout=None):
+    return self.call("NodeService/Status", b"", decode_status_response, timeout)
+
+  def status_stream(self, timeout=None):
+    # yields NodeStatus whenever the node reports a change; cancel the returned iterator to stop
+    rpc = self.channel.unary_stream("/spacemesh.v1.NodeService/StatusStream", request_serializer=_identity, response_deserializer=decode_status_response)
+    return rpc(b"", timeout=timeout)
+
+  def version(self, timeout=None):
+    return self.call("NodeService/Version", b"", decode_version_response, timeout)
+
+  def highest_atx(self, timeout=None):
+    return self.call("ActivationService/Highest", b"", decode_highest_response, timeout)
+
+  def post_setup_status(self, timeout=None):
+    return self.call("SmesherService/PostSetupStatus", b"", decode_post_setup_status_response, timeout)
+
+  def start_smeshing(self, coinbase, data_dir, num_units, max_file_size, provider_id=0, throttle=False, timeout=None):
+    request = encode_start_smeshing_request(coinbase, data_dir, num_units, max_file_size, provider_id, throttle)
+    return self.call("SmesherService/StartSmeshing", request, _identity, timeout)
+
+  def stop_smeshing(self, delete_files=False, timeout=None):
+    return self.call("SmesherService/StopSmeshing", encode_stop_smeshing_request(delete_files), _identity, timeout)
+
+# Fake node for local testing: handlers maps "Service/Method" to a callable returning encoded response bytes,
+# stream_handlers to a generator of encoded responses
+
+def serve_fake_node(handlers, address="127.0.0.1:0", max_workers=8, stream_handlers=None):
+  server, endpoints = serve_fake_nodes(handlers, 1, address, max_workers, stream_handlers)
+  return server, endpoints[0]
+
+def serve_fake_nodes(handlers, count, address="127.0.0.1:0", max_workers=8, stream_handlers=None):
+  # one server listening on count ports, so many fake endpoints share a thread pool
+  def make_handler(handler):
+    return grpc.unary_unary_rpc_method_handler(lambda request, context: handler(request, context), request_deserializer=_identity, response_serializer=_identity)
+
+  def make_stream_handler(handler):
+    return grpc.unary_stream_rpc_method_handler(lambda request, context: handler(request, context), request_deserializer=_identity, response_serializer=_identity)
+
+  services = {}
+  for name, handler in handlers.items():
+    service, method = name.split("/")
+    services.setdefault(service, {})[method] = make_handler(handler)
+  for name, handler in (stream_handlers or {}).items():
+    service, method = name.split("/")
+    services.setdefault(service, {})[method] = make_stream_handler(handler)
+
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+  for service, methods in services.items():
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(f"spacemesh.v1.{service}", methods),))
+  host = address.rsplit(':', 1)[0]
+  endpoints = [f"{host}:{server.add_insecure_port(address)}" for _ in range(count)]
+  server.start()
+  return server, endpoints
+
+# Command line helpers used by stage1.sh (one process per wait loop instead of one grpcurl per poll)
+
+def wait_for_status(client, interval=1.0):
+  # until the node's gRPC API answers at all
+  while True:
+    try:
+      return client.status()
+    except grpc.RpcError:
+      pass
+    time.sleep(interval)
+
+def wait_for_peers(client, interval=1.0):
+  while True:
+    try:
+      if client.status().connected_peers > 0:
+        return
+    except grpc.RpcError:
+      pass
+    time.sleep(interval)
+
+def wait_for_post_state(client, states, interval=1.0):
+  while True:
+    try:
+      status = client.post_setup_status()
+      if status.state in states:
+        return status
+    except grpc.RpcError:
+      pass
+    time.sleep(interval)
+
+def main():
+  parser = argparse.ArgumentParser(description="Spacemesh v1 API client")
+  parser.add_argument("command", choices=["status", "version", "highest-atx", "wait-status", "wait-peers", "start-smeshing", "wait-post-state", "stop-smeshing"])
+  parser.add_argument("endpoint", help="gRPC endpoint (host:port)")
+  parser.add_argument("states", nargs="*", help="PostSetupStatus states to wait for (wait-post-state)")
+  parser.add_argument("--timeout", help="Per-call timeout in seconds", default=5.0, type=float)
+  parser.add_argument("--coinbase", help="Coinbase address (start-smeshing)")
+  parser.add_argument("--data-dir", help="PoST data directory (start-smeshing)")
+  parser.add_argument("--num-units", help="Number of units (start-smeshing)", default=4, type=int)
+  parser.add_argument("--max-file-size", help="Max PoST file size in bytes (start-smeshing)", default=2_147_483_648, type=int)
+  parser.add_argument("--provider-id", help="PoST provider ID (start-smeshing)", default=0, type=int)
+  args = parser.parse_args()
+
+  client = SpacemeshClient(args.endpoint, timeout=args.timeout)
+  try:
+    if args.command == "status":
+      print(client.status())
+    elif args.command == "version":
+      print(client.version())
+    elif args.command == "highest-atx":
+      print(client.highest_atx())
+    elif args.command == "wait-status":
+      wait_for_status(client)
+    elif args.command == "wait-peers":
+      wait_for_peers(client)
+    elif args.command == "start-smeshing":
+      client.start_smeshing(args.coinbase, args.data_dir, args.num_units, args.max_file_size, args.provider_id)
+    elif args.command == "wait-post-state":
+      print(wait_for_post_state(client, args.states).state)
+    elif args.command == "stop-smeshing":
+      client.stop_smeshing()
+  except grpc.RpcError as e:
+    print(f"Error: {args.command} failed on {args.endpoint}: {e.code().name}", file=sys.stderr)
+    sys.exit(1)
+  finally:
+    close_all_channels()
+
+if __name__ == "__main__":
+  main()
@@ -2,9 +2,14 @@
 #
 # Generate node identity and details
 #
+# Fast path for stage1.sh: instead of booting a go-spacemesh node, the
+# commitment ATX is taken from the highest ATX reported by the fastest synced
+# public node, and postdata_metadata.json, stage1.json and the tarball are
+# written directly.
+#
 # Usage:
 #
-#   stage1.sh
+#   stage1.py [--data-dir DIR] [--node HOST:PORT ...] [--num-units N] [--keystore FILE [--identity ID]] [--disk DIR ...]
 #
 # Author:
 #
@@ -12,45 +17,205 @@
 #
 
 import argparse
+import base64
 import json
 import os
+import sys
+import tarfile
 
+import grpc
 
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description="Generate node identity and details")
-parser.add_argument("--data-dir", help="Directory for data files", default="data")
-args = parser.parse_args()
-
-data_dir = args.data_dir
-stage1_path = f"{data_dir}/stage1"
-stage1_config_path = f"{stage1_path}/stage1.json"
-if os.path.isfile(stage1_config_path):
-  config = json.load(open(stage1_config_path, "r"))
-else:
-  config = {
-    "node_id": None,
-    "node_id_first_8": None,
-    "commitment_atx_id": None,
-    "labels_per_unit": 4_294_967_296,
-    "num_units": 4,
-    "max_file_size": 2_147_483_648,
-  }
-  config["disk_size"] = config["num_units"] * 64
+from endpoint_selector import EndpointSelector, public_nodes
+from keystore import Keystore, export_key, keystore_lock
+from node_config import default_coinbase, download_template, write_node_config
+from post_layout import run_layout
+from tracing import Tracer
 
-# Check if node_id is provided otherwise generate it
-if not config.get("node_id"):
-  print("S1.1 Generating node ID")
-  # generate a ed25518 key pair using pynacl
+def generate_key(stage1_path):
+  # generate a ed25519 key pair using pynacl
   import nacl.encoding
   import nacl.signing
   signing_key = nacl.signing.SigningKey.generate()
   verify_key = signing_key.verify_key
-  signing_key_hex = signing_key.encode(encoder=nacl.encoding.HexEncoder).decode('utf-8')
   node_id = verify_key.encode(encoder=nacl.encoding.HexEncoder).decode("utf-8")
   bin_file = f"{stage1_path}/key.bin"
-  with open(bin_file, "wb") as f:
-    f.write(signing_key.encode())
-  print(f"S1.1   - Node ID: {node_id} (saved to {bin_file})")
-else :
-  print(f"S1.1 Loaded node ID from {stage1_config_path}")
-  print(f"S1.1   - Node ID: {node_id}")
+  # go-spacemesh stores the 64 byte private key (seed + public key) hex encoded
+  with open(bin_file, "w") as f:
+    f.write((signing_key.encode() + verify_key.encode()).hex())
+  return node_id, bin_file
+
+def key_bin_node_id(stage1_path):
+  # node ID of the key.bin an earlier run left in stage1_path (the public key is the last 32 bytes), or None
+  bin_file = f"{stage1_path}/key.bin"
+  if not os.path.isfile(bin_file):
+    return None
+  with open(bin_file, "r") as f:
+    return f.read().strip()[64:] or None
+
+def take_keystore_identity(keystore_path, stage1_path, node_id=None):
+  # export key.bin of the given identity, or of the next one nobody has used yet. Exporting marks the identity
+  # as taken, so a rerun after a failure before stage1.json was written takes its key.bin's identity again
+  # instead of using up another one.
+  previous_node_id = key_bin_node_id(stage1_path)
+  # parallel stage 1 runs on the same keystore must not pick the same new identity
+  with keystore_lock(keystore_path):
+    keystore = Keystore(keystore_path, writable=True)
+    try:
+      identity = None
+      if node_id:
+        identity = keystore.find(node_id)
+      elif previous_node_id:
+        try:
+          identity = keystore.find(previous_node_id)
+        except KeyError:
+          pass
+      if identity is None:
+        identity = next(keystore.identities("new"), None)
+      if identity is None:
+        raise KeyError(f"No unused identity left in {keystore_path}")
+      return identity.node_id, export_key(keystore, identity, stage1_path)
+    finally:
+      keystore.close()
+
+def fetch_commitment_atx_id(nodes, timeout=10.0):
+  # the commitment ATX of a new identity is the highest ATX known to the network, asked from the fastest synced nodes
+  selector = EndpointSelector(nodes, timeout=timeout)
+  try:
+    selector.refresh()
+    atx, node = selector.hedged_call(lambda client: client.highest_atx())
+    return atx.id, node
+  except grpc.RpcError as e:
+    print(f"S1.2   - No node answered: {e.code().name}")
+    return None, None
+  finally:
+    selector.close()
+
+def write_metadata(stage1_path, config):
+  metadata = {
+    "NodeId": base64.b64encode(bytes.fromhex(config["node_id"])).decode("utf-8"),
+    "CommitmentAtxId": base64.b64encode(bytes.fromhex(config["commitment_atx_id"])).decode("utf-8"),
+    "LabelsPerUnit": config["labels_per_unit"],
+    "NumUnits": config["num_units"],
+    "MaxFileSize": config["max_file_size"],
+    "Nonce": None,
+    "LastPosition": None,
+  }
+  with open(f"{stage1_path}/postdata_metadata.json", "w") as f:
+    json.dump(metadata, f)
+
+def write_tarball(data_dir, stage1_path, node_id_first_8):
+  tarball_path = f"{data_dir}/{node_id_first_8}.stage1.tar.gz"
+  with tarfile.open(tarball_path, "w:gz") as tar:
+    for name in ["key.bin", "postdata_metadata.json", "stage1.json"]:
+      tar.add(f"{stage1_path}/{name}", arcname=name)
+  return tarball_path
+
+def run_stage1(data_dir, nodes, num_units=4, labels_per_unit=4_294_967_296, max_file_size=2_147_483_648, timeout=10.0, tracer=None, keystore_path=None, identity=None, disks=None, coinbase=default_coinbase):
+  tracer = tracer or Tracer("stage1")
+  stage1_path = f"{data_dir}/stage1"
+  stage1_config_path = f"{stage1_path}/stage1.json"
+  os.makedirs(stage1_path, exist_ok=True)
+  if os.path.isfile(stage1_config_path):
+    config = json.load(open(stage1_config_path, "r"))
+  else:
+    config = {
+      "node_id": None,
+      "node_id_first_8": None,
+      "commitment_atx_id": None,
+      "labels_per_unit": labels_per_unit,
+      "num_units": num_units,
+      "max_file_size": max_file_size,
+    }
+    config["disk_size"] = config["num_units"] * 64
+
+  # Check if node_id is provided otherwise generate it
+  with tracer.span("S1.1", "Generate node ID"):
+    if not config.get("node_id") and keystore_path:
+      print(f"S1.1 Taking node ID from keystore {keystore_path}")
+      try:
+        node_id, bin_file = take_keystore_identity(keystore_path, stage1_path, identity)
+      except (KeyError, ValueError) as e:
+        print(f"Error: {e.args[0]}")
+        sys.exit(1)
+      config["node_id"] = node_id
+      config["node_id_first_8"] = node_id[:8]
+      print(f"S1.1   - Node ID: {node_id} (saved to {bin_file})")
+    elif not config.get("node_id"):
+      print("S1.1 Generating node ID")
+      node_id, bin_file = generate_key(stage1_path)
+      config["node_id"] = node_id
+      config["node_id_first_8"] = node_id[:8]
+      print(f"S1.1   - Node ID: {node_id} (saved to {bin_file})")
+    else:
+      print(f"S1.1 Loaded node ID from {stage1_config_path}")
+      print(f"S1.1   - Node ID: {config['node_id']}")
+
+  with tracer.span("S1.2", "Retrieve commitment ATX"):
+    if not config.get("commitment_atx_id"):
+      print("S1.2 Retrieving highest ATX as commitment ATX")
+      commitment_atx_id, node = fetch_commitment_atx_id(nodes, timeout)
+      if not commitment_atx_id:
+        print("Error: No node returned the highest ATX.")
+        sys.exit(1)
+      config["commitment_atx_id"] = commitment_atx_id
+      print(f"S1.2   - Commitment ATX ID: {commitment_atx_id} (from {node})")
+    else:
+      print(f"S1.2   - Commitment ATX ID: {config['commitment_atx_id']}")
+
+  with tracer.span("S1.3", "Write metadata"):
+    print("S1.3 Writing postdata_metadata.json, stage1.json and config.json")
+    write_metadata(stage1_path, config)
+    with open(stage1_config_path, "w") as f:
+      json.dump(config, f, indent=2)
+    # the node config stage1.sh would have generated, from the same mainnet template
+    if not os.path.isfile(f"{stage1_path}/config.mainnet.json"):
+      try:
+        download_template(stage1_path)
+      except (OSError, ValueError) as e:
+        print(f"Error: Could not download the mainnet config template: {e}")
+        sys.exit(1)
+    write_node_config(stage1_path, coinbase)
+
+  with tracer.span("S1.4", "Bundle tarball"):
+    print("S1.4 Bundling node smesher data")
+    tarball_path = write_tarball(data_dir, stage1_path, config["node_id_first_8"])
+    print(f"S1.4   - Created tarball at {tarball_path} containing stage1.json, postdata_metadata.json and key.bin")
+
+  if disks:
+    with tracer.span("S1.5", "Plan PoST layout"):
+      print(f"S1.5 Spreading the PoST files over {len(disks)} disks")
+      try:
+        run_layout(config, stage1_path, disks, log=lambda line: print(f"S1.5 {line}"))
+      except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+      with open(stage1_config_path, "w") as f:
+        json.dump(config, f, indent=2)
+  return config
+
+def main():
+  # Parse command-line arguments
+  parser = argparse.ArgumentParser(description="Generate node identity and details")
+  parser.add_argument("--data-dir", help="Directory for data files", default="data")
+  parser.add_argument("--node", help="Node to query for the highest ATX (repeatable, default: the public nodes)", action="append")
+  parser.add_argument("--num-units", help="Number of PoST units", default=4, type=int)
+  parser.add_argument("--labels-per-unit", help="Labels per unit", default=4_294_967_296, type=int)
+  parser.add_argument("--max-file-size", help="Max PoST file size in bytes", default=2_147_483_648, type=int)
+  parser.add_argument("--timeout", help="RPC timeout in seconds", default=10.0, type=float)
+  parser.add_argument("--keystore", help="Take the identity from this keystore instead of generating one (see keystore.py)")
+  parser.add_argument("--identity", help="Node ID or prefix to take from --keystore (default: the next unused one)")
+  parser.add_argument("--coinbase", help="Coinbase address written into config.json", default=default_coinbase)
+  parser.add_argument("--disk", help="Spread the PoST files over this directory (repeatable, one per disk, see post_layout.py)", action="append")
+  parser.add_argument("--profile", action="store_true", help="Print the slowest steps at the end")
+  args = parser.parse_args()
+
+  print("Stage 1 Started")
+  tracer = Tracer("stage1", args.data_dir, args.profile)
+  try:
+    run_stage1(args.data_dir, args.node or public_nodes, args.num_units, args.labels_per_unit, args.max_file_size, args.timeout, tracer, args.keystore, args.identity, args.disk, args.coinbase)
+  finally:
+    tracer.finish()
+  print("Stage 1 Complete")
+
+if __name__ == "__main__":
+  main()
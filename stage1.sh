@@ -4,7 +4,7 @@
 #
 # Usage:
 #
-#   stage1.sh
+#   stage1.sh [GO_SPACEMESH_DIR] [DATA_DIR] [--profile]
 #
 # Author:
 #
@@ -36,13 +36,26 @@ spacemesh_data_dir="$stage1_dir/smesh-node-data"
 filelock="/tmp/sm.lock"
 listen="/ip4/0.0.0.0/tcp/7555"
 smeshing_opts_datadir="$stage1_dir"
+profile=""
+[[ " $* " == *" --profile "* ]] && profile="--profile"
+
+# Step timing, recorded in $data_dir/traces/stage1.jsonl (see tracing.py)
+stage1_started=$(date +%s.%N)
+step_begin() {
+  step_started=$(date +%s.%N)
+}
+step_end() {
+  python3 tracing.py record --data-dir "$data_dir" --stage stage1 --step "$1" --name "$2" --start "$step_started" --outcome "${3:-ok}"
+}
 
 # Retrieve the latest mainnet config template from https://smapp.spacemesh.network/config.mainnet.json
 echo "S1.1 Retrieving latest mainnet config template"
-wget https://smapp.spacemesh.network/config.mainnet.json -O $stage1_dir/config.mainnet.json -q
+step_begin
+wget https://smapp.spacemesh.network/config.mainnet.json -O $stage1_dir/config.mainnet.json -q && step_end S1.1 "Template download" || step_end S1.1 "Template download" error
 
 # Generate a new config.json from template
 echo "S1.2 Generating config.json"
+step_begin
 
 # Load and parse the config.json template
 template=$(cat $stage1_dir/config.mainnet.json)
@@ -82,67 +95,57 @@ template=$(echo "$template" | jq '.smeshing = '"$smeshing")
 
 # Persist the new config.json
 echo "$template" > $config_file
+step_end S1.2 "Generate config.json"
 
 
 # Spin up a new go-spacemesh node with the config.json
 echo "S1.3 Starting go-spacemesh node"
+step_begin
 $go_spacemesh_bin -d $spacemesh_data_dir --config $config_file --filelock $filelock --listen $listen --smeshing-opts-datadir $smeshing_opts_datadir > $go_spacemesh_log &
+# the node has booted once its gRPC API answers
+python3 spacemesh_api.py wait-status "$grpc_public_listener" > /dev/null
+step_end S1.3 "Node boot"
 
 # Wait for the node to be ready
 echo "S1.4 Waiting for node to be ready"
-while true; do
-  status=$(grpcurl -plaintext -d '' "$grpc_public_listener" spacemesh.v1.NodeService.Status 2>/dev/null)
-  connected_peers=$(echo "$status" | jq -r '.status.connectedPeers')
-  connected_peers=$((connected_peers + 0))
-  if [ "$connected_peers" -gt 0 ]; then
-    echo "S1.4 Node is ready"
-    break
-  fi
-  # is_synced=$(echo "$status" | jq -r '.status.isSynced')
-  # if [ "$is_synced" = "true" ]; then
-  #   echo "S1.4 Node is synced"
-  #   break
-  # fi
-  sleep 1
-done
+step_begin
+python3 spacemesh_api.py wait-peers "$grpc_public_listener"
+step_end S1.4 "Peer wait"
+echo "S1.4 Node is ready"
 
 # Start the node's smesher service
 echo "S1.5 Starting node smesher"
-command="jq -n --arg coinbase \"$coinbase\" --arg data_dir \"$stage1_dir\" '{ \"coinbase\": { \"address\": \"$coinbase\" }, \"opts\": { \"data_dir\": \"$data_dir\", \"num_units\": 6, \"max_file_size\": 2147483648, \"provider_id\": 0, \"throttle\": false } }'"
-payload=$(eval "$command")
-status=$(grpcurl -plaintext -d "$payload" "$grpc_private_listener" spacemesh.v1.SmesherService.StartSmeshing)
-while true; do
-  status=$(grpcurl -plaintext -d '' "$grpc_private_listener" spacemesh.v1.SmesherService.PostSetupStatus)
-  state=$(echo "$status" | jq -r '.status.state')
-  if [ "$state" = "STATE_NOT_STARTED" ] || [ "$state" = "STATE_PREPARED" ] || [ "$state" = "STATE_IN_PROGRESS" ]; then
-    echo "S1.5 Node smesher is prepared"
-    break
-  fi
-  sleep 1
-done
+step_begin
+python3 spacemesh_api.py start-smeshing "$grpc_private_listener" --coinbase "$coinbase" --data-dir "$data_dir" --num-units 6 --max-file-size 2147483648
+python3 spacemesh_api.py wait-post-state "$grpc_private_listener" STATE_NOT_STARTED STATE_PREPARED STATE_IN_PROGRESS > /dev/null
+step_end S1.5 "PoST setup start"
+echo "S1.5 Node smesher is prepared"
 
 # Get the node's smeshing service post setup status and wait for it to be complete (STATE_COMPLETE)
 echo "S1.6 Waiting for node smesher setup to be complete"
-while true; do
-  status=$(grpcurl -plaintext -d '' "$grpc_private_listener" spacemesh.v1.SmesherService.PostSetupStatus)
-  state=$(echo "$status" | jq -r '.status.state')
-  if [ "$state" = "STATE_IN_PROGRESS" ]; then
-    echo "S1.6 Node smesher init is complete"
-    break
-  fi
-  if [ "$state" = "STATE_ERROR" ]; then
-    echo "S1.6 Node smesher has errored"
-    break
-  fi
-  sleep 1
-done
+step_begin
+# Report labels written, rate and ETA from the node log while waiting
+python3 log_follower.py "$go_spacemesh_log" --post-dir "$smeshing_opts_datadir" --from-start --prefix S1.6 --interval 30 &
+follower_pid=$!
+state=$(python3 spacemesh_api.py wait-post-state "$grpc_private_listener" STATE_IN_PROGRESS STATE_ERROR)
+kill $follower_pid 2> /dev/null
+[ "$state" = "STATE_ERROR" ] && step_end S1.6 "PoST setup init" error || step_end S1.6 "PoST setup init"
+if [ "$state" = "STATE_IN_PROGRESS" ]; then
+  echo "S1.6 Node smesher init is complete"
+fi
+if [ "$state" = "STATE_ERROR" ]; then
+  echo "S1.6 Node smesher has errored"
+fi
 
 # Stop the node's smesher service
 echo "S1.7 Stopping node smesher"
-status=$(grpcurl -plaintext -d '' "$grpc_private_listener" spacemesh.v1.SmesherService.StopSmeshing)
+step_begin
+python3 spacemesh_api.py stop-smeshing "$grpc_private_listener"
+step_end S1.7 "Stop smesher"
 
 # Stop the node
 echo "S1.8 Stopping node"
+step_begin
 port=$(echo "$listen" | awk -F/ '{print $NF}')
 echo "S1.8 Stopping node on port $port"
 pid=$(lsof -t -i :"$port")
@@ -157,6 +160,7 @@ while true; do
   sleep 1
 done
 rm -rf $filelock
+step_end S1.8 "Node shutdown"
 
 # Extract the details from the node's metadata file
 echo "S1.9 Extracting node smesher details"
@@ -175,6 +179,7 @@ echo "S1.9   - Max file size: $max_file_size"
 
 # Bundle up the node's smesher data directory and metadata file into a tarball
 echo "S1.10 Bundling node smesher data"
+step_begin
 echo '{
   "node_id": "'"$node_id"'",
   "node_id_first_8": "'"$node_id_first_8"'",
@@ -188,8 +193,10 @@ echo "S1.10   - Saved details to stage1.json"
 tar -czf $data_dir/$node_id_first_8.stage1.tar.gz -C $stage1_dir key.bin postdata_metadata.json stage1.json
 file_size=$(du -m $data_dir/$node_id_first_8.stage1.tar.gz | awk '{print $1}')
 echo "S1.10   - Created tarball at $data_dir/$node_id_first_8.stage1.tar.gz ($((file_size))MB) containing stage1.json, postdata_metadata.json and key.bin"
+step_end S1.10 "Bundle tarball"
 
 # Store the tarball + details locally or upload to a remote storage service
 # echo "S1.11 Uploading node smesher data to network storage"
 
+python3 tracing.py finish --data-dir "$data_dir" --stage stage1 --since "$stage1_started" $profile
 echo "Stage 1 Complete"
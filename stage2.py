@@ -12,24 +12,59 @@
 #
 
 import argparse
+import atexit
 import json
 import os
-import subprocess
-from time import sleep
 import runpod
 import sys
+import threading
+import time
+from epoch_scheduler import format_hours, format_time, identity_status, label_size, load_network, network_time, plan_identity
+from gpu_selector import gpu_labels_per_second, print_options, spot_supported, wait_for_gpu_options
+from post_runpod import check_joined_post, run_runpod_shards
+from post_shards import default_generator, generator_command, post_files, run_local_shards
+from post_ssh import build_hosts, load_inventory, run_ssh_shards
+from post_transfer import pull, transport_from_source
+from providers import LocalProvider, RunPodProvider, race_for_capacity
+from tracing import Tracer
 
 generate_post_url = "https://raw.githubusercontent.com/smeshcloud/multi-provider-generate-post/main/generate-post.sh"
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Generate PoST")
-parser.add_argument("--cloud", help="Cloud provider", required=False)
+parser.add_argument("--cloud", help="Cloud provider (runpod, local), comma-separated to race several for the first capacity", required=False)
 parser.add_argument("--cloud-key", help="Cloud provider API key", required=False)
 parser.add_argument("--local", action="store_true", help="Generate PoST locally")
-parser.add_argument("--ssh", action="store_true", help="Generate PoST remotely")
+parser.add_argument("--ssh", action="store_true", help="Generate PoST remotely on the --ssh-host / --inventory hosts")
 parser.add_argument("--ssh-key", help="SSH key for remote execution", required=False)
+parser.add_argument("--ssh-host", help="USER@HOST[:PORT] to generate on (repeatable)", action="append")
+parser.add_argument("--ssh-capacity", help="Generator slots per --ssh-host", default=1, type=int)
+parser.add_argument("--inventory", help="Host inventory file for --ssh (see post_ssh.py)", required=False)
+parser.add_argument("--remote-dir", help="Working directory on the SSH hosts (default: auto-spacemesh/post-<node id prefix>)", required=False)
 parser.add_argument("--gpu-quantity", help="Number of GPUs", default=1, type=int)
+parser.add_argument("--gpu-type", help="Only consider this RunPod GPU type", required=False)
+parser.add_argument("--gpu-market", help="GPU market to bid in", choices=["any", "spot", "on-demand"], default="any")
+parser.add_argument("--max-cost-per-tib", help="Skip GPU options above this estimated $/TiB of labels", type=float)
 parser.add_argument("--data-dir", help="Directory for data files", default="data")
+parser.add_argument("--post-dir", help="PoST output directory (default: <data-dir>/stage1)", required=False)
+parser.add_argument("--providers", help="Comma-separated PoST provider IDs, one generator per entry (repeat an ID for several CPU slots)", default="0")
+parser.add_argument("--shards", help="Number of file-range shards for local execution (default: one per provider)", type=int)
+parser.add_argument("--retries", help="Restarts allowed per failed shard", default=3, type=int)
+parser.add_argument("--pod-log-path", help="Generator log inside the pod, read over SSH for progress", default="/workspace/generate-post.log")
+parser.add_argument("--pods", help="Number of RunPod pods to shard the PoST across", default=1, type=int)
+parser.add_argument("--pod-post-dir", help="PoST directory inside the pods, pulled over SSH with --pods", default="/workspace/post")
+parser.add_argument("--pod-deadline", help="With --pods, give up on unfinished shards after this many hours", default=48, type=float)
+parser.add_argument("--fetch-source", help="Pull finished PoST files from this directory or user@host:dir while they are generated", required=False)
+parser.add_argument("--fetch-streams", help="Parallel streams for --fetch-source", default=4, type=int)
+parser.add_argument("--fetch-timeout", help="Give up fetching after this many seconds without a new PoST file", default=4 * 3600, type=float)
+parser.add_argument("--generator", help="Generator command template for local execution", default=default_generator)
+parser.add_argument("--local-price", help="$/hr charged for the local provider when racing", default=0.0, type=float)
+parser.add_argument("--local-labels-per-second", help="Labels/sec of the local provider, for its $/TiB", default=100_000, type=int)
+parser.add_argument("--schedule", action="store_true", help="Plan the job against the next PoET cycle gap first (see epoch_scheduler.py)")
+parser.add_argument("--target-epoch", help="With --schedule, stop before starting when this epoch's cycle gap cannot be made", type=int)
+parser.add_argument("--max-gpu-quantity", help="With --schedule, raise --gpu-quantity up to this to make the cycle gap", default=8, type=int)
+parser.add_argument("--labels-per-second", help="Labels/sec per GPU or slot for --schedule (default: the --gpu-type's rate, else --local-labels-per-second)", type=int)
+parser.add_argument("--profile", action="store_true", help="Print the slowest steps at the end")
 args = parser.parse_args()
 
 cloud_provider = args.cloud
@@ -53,6 +88,8 @@ if not (cloud_provider or local_execution or ssh_execution):
   sys.exit(1)
 
 print("Stage 2 Started")
+tracer = Tracer("stage2", data_dir, args.profile)
+atexit.register(tracer.finish)
 
 os.makedirs(stage2_path, exist_ok=True)
 print(f"S2.1 Loaded config from {stage1_config_path}")
@@ -60,123 +97,276 @@ print(f"S2.1   - Node ID: {stage1_config['node_id']}")
 print(f"S2.1   - Commitment ATX ID: {stage1_config['commitment_atx_id']}")
 print(f"S2.1   - Disk size: {stage1_config['disk_size']} GB")
 
+# Check the job against the PoET cycle gaps before paying for anything
+schedule = None
+if args.schedule:
+  network = load_network(f"{stage1_path}/config.mainnet.json")
+  now, layer, source = network_time(network)
+  identity = identity_status(data_dir, now)
+  if cloud_provider:
+    parallelism = args.gpu_quantity
+  elif local_execution:
+    parallelism = len([provider for provider in args.providers.split(",") if provider.strip()])
+  else:
+    parallelism = len(args.ssh_host or []) * args.ssh_capacity + sum(capacity for _, capacity, _ in (load_inventory(args.inventory) if args.inventory else []))
+  max_parallelism = max(parallelism, args.max_gpu_quantity) if cloud_provider else parallelism
+  labels_per_second = args.labels_per_second or gpu_labels_per_second.get(args.gpu_type) or args.local_labels_per_second
+  with tracer.span("S2.1", "Epoch schedule"):
+    schedule = plan_identity(network, now, identity['total_bytes'], identity['remaining_bytes'], labels_per_second * label_size, identity['proving_rate'], max_parallelism, args.target_epoch)
+  print(f"S2.1 Schedule - Layer {layer} ({source}), {identity['remaining_bytes'] / 2 ** 30:.0f} GiB left at {labels_per_second:,} labels/s per GPU")
+  gap = schedule['gap']
+  if not gap or (args.target_epoch is not None and gap['epoch'] != args.target_epoch):
+    target = args.target_epoch if args.target_epoch is not None else "any"
+    print(f"S2.1 Error: With at most {max_parallelism} GPUs/slots the PoST cannot be ready for the epoch {target} cycle gap, not starting.")
+    sys.exit(1)
+  for missed in schedule['missed']:
+    print(f"S2.1   - WARNING: Too late for the epoch {missed['epoch']} cycle gap (register by {format_time(missed['registration_deadline'])})")
+  print(f"S2.1   - Target: epoch {gap['epoch']} cycle gap at {format_time(gap['start'])}, PoST due {format_time(schedule['deadline'])}")
+  print(f"S2.1   - Needs {schedule['gpus']} GPUs/slots for {format_hours(schedule['generation_seconds'])}, latest start {format_time(schedule['latest_start'])}")
+  if schedule['gpus'] > parallelism:
+    if cloud_provider:
+      print(f"S2.1   - Raising --gpu-quantity from {args.gpu_quantity} to {schedule['gpus']} to make the cycle gap")
+      args.gpu_quantity = schedule['gpus']
+    else:
+      print(f"S2.1   - WARNING: Only {parallelism} slots configured, the PoST will miss the epoch {gap['epoch']} cycle gap")
+
+# Pull finished files from the producer in the background while generation runs
+fetch_thread = None
+fetch_errors = []
+if args.fetch_source:
+  fetch_dir = args.post_dir or stage1_path
+  fetch_transport = transport_from_source(args.fetch_source, ssh_key)
+  print(f"S2.2 Fetching PoST data from {args.fetch_source} into {fetch_dir} ({args.fetch_streams} streams)")
+
+  def fetch_post():
+    try:
+      pull(fetch_transport, fetch_dir, args.fetch_streams, timeout=args.fetch_timeout)
+    except OSError as e:
+      fetch_errors.append(e)
+    finally:
+      fetch_transport.close()
+
+  fetch_thread = threading.Thread(target=fetch_post, daemon=True)
+  fetch_thread.start()
+
 if local_execution:
-  print("S2.2 Local Execution - Running generate-post.sh locally")
+  post_dir = args.post_dir or stage1_path
+  providers = [provider.strip() for provider in args.providers.split(",") if provider.strip()]
+  print(f"S2.2 Local Execution - Generating PoST in {post_dir} with providers {', '.join(providers)}")
 
-  # Execute generate-post.sh locally
-  subprocess.run(["bash", "generate-post.sh"])
+  def save_local_state(shards):
+    json.dump({ 'mode': 'local', 'post_dir': post_dir, 'shards': shards }, open(stage2_config_path, "w"), indent=2)
 
-  # Rest of the local execution logic
+  with tracer.span("S2.3", "Local PoST generation"):
+    shards = run_local_shards(stage1_config, post_dir, providers, args.generator, args.shards, args.retries, on_update=save_local_state)
+  save_local_state(shards)
+  failed = [shard for shard in shards if shard['status'] != 'complete']
+  if failed:
+    print(f"S2.4 Local Execution - {len(failed)} shards failed, rerun stage2.py --local to resume")
+    sys.exit(1)
+  print("S2.4 Local Execution - All shards complete")
 
-# 3. Execute generate-post.sh remotely via SSH
+# 3. Generate on a pool of hosts via SSH, shards handed out from a shared queue
 elif ssh_execution:
-  if not ssh_key:
-    print("Error: --ssh-key option is required for remote execution (--ssh).")
+  inventory = [(host, args.ssh_capacity, [provider.strip() for provider in args.providers.split(",") if provider.strip()]) for host in args.ssh_host or []]
+  if args.inventory:
+    inventory += load_inventory(args.inventory)
+  if not inventory:
+    print("Error: --ssh needs at least one --ssh-host or an --inventory file.")
     sys.exit(1)
 
-  print("S2.2 Remote Execution - Running generate-post.sh remotely via SSH")
+  post_dir = args.post_dir or stage1_path
+  remote_dir = args.remote_dir or f"auto-spacemesh/post-{stage1_config['node_id_first_8']}"
+  hosts = build_hosts(inventory, remote_dir, ssh_key)
+  print(f"S2.2 Remote Execution - Generating PoST on {', '.join(host['name'] for host in hosts)} into {post_dir}")
 
-  # Execute generate-post.sh remotely via SSH
-  ssh_command = f"ssh -i {ssh_key} user@hostname 'bash generate-post.sh'"
-  subprocess.run(ssh_command, shell=True)
+  def save_ssh_state(shards):
+    json.dump({ 'mode': 'ssh', 'post_dir': post_dir, 'hosts': [host['name'] for host in hosts], 'shards': shards }, open(stage2_config_path, "w"), indent=2)
 
-  # Rest of the remote execution logic
+  with tracer.span("S2.3", "SSH PoST generation"):
+    shards = run_ssh_shards(stage1_config, post_dir, hosts, args.generator, args.shards, args.retries, on_update=save_ssh_state)
+  save_ssh_state(shards)
+  for host in hosts:
+    print(f"S2.4   - {host['name']}: {host['completed']} shards")
+  failed = [shard for shard in shards if shard['status'] != 'complete']
+  if failed:
+    print(f"S2.4 Remote Execution - {len(failed)} shards not complete, rerun stage2.py --ssh to resume")
+    sys.exit(1)
+  print("S2.4 Remote Execution - All shards complete")
 
 # 4. Execute generate-post.sh via cloud provider
 elif cloud_provider:
-  if cloud_provider == "runpod":
+  cloud_providers = [name.strip() for name in cloud_provider.split(",") if name.strip()]
+  if not cloud_providers or any(name not in ["runpod", "local"] for name in cloud_providers):
+    print("Invalid cloud provider. Supported options: runpod, local (comma-separated to race several)")
+    sys.exit(1)
+  if "runpod" in cloud_providers:
     # Set runpod cloud provider API key
     if not cloud_key:
       print("Error: --cloud-key option is required for cloud provider execution (--cloud).")
       sys.exit(1)
     runpod.api_key = cloud_key
+    if args.gpu_market == "spot" and not spot_supported():
+      print("Error: --gpu-market spot needs a runpod SDK that can bid for spot pods, use any or on-demand.")
+      sys.exit(1)
+  disk_size = stage1_config['disk_size']
+  total_bytes = int(stage1_config['num_units']) * int(stage1_config['labels_per_unit']) * 16
+
+  if args.pods > 1:
+    if cloud_providers != ["runpod"]:
+      print("Error: --pods only works with --cloud runpod.")
+      sys.exit(1)
 
     # Look for runpod availability
-    gpus = runpod.get_gpus()
+    with tracer.span("S2.2", "List GPUs"):
+      gpus = runpod.get_gpus()
     print("S2.2 Cloud (RunPod) - Available GPUs:")
     for gpu in gpus:
       print(f"S2.2  - {gpu['id']}")
 
-    gpu_selected = {'id': "NVIDIA GeForce RTX 4090", 'quantity': args.gpu_quantity}
-    gpu_selected = {'id': "NVIDIA GeForce RTX 3090", 'quantity': args.gpu_quantity}
-    # gpu_selected = {'id': "NVIDIA RTX 6000 Ada Generation", 'quantity': args.gpu_quantity}
-    print(f"S2.2 Cloud(RunPod) - Selected GPU: {gpu_selected['id']} ({gpu_selected['quantity']}x)")
-    disk_size = stage1_config['disk_size']
-    lowest_price = None
-    ondemand_price = None
-
-    print("S2.3 Cloud(RunPod) - Checking for pricing and availability...", end='', flush=True)
-    while lowest_price is None and ondemand_price is None:
-      gpu = runpod.get_gpu(gpu_selected['id'])
-      lowest_price = gpu['lowestPrice']['minimumBidPrice']
-      ondemand_price = gpu['lowestPrice']['uninterruptablePrice']
-      # print(gpu)
-      print(".", end='', flush=True)
-      sleep(5)
-    print()
-
-    # If runpod is available, run the pod
-    pod = None
-    print(f"S2.3 Cloud(RunPod) - Lowest price: {lowest_price * gpu_selected['quantity'] if lowest_price is not None else '-'}/hr")
-    print(f"S2.3 Cloud(RunPod) - On-demand price: {ondemand_price * gpu_selected['quantity']}/hr")
-    print(f"S2.3 Cloud(RunPod) - Trying to run a pod with {gpu_selected['quantity']} x GPU {gpu_selected['id']} and {disk_size}GB storage...")
-
-    # If runpod is not available, wait until it is
-    print("S2.4 Cloud(RunPod) - Waiting for availability...", end='', flush=True)
-    while pod is None:
-      pod = runpod.create_pod(
-        name=f"smesher {stage1_config['node_id_first_8']}",
-        image_name="ghcr.io/smeshcloud/nvidia-cuda-opencl",
-        gpu_type_id=gpu_selected['id'],
-        gpu_count=gpu_selected['quantity'],
-        container_disk_in_gb=disk_size,
-        docker_args=f"bash -c 'wget -O- {generate_post_url} | bash -s {disk_size} {stage1_config['node_id']}'",
-      )
-      # print("Pod is not available yet, trying again in 15 seconds...")
-      print('.', end='', flush=True)
-      sleep(15)
-    print(' submitted!')
-    # print(pod)
-
-    print(f"S2.4 Cloud(RunPod) - Pod {pod['id']} is now running")
-    print(f"S2.4  - Pod ID: {pod['id']}")
-    print(f"S2.4  - Pod Host ID: {pod['machine']['podHostId']}")
-    print(f"S2.4  - SSH Command: ssh {pod['machine']['podHostId']}@ssh.runpod.io -i ~/.ssh/id_ed25519")
+    # Rank every priced GPU by estimated $/TiB of labels
+    def rank_options():
+      return wait_for_gpu_options(gpus, args.gpu_quantity, total_bytes, args.gpu_market, args.max_cost_per_tib, args.gpu_type)
+
+    print("S2.3 Cloud(RunPod) - Checking pricing and availability of all GPU types...")
+    with tracer.span("S2.3", "Price GPU options"):
+      options = rank_options()
+    print_options(options)
+    gpu_selected = options[0]
+    print(f"S2.3 Cloud(RunPod) - Best option: {gpu_selected['id']} ({gpu_selected['quantity']}x, {gpu_selected['market']}) at ${gpu_selected['cost_per_tib']:.2f}/TiB")
+
+    # Split the identity's files across several pods and wait until all shards have arrived in post_dir
+    post_dir = args.post_dir or stage1_path
+    print(f"S2.4 Cloud(RunPod) - Sharding PoST across {args.pods} pods with {gpu_selected['quantity']} x GPU {gpu_selected['id']} each")
+    with tracer.span("S2.5", "Sharded pod generation"):
+      shards = run_runpod_shards(generate_post_url, stage1_config, gpu_selected, args.pods, post_dir, stage2_config_path,
+        ssh_key, args.pod_post_dir, args.fetch_streams, args.fetch_timeout, args.pod_deadline * 3600)
+    failed = [shard for shard in shards if shard['status'] != 'complete']
+    if failed:
+      print(f"S2.6 Cloud(RunPod) - {len(failed)} shards failed, rerun stage2.py to resume")
+      sys.exit(1)
+    problems = check_joined_post(post_dir, stage1_config)
+    if problems:
+      for problem in problems:
+        print(f"S2.6   - {problem}")
+      print("S2.6 Cloud(RunPod) - Shard outputs do not form a consistent PoST directory")
+      sys.exit(1)
+    print(f"S2.6 Cloud(RunPod) - All {len(shards)} shards joined in {post_dir}")
+
+  else:
+    # Ask every provider at once, keep the first usable capacity under the price ceiling and cancel the rest
+    providers = []
+    for name in cloud_providers:
+      if name == "runpod":
+        providers.append(RunPodProvider({
+          'name': f"smesher {stage1_config['node_id_first_8']}",
+          'image_name': "ghcr.io/smeshcloud/nvidia-cuda-opencl",
+          'container_disk_in_gb': disk_size,
+          'docker_args': f"bash -c 'wget -O- {generate_post_url} | bash -s {disk_size} {stage1_config['node_id']}'",
+        }, args.gpu_market, args.gpu_type, args.pod_log_path, ssh_key))
+      else:
+        post_dir = args.post_dir or stage1_path
+        files = post_files(stage1_config)
+        command = generator_command(args.generator, stage1_config, post_dir, args.providers.split(",")[0].strip(), 0, len(files) - 1)
+        providers.append(LocalProvider(command, post_dir, args.local_price, args.local_labels_per_second))
+    print(f"S2.3 Cloud - Racing {', '.join(cloud_providers)} for {args.gpu_quantity} x GPU and {disk_size}GB storage" + (f" under ${args.max_cost_per_tib:.2f}/TiB" if args.max_cost_per_tib else ""))
+    unreleased = []
+    with tracer.span("S2.4", "Capacity race"):
+      provider, gpu_selected, handle = race_for_capacity(providers, args.gpu_quantity, total_bytes, args.max_cost_per_tib, unreleased=unreleased)
+    for capacity in unreleased:
+      print(f"S2.4 Cloud - WARNING: {capacity['provider']} {capacity['id']} ({capacity['option']}) could not be cancelled and is still billed, release it manually: {capacity['error']}")
+    if not provider:
+      print("S2.4 Cloud - No provider had usable capacity")
+      sys.exit(1)
+    lowest_price = gpu_selected['lowest_price']
+    ondemand_price = gpu_selected['ondemand_price']
+    print(f"S2.4 Cloud({provider.name}) - Running on {gpu_selected['id']} ({gpu_selected['market']}, ${gpu_selected['price'] * gpu_selected['quantity']:.3f}/hr)")
+    details = provider.describe(handle)
+    for key, value in details.items():
+      print(f"S2.4  - {key}: {value}")
+    if provider.name == "runpod":
+      print(f"S2.4  - SSH Command: ssh {details['pod_host_id']}@ssh.runpod.io -i ~/.ssh/id_ed25519")
 
     # Write the pod details to a file
     pod_details = {
-      'pod_id': pod['id'],
-      'pod_host_id': pod['machine']['podHostId'],
+      'provider': provider.name,
+      **details,
       'gpu': {
         'quantity': gpu_selected['quantity'],
         'type': gpu_selected['id'],
+        'market': gpu_selected['market'],
+        'cost_per_tib': gpu_selected['cost_per_tib'],
         'lowest_price': lowest_price,
         'ondemand_price': ondemand_price,
       },
       'disk_size': disk_size,
     }
+    if unreleased:
+      pod_details['unreleased'] = unreleased
+    if schedule:
+      pod_details['schedule'] = { 'epoch': schedule['gap']['epoch'], 'deadline': schedule['deadline'] }
     json.dump(pod_details, open(f"{stage2_config_path}", "w"))
-    print(f"S2.4 Cloud(RunPod) - Pod details written to {stage2_config_path}")
+    print(f"S2.4 Cloud({provider.name}) - Details written to {stage2_config_path}")
+
+    # Follow the job until its output is complete, release the capacity once the output is safe and record the cost
+    print(f"S2.5 Cloud({provider.name}) - Waiting for generation to complete")
+    total_labels = int(stage1_config['num_units']) * int(stage1_config['labels_per_unit'])
+    # with --fetch-source the output is only complete once every file is verified locally, and lost when the transfer failed
+    def transfer_complete():
+      return not fetch_thread.is_alive() and not fetch_errors
 
-    # Wait for the pod to complete
-    print("S2.5 Cloud(RunPod) - Waiting for pod to complete", end='', flush=True)
-    print()
+    def transfer_failed():
+      return bool(fetch_errors)
 
-    print("S2.5 Cloud(RunPod) - Pod completed successfully")
+    def save_pod_progress(pod_status, labels_written, eta):
+      pod_details['labels_written'] = labels_written
+      pod_details['eta_seconds'] = eta
+      # warn once as soon as the job is predicted to finish after the cycle gap deadline
+      if schedule and eta is not None and time.time() + eta > schedule['deadline'] and not pod_details.get('late_warning'):
+        pod_details['late_warning'] = True
+        print(f"S2.5   - WARNING: ETA is {format_hours(time.time() + eta - schedule['deadline'])} past the epoch {schedule['gap']['epoch']} deadline ({format_time(schedule['deadline'])})")
+      json.dump(pod_details, open(stage2_config_path, "w"))
 
-    # If the pod fails, exit with an error
-    if pod['failure']:
-      print(f"S2.6 Cloud(RunPod) - Pod failed with error: {pod['failure']}")
+    with tracer.span("S2.5", "Pod generation"):
+      if fetch_thread:
+        result = provider.track(handle, total_labels, transfer_complete, transfer_failed, on_update=save_pod_progress)
+      else:
+        result = provider.track(handle, total_labels, on_update=save_pod_progress)
+    pod_details['status'] = result['status']
+    pod_details['labels_written'] = result['labels_written']
+    pod_details['runtime_seconds'] = result['runtime_seconds']
+    pod_details['final_cost'] = result['cost']
+    json.dump(pod_details, open(stage2_config_path, "w"))
+    print(f"S2.6 Cloud({provider.name}) - Ran for {result['runtime_seconds'] / 3600:.1f}h, cost ${result['cost']:.2f}")
+
+    # Without --fetch-source the pod holds the only copy of the PoST, so it is left running until the data is fetched
+    if result['status'] == 'generated':
+      print(f"S2.6 Cloud({provider.name}) - PoST generated, {handle['id']} is left running so the data can be fetched")
+      if result.get('ssh'):
+        ip, port = result['ssh']
+        print(f"S2.6  - SSH Command: ssh -p {port} root@{ip} -i ~/.ssh/id_ed25519")
+        print(f"S2.6  - Fetch Command: scp -P {port} -i ~/.ssh/id_ed25519 'root@{ip}:{args.pod_post_dir}/*' {args.post_dir or stage1_path}")
+      elif provider.name == "runpod":
+        print(f"S2.6  - SSH Command: ssh {details['pod_host_id']}@ssh.runpod.io -i ~/.ssh/id_ed25519")
+      print(f"S2.6  - Terminate {handle['id']} once the PoST data is fetched")
+    # If the job fails, exit with an error
+    elif result['status'] != 'complete':
+      print(f"S2.6 Cloud({provider.name}) - {handle['id']} stopped before the PoST output was complete")
+      if result.get('pod_kept'):
+        print(f"S2.6  - {handle['id']} was not terminated, its output can still be fetched")
       sys.exit(1)
+    elif result.get('pod_kept'):
+      print(f"S2.6 Cloud({provider.name}) - Completed successfully, but {handle['id']} could not be terminated, release it manually")
     else:
-      print("S2.6 Cloud(RunPod) - Pod completed successfully")
+      print(f"S2.6 Cloud({provider.name}) - Completed successfully and the capacity was released")
 
-  elif cloud_provider == "valt":
-    # Add Valt cloud provider logic here
-    print("S2.2 Cloud (Valt) - Valt cloud provider is not implemented yet.")
+if fetch_thread:
+  print("S2.7 Waiting for PoST data transfer to complete")
+  with tracer.span("S2.7", "PoST data transfer"):
+    fetch_thread.join()
+  if fetch_errors:
+    print(f"S2.7 Error: PoST data transfer failed: {fetch_errors[0]}")
     sys.exit(1)
-
-  else:
-    print("Invalid cloud provider. Supported options: runpod, valt")
+  print(f"S2.7 PoST data transferred and verified in {fetch_dir}")
 
 print("Stage 2 Completed")
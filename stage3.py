@@ -4,11 +4,209 @@
 #
 # Verify the Spacemesh PoST generation created by stage 2.
 #
+# Checks that every postdata_N.bin described by postdata_metadata.json exists
+# with the right size, then samples labels through mmap across a process pool
+# and flags unwritten (all-zero) labels. Progress is checkpointed per file so
+# an interrupted run resumes where it stopped.
+#
 # Usage:
 #
-#   stage3.py <path to config file>
+#   stage3.py [--data-dir DIR] [--post-dir DIR] [--sample-rate RATE] [--workers N]
+#   stage3.py --generate-synthetic --post-dir DIR --num-units N --labels-per-unit N --max-file-size BYTES
 #
 # Author:
 #
 #   Zanoryt <zanoryt@protonmail.com>
 #
+
+import argparse
+import hashlib
+import json
+import math
+import mmap
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+label_size = 16
+zero_label = bytes(label_size)
+
+def load_metadata(post_dir):
+  metadata_path = f"{post_dir}/postdata_metadata.json"
+  with open(metadata_path, "r") as f:
+    metadata = json.load(f)
+  for key in ["NumUnits", "LabelsPerUnit", "MaxFileSize"]:
+    if key not in metadata:
+      raise ValueError(f"{metadata_path} is missing {key}")
+  return metadata
+
+def expected_files(metadata):
+  # postdata_N.bin files are filled up to MaxFileSize, the last one holds the remainder
+  total_size = int(metadata["NumUnits"]) * int(metadata["LabelsPerUnit"]) * label_size
+  max_file_size = int(metadata["MaxFileSize"])
+  num_files = math.ceil(total_size / max_file_size)
+  return [(f"postdata_{index}.bin", min(max_file_size, total_size - index * max_file_size)) for index in range(num_files)]
+
+def check_file_sizes(post_dir, files):
+  problems = []
+  for name, size in files:
+    path = f"{post_dir}/{name}"
+    if not os.path.isfile(path):
+      problems.append(f"{name} is missing")
+    elif os.path.getsize(path) < label_size:
+      # nothing to sample in a file without a single whole label
+      problems.append(f"{name} is truncated ({os.path.getsize(path)} bytes, shorter than one {label_size} byte label)")
+    elif os.path.getsize(path) != size:
+      problems.append(f"{name} has size {os.path.getsize(path)}, expected {size}")
+  return problems
+
+def sample_file(path, size, sample_rate, seed):
+  # Read a deterministic spread of labels from one file; runs inside a worker process
+  num_labels = size // label_size
+  if num_labels == 0:
+    raise ValueError(f"{path} is shorter than one label")
+  num_samples = min(num_labels, max(1, int(num_labels * sample_rate)))
+  rng = random.Random(f"{seed}:{os.path.basename(path)}")
+  stride = num_labels / num_samples
+  positions = sorted(int(i * stride + rng.random() * stride) for i in range(num_samples))
+
+  digest = hashlib.sha256()
+  zero_labels = 0
+  with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+    if hasattr(data, "madvise"):
+      data.madvise(mmap.MADV_RANDOM)
+    for position in positions:
+      offset = position * label_size
+      label = data[offset:offset + label_size]
+      if label == zero_label:
+        zero_labels += 1
+      digest.update(label)
+  return { "samples": num_samples, "zero_labels": zero_labels, "digest": digest.hexdigest() }
+
+def load_checkpoint(checkpoint_path, sample_rate, seed):
+  if not os.path.isfile(checkpoint_path):
+    return {}
+  with open(checkpoint_path, "r") as f:
+    checkpoint = json.load(f)
+  if checkpoint.get("sample_rate") != sample_rate or checkpoint.get("seed") != seed:
+    return {}
+  return checkpoint.get("files", {})
+
+def save_checkpoint(checkpoint_path, post_dir, sample_rate, seed, results):
+  tmp_path = f"{checkpoint_path}.tmp"
+  with open(tmp_path, "w") as f:
+    json.dump({ "post_dir": post_dir, "sample_rate": sample_rate, "seed": seed, "files": results }, f, indent=2)
+  os.replace(tmp_path, checkpoint_path)
+
+def verify_post(post_dir, sample_rate=0.0001, workers=None, checkpoint_path=None, seed=0, log=print):
+  metadata = load_metadata(post_dir)
+  files = expected_files(metadata)
+  log(f"S3.1 Loaded metadata from {post_dir}/postdata_metadata.json")
+  log(f"S3.1   - Units: {metadata['NumUnits']}, labels per unit: {metadata['LabelsPerUnit']}, max file size: {metadata['MaxFileSize']}")
+  log(f"S3.1   - Expecting {len(files)} files")
+
+  log("S3.2 Checking PoST files")
+  problems = check_file_sizes(post_dir, files)
+  if problems:
+    for problem in problems:
+      log(f"S3.2   - {problem}")
+    return { "ok": False, "problems": problems, "files": {} }
+  log(f"S3.2   - All {len(files)} files present with the expected size")
+
+  results = load_checkpoint(checkpoint_path, sample_rate, seed) if checkpoint_path else {}
+  pending = []
+  for name, size in files:
+    path = f"{post_dir}/{name}"
+    previous = results.get(name)
+    if previous and previous.get("size") == size and previous.get("mtime") == os.path.getmtime(path):
+      continue
+    results.pop(name, None)
+    pending.append((name, path, size))
+  if len(pending) < len(files):
+    log(f"S3.3 Resuming from checkpoint, {len(files) - len(pending)} files already verified")
+
+  log(f"S3.3 Sampling labels (rate {sample_rate}) from {len(pending)} files with {workers or os.cpu_count()} workers")
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    futures = { executor.submit(sample_file, path, size, sample_rate, seed): (name, path, size) for name, path, size in pending }
+    for future in as_completed(futures):
+      name, path, size = futures[future]
+      result = future.result()
+      result["size"] = size
+      result["mtime"] = os.path.getmtime(path)
+      results[name] = result
+      if result["zero_labels"]:
+        log(f"S3.3   - {name}: {result['zero_labels']}/{result['samples']} sampled labels are unwritten")
+      if checkpoint_path:
+        save_checkpoint(checkpoint_path, post_dir, sample_rate, seed, results)
+
+  problems = [f"{name} has {result['zero_labels']} unwritten labels in {result['samples']} samples" for name, result in results.items() if result["zero_labels"]]
+  return { "ok": not problems, "problems": problems, "files": results }
+
+def generate_synthetic_post(post_dir, num_units, labels_per_unit, max_file_size, seed=0):
+  # Random-filled PoST directory with a matching metadata file, for testing the verifier
+  os.makedirs(post_dir, exist_ok=True)
+  metadata = {
+    "NodeId": None,
+    "CommitmentAtxId": None,
+    "LabelsPerUnit": labels_per_unit,
+    "NumUnits": num_units,
+    "MaxFileSize": max_file_size,
+  }
+  with open(f"{post_dir}/postdata_metadata.json", "w") as f:
+    json.dump(metadata, f)
+  rng = random.Random(seed)
+  chunk_size = 1 << 20
+  for name, size in expected_files(metadata):
+    with open(f"{post_dir}/{name}", "wb") as f:
+      remaining = size
+      while remaining > 0:
+        length = min(chunk_size, remaining)
+        f.write(rng.randbytes(length))
+        remaining -= length
+  return metadata
+
+def main():
+  parser = argparse.ArgumentParser(description="Verify PoST data")
+  parser.add_argument("--data-dir", help="Directory for data files", default="data")
+  parser.add_argument("--post-dir", help="PoST data directory (default: <data-dir>/stage1)")
+  parser.add_argument("--sample-rate", help="Fraction of labels to read", default=0.0001, type=float)
+  parser.add_argument("--workers", help="Number of worker processes", default=os.cpu_count(), type=int)
+  parser.add_argument("--seed", help="Seed for the sampled label positions", default=0, type=int)
+  parser.add_argument("--restart", action="store_true", help="Ignore the existing checkpoint")
+  parser.add_argument("--generate-synthetic", action="store_true", help="Write a synthetic PoST directory instead of verifying")
+  parser.add_argument("--num-units", help="Units for --generate-synthetic", default=1, type=int)
+  parser.add_argument("--labels-per-unit", help="Labels per unit for --generate-synthetic", default=1_048_576, type=int)
+  parser.add_argument("--max-file-size", help="Max file size for --generate-synthetic", default=4_194_304, type=int)
+  args = parser.parse_args()
+
+  data_dir = args.data_dir
+  post_dir = args.post_dir or f"{data_dir}/stage1"
+  stage3_path = f"{data_dir}/stage3"
+  checkpoint_path = f"{stage3_path}/stage3.json"
+
+  if args.generate_synthetic:
+    generate_synthetic_post(post_dir, args.num_units, args.labels_per_unit, args.max_file_size, args.seed)
+    print(f"Synthetic PoST data written to {post_dir}")
+    return
+
+  print("Stage 3 Started")
+  os.makedirs(stage3_path, exist_ok=True)
+  if args.restart and os.path.isfile(checkpoint_path):
+    os.remove(checkpoint_path)
+
+  try:
+    result = verify_post(post_dir, args.sample_rate, args.workers, checkpoint_path, args.seed)
+  except (OSError, ValueError) as e:
+    print(f"Error: {e}")
+    sys.exit(1)
+
+  if not result["ok"]:
+    print(f"S3.4 PoST verification failed ({len(result['problems'])} problems)")
+    sys.exit(1)
+  samples = sum(file_result["samples"] for file_result in result["files"].values())
+  print(f"S3.4 PoST verification passed ({samples} labels sampled)")
+  print("Stage 3 Completed")
+
+if __name__ == "__main__":
+  main()
@@ -4,11 +4,286 @@
 #
 # Run the Spacemesh node created by stage 3 and start mining (PoET challenges).
 #
+# Supervises go-spacemesh: starts it with the generated config.json, follows
+# its health through NodeService.StatusStream, restarts it with backoff when it
+# crashes or its synced layer stops advancing, rotates go-spacemesh.log and
+# serves uptime/restart metrics. The node's pid is kept in go-spacemesh.pid so
+# proving_coordinator.py can limit its reads while other identities prove.
+#
 # Usage:
 #
-#   stage4.py <path to config file>
+#   stage4.py [--data-dir DIR] [--go-spacemesh BIN] [--metrics-port PORT]
 #
 # Author:
 #
 #   Zanoryt <zanoryt@protonmail.com>
 #
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+
+from spacemesh_api import SpacemeshClient
+
+class RotatingLog:
+  # go-spacemesh.log, go-spacemesh.log.1, ... go-spacemesh.log.N
+  def __init__(self, path, max_bytes, backups):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.backups = backups
+    self.file = open(path, "ab")
+
+  def write(self, data):
+    if self.file.tell() + len(data) > self.max_bytes:
+      self.rotate()
+    self.file.write(data)
+    self.file.flush()
+
+  def rotate(self):
+    self.file.close()
+    for index in range(self.backups - 1, 0, -1):
+      if os.path.exists(f"{self.path}.{index}"):
+        os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+    if self.backups > 0:
+      os.replace(self.path, f"{self.path}.1")
+    else:
+      os.remove(self.path)
+    self.file = open(self.path, "ab")
+
+  def close(self):
+    self.file.close()
+
+class NodeSupervisor:
+  def __init__(self, command, endpoint, log_path, filelock=None, stall_timeout=1800, max_log_bytes=100 << 20, log_backups=5, min_backoff=1, max_backoff=300, healthy_after=600, pid_path=None, log=print):
+    self.command = command
+    self.endpoint = endpoint
+    self.filelock = filelock
+    # proving_coordinator.py finds the node process through this file
+    self.pid_path = pid_path
+    self.stall_timeout = stall_timeout
+    self.min_backoff = min_backoff
+    self.max_backoff = max_backoff
+    self.healthy_after = healthy_after
+    self.log = log
+    self.node_log = RotatingLog(log_path, max_log_bytes, log_backups)
+    self.process = None
+    self.stream = None
+    self.stopping = False
+    self.lock = threading.Lock()
+    # metrics
+    self.started_at = time.time()
+    self.node_started_at = None
+    self.restarts = 0
+    self.crashes = 0
+    self.stalls = 0
+    self.last_status = None
+    self.last_progress = None
+    self.last_recovery_seconds = None
+    self.down_since = None
+
+  def start_node(self):
+    # a crashed node leaves its filelock behind
+    if self.filelock and os.path.isdir(self.filelock):
+      shutil.rmtree(self.filelock, ignore_errors=True)
+    elif self.filelock and os.path.exists(self.filelock):
+      os.remove(self.filelock)
+    self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+    self.node_started_at = time.time()
+    self.last_progress = time.monotonic()
+    if self.pid_path:
+      with open(self.pid_path, "w") as f:
+        f.write(f"{self.process.pid}\n")
+    threading.Thread(target=self.copy_output, args=(self.process,), daemon=True).start()
+    threading.Thread(target=self.watch_status, args=(self.process,), daemon=True).start()
+    self.log(f"S4.1 Started go-spacemesh (pid {self.process.pid})")
+
+  def stop_node(self, timeout=30):
+    # detach the process first, so its watch_status thread does not open a new stream while it shuts down
+    with self.lock:
+      process = self.process
+      self.process = None
+      if self.stream:
+        self.stream.cancel()
+        self.stream = None
+    if not process or process.poll() is not None:
+      return
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+      process.wait(timeout)
+    except subprocess.TimeoutExpired:
+      os.killpg(process.pid, signal.SIGKILL)
+      process.wait()
+
+  def copy_output(self, process):
+    for line in iter(process.stdout.readline, b""):
+      with self.lock:
+        self.node_log.write(line)
+
+  def watch_status(self, process):
+    # follow StatusStream for as long as this process lives; reconnect when the stream drops
+    client = SpacemeshClient(self.endpoint)
+    while process.poll() is None and not self.stopping:
+      try:
+        with self.lock:
+          if process is not self.process:
+            return
+          stream = client.status_stream()
+          self.stream = stream
+        for status in stream:
+          previous = self.last_status
+          self.last_status = status
+          if previous is None or status.synced_layer > previous.synced_layer:
+            self.last_progress = time.monotonic()
+            if self.down_since is not None:
+              self.last_recovery_seconds = time.monotonic() - self.down_since
+              self.down_since = None
+              self.log(f"S4.2 Node healthy again after {self.last_recovery_seconds:.0f}s (synced layer {status.synced_layer})")
+      except grpc.RpcError:
+        pass
+      time.sleep(1)
+
+  def run(self):
+    failures = 0
+    self.start_node()
+    while not self.stopping:
+      time.sleep(1)
+      reason = None
+      code = self.process.poll()
+      if code is not None:
+        reason = f"exited with code {code}"
+        self.crashes += 1
+      elif time.monotonic() - self.last_progress > self.stall_timeout:
+        reason = f"synced layer stalled for {self.stall_timeout}s"
+        self.stalls += 1
+      if reason is None:
+        if time.time() - self.node_started_at > self.healthy_after:
+          failures = 0
+        continue
+
+      # restart with exponential backoff; the counter resets once the node stayed healthy
+      if self.down_since is None:
+        self.down_since = time.monotonic()
+      delay = min(self.max_backoff, self.min_backoff * 2 ** failures)
+      failures += 1
+      self.log(f"S4.3 go-spacemesh {reason}, restarting in {delay}s")
+      self.stop_node()
+      time.sleep(delay)
+      if self.stopping:
+        break
+      self.restarts += 1
+      self.start_node()
+    self.stop_node()
+    self.node_log.close()
+
+  def stop(self):
+    self.stopping = True
+
+  def metrics(self):
+    now = time.time()
+    status = self.last_status
+    values = [
+      ("spacemesh_supervisor_uptime_seconds", "Seconds since the supervisor started", now - self.started_at),
+      ("spacemesh_node_uptime_seconds", "Seconds since go-spacemesh was last started", now - self.node_started_at if self.node_started_at else 0),
+      ("spacemesh_node_restarts_total", "Restarts of go-spacemesh", self.restarts),
+      ("spacemesh_node_crashes_total", "go-spacemesh exits", self.crashes),
+      ("spacemesh_node_stalls_total", "Restarts because the synced layer stopped advancing", self.stalls),
+      ("spacemesh_node_last_recovery_seconds", "Time from the last failure until the node reported progress again", self.last_recovery_seconds),
+      ("spacemesh_node_synced_layer", "Synced layer from the status stream", status.synced_layer if status else None),
+      ("spacemesh_node_connected_peers", "Connected peers from the status stream", status.connected_peers if status else None),
+    ]
+    lines = []
+    for name, help_text, value in values:
+      if value is None:
+        continue
+      metric_type = "counter" if name.endswith("_total") else "gauge"
+      lines.append(f"# HELP {name} {help_text}")
+      lines.append(f"# TYPE {name} {metric_type}")
+      lines.append(f"{name} {value}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+def start_metrics_server(supervisor, port):
+  class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path != "/metrics":
+        self.send_error(404)
+        return
+      body = supervisor.metrics().encode("utf-8")
+      self.send_response(200)
+      self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+
+  server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+def config_grpc_address(config_path, default="127.0.0.1:9092"):
+  # the public gRPC listener stage 1 wrote into config.json, reached over loopback when it listens on all interfaces
+  with open(config_path, "r") as f:
+    listener = json.load(f).get("api", {}).get("grpc-public-listener")
+  if not listener:
+    return default
+  host, _, port = listener.rpartition(":")
+  if host in ("", "0.0.0.0", "[::]"):
+    host = "127.0.0.1"
+  return f"{host}:{port}"
+
+def main():
+  parser = argparse.ArgumentParser(description="Run and supervise the Spacemesh node")
+  parser.add_argument("--data-dir", help="Directory for data files", default="data")
+  parser.add_argument("--go-spacemesh", help="go-spacemesh binary", default="/go-spacemesh/build/go-spacemesh")
+  parser.add_argument("--config", help="Node config (default: <data-dir>/stage1/config.json)")
+  parser.add_argument("--node-data-dir", help="Node database directory (default: <data-dir>/stage4/node-data)")
+  parser.add_argument("--filelock", help="Node filelock, removed before every start", default="/tmp/sm.lock")
+  parser.add_argument("--listen", help="P2P listen address", default="/ip4/0.0.0.0/tcp/7513")
+  parser.add_argument("--grpc", help="Node public gRPC listener used for health checks (default: api.grpc-public-listener from the node config)")
+  parser.add_argument("--stall-timeout", help="Restart when the synced layer does not advance for this many seconds", default=1800, type=float)
+  parser.add_argument("--max-backoff", help="Maximum delay between restarts in seconds", default=300, type=float)
+  parser.add_argument("--log-max-mb", help="Rotate go-spacemesh.log at this size", default=100, type=int)
+  parser.add_argument("--log-backups", help="Rotated logs to keep", default=5, type=int)
+  parser.add_argument("--metrics-port", help="Serve uptime/restart metrics on this port", type=int)
+  parser.add_argument("node_args", nargs=argparse.REMAINDER, help="Extra go-spacemesh arguments (after --)")
+  args = parser.parse_args()
+
+  data_dir = args.data_dir
+  stage1_path = f"{data_dir}/stage1"
+  stage4_path = f"{data_dir}/stage4"
+  config_path = args.config or f"{stage1_path}/config.json"
+  node_data_dir = args.node_data_dir or f"{stage4_path}/node-data"
+  os.makedirs(node_data_dir, exist_ok=True)
+  if not os.path.isfile(config_path):
+    print(f"Error: Node config {config_path} does not exist, run stage 1 first.")
+    sys.exit(1)
+  grpc_address = args.grpc or config_grpc_address(config_path)
+
+  command = [args.go_spacemesh, "-d", node_data_dir, "--config", config_path, "--filelock", args.filelock, "--listen", args.listen, "--smeshing-opts-datadir", stage1_path]
+  command += [arg for arg in args.node_args if arg != "--"]
+
+  print("Stage 4 Started")
+  supervisor = NodeSupervisor(command, grpc_address, f"{stage4_path}/go-spacemesh.log", args.filelock, args.stall_timeout, args.log_max_mb << 20, args.log_backups, max_backoff=args.max_backoff, pid_path=f"{stage4_path}/go-spacemesh.pid")
+  if args.metrics_port:
+    start_metrics_server(supervisor, args.metrics_port)
+  signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.stop())
+  try:
+    supervisor.run()
+  except KeyboardInterrupt:
+    supervisor.stop()
+    supervisor.stop_node()
+  print("Stage 4 Completed")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+#
+# Run the auto-spacemesh stages as a dependency graph and skip the ones that
+# are already done.
+#
+# Every stage declares its inputs and outputs. After a stage succeeds their
+# fingerprints are recorded in <data-dir>/pipeline.json; on the next run a
+# stage whose inputs and outputs still match is skipped. Stages that were
+# interrupted are simply started again and resume from their own checkpoints
+# (stage 2 skips finished PoST files, stage 3 keeps stage3.json). Stages whose
+# dependencies are satisfied run concurrently, e.g. the mainnet config template
+# is downloaded while the key is generated.
+#
+# Usage:
+#
+#   stage_runner.py [--data-dir DIR] [--force STAGE] [--profile] [TARGET ...] [-- STAGE2 ARGS]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from log_follower import LogFollower, format_progress
+from node_config import default_coinbase, download_template
+from stage3 import expected_files, load_metadata
+from tracing import Tracer
+
+# inputs/outputs are callables returning paths, so outputs that depend on earlier stages (PoST files) are resolved late;
+# logs returns { log path: PoST directory or None } for stages whose progress is followed from a log
+Stage = namedtuple("Stage", ["name", "deps", "inputs", "outputs", "action", "logs"], defaults=[None])
+
+# files above this size are fingerprinted by size and mtime instead of content
+content_hash_limit = 16 << 20
+
+def fingerprint(paths):
+  # None when any path is missing
+  digest = hashlib.sha256()
+  for path in sorted(paths):
+    if not os.path.isfile(path):
+      return None
+    stat = os.stat(path)
+    digest.update(path.encode("utf-8"))
+    if stat.st_size > content_hash_limit:
+      digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    else:
+      with open(path, "rb") as f:
+        digest.update(hashlib.sha256(f.read()).digest())
+  return digest.hexdigest()
+
+def post_files(post_dir):
+  # the PoST files described by postdata_metadata.json, or just the metadata while it does not exist
+  try:
+    metadata = load_metadata(post_dir)
+  except (OSError, ValueError):
+    return [f"{post_dir}/postdata_metadata.json"]
+  return [f"{post_dir}/{name}" for name, _ in expected_files(metadata)]
+
+def build_pipeline(data_dir, stage2_args=None, stage4_args=None, coinbase=None):
+  stage1_path = f"{data_dir}/stage1"
+  stage1_files = [f"{stage1_path}/{name}" for name in ["stage1.json", "postdata_metadata.json", "key.bin"]]
+  stage2_args = stage2_args or ["--local"]
+  stages = [
+    Stage("template", [], lambda: [], lambda: [f"{stage1_path}/config.mainnet.json"], lambda: download_template(stage1_path)),
+    # stage1.py writes config.json from the template, downloading it itself when the template stage has not finished yet
+    Stage("stage1", [], lambda: [], lambda: stage1_files + [f"{stage1_path}/config.json"], [sys.executable, "stage1.py", "--data-dir", data_dir, "--coinbase", coinbase or default_coinbase]),
+    Stage("stage2", ["stage1"], lambda: stage1_files, lambda: [f"{data_dir}/stage2/stage2.json"] + post_files(stage1_path), [sys.executable, "stage2.py", "--data-dir", data_dir] + stage2_args),
+    Stage("stage3", ["stage2"], lambda: post_files(stage1_path), lambda: [f"{data_dir}/stage3/stage3.json"], [sys.executable, "stage3.py", "--data-dir", data_dir]),
+    # the node runs until stopped, so it has no outputs and is never skipped
+    Stage("stage4", ["stage3"], lambda: [f"{stage1_path}/config.json"], lambda: None, [sys.executable, "stage4.py", "--data-dir", data_dir] + (stage4_args or []), lambda: { f"{data_dir}/stage4/go-spacemesh.log": stage1_path }),
+  ]
+  return { stage.name: stage for stage in stages }
+
+def load_state(state_path):
+  if os.path.isfile(state_path):
+    with open(state_path, "r") as f:
+      return json.load(f)
+  return {}
+
+def save_state(state_path, state):
+  with open(f"{state_path}.tmp", "w") as f:
+    json.dump(state, f, indent=2)
+  os.replace(f"{state_path}.tmp", state_path)
+
+def up_to_date(stage, record):
+  if not record or record.get("status") != "done":
+    return False
+  outputs = stage.outputs()
+  if outputs is None:
+    return False
+  return record.get("inputs") == fingerprint(stage.inputs()) and record.get("outputs") == fingerprint(outputs)
+
+def required_stages(stages, targets):
+  needed = set()
+  pending = list(targets)
+  while pending:
+    name = pending.pop()
+    if name not in needed:
+      needed.add(name)
+      pending += stages[name].deps
+  return needed
+
+def run_stage(stage, log):
+  started = time.time()
+  try:
+    if callable(stage.action):
+      stage.action()
+      code = 0
+    else:
+      code = subprocess.run(stage.action).returncode
+  except Exception as e:
+    log(f"Pipeline: {stage.name} failed: {e}")
+    code = 1
+  return code, time.time() - started
+
+def follow_stage_logs(follower, stage_names, stop, interval=30, log=print):
+  # progress parsed from the stage logs, at most one line per log and interval
+  last_report = {}
+  while not stop.is_set():
+    for event in follower.poll(1.0):
+      name = stage_names[event.path]
+      if event.kind == "complete" or time.monotonic() - last_report.get(event.path, 0) >= interval:
+        last_report[event.path] = time.monotonic()
+        log(f"Pipeline: {name} {format_progress(follower.progress(event.path))}")
+  follower.close()
+
+def run_pipeline(stages, targets, state_path, force=(), workers=4, tracer=None, log=print):
+  # returns True when every target finished (or was already up to date)
+  needed = required_stages(stages, targets)
+  stage_names = {}
+  follower = LogFollower()
+  for name in needed:
+    for path, post_dir in (stages[name].logs() if stages[name].logs else {}).items():
+      follower.add(path, post_dir=post_dir)
+      stage_names[os.path.abspath(path)] = name
+  stop_following = threading.Event()
+  if stage_names:
+    threading.Thread(target=follow_stage_logs, args=(follower, stage_names, stop_following, 30, log), daemon=True).start()
+  else:
+    follower.close()
+  state = load_state(state_path)
+  pending = set(needed)
+  done = set()
+  failed = set()
+  running = {}
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    while pending or running:
+      # repeat the scan until nothing changes, skipped stages can unblock stages visited before them
+      changed = True
+      while changed:
+        changed = False
+        for name in sorted(pending):
+          stage = stages[name]
+          if any(dep in failed for dep in stage.deps):
+            pending.remove(name)
+            changed = True
+            failed.add(name)
+            log(f"Pipeline: {name} not started, a dependency failed")
+          elif all(dep in done for dep in stage.deps):
+            pending.remove(name)
+            changed = True
+            record = state.get(name)
+            if name not in force and up_to_date(stage, record):
+              done.add(name)
+              log(f"Pipeline: {name} up to date, skipped")
+              continue
+            if record and record.get("status") == "running":
+              log(f"Pipeline: {name} resuming interrupted run")
+            else:
+              log(f"Pipeline: {name} started")
+            state[name] = { "status": "running", "started_at": time.time() }
+            save_state(state_path, state)
+            running[executor.submit(run_stage, stage, log)] = name
+      if not running:
+        break
+
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        name = running.pop(future)
+        stage = stages[name]
+        code, duration = future.result()
+        if tracer:
+          tracer.record(name, f"Stage {name}", time.time() - duration, duration, "ok" if code == 0 else "error", None if code == 0 else f"exit code {code}")
+        if code == 0:
+          done.add(name)
+          outputs = stage.outputs()
+          state[name] = { "status": "done", "inputs": fingerprint(stage.inputs()), "outputs": fingerprint(outputs) if outputs is not None else None, "finished_at": time.time(), "duration": duration }
+          log(f"Pipeline: {name} done in {duration:.1f}s")
+        else:
+          failed.add(name)
+          state[name] = dict(state[name], status="failed", exit_code=code, finished_at=time.time())
+          log(f"Pipeline: {name} failed with exit code {code}")
+        save_state(state_path, state)
+  stop_following.set()
+  return not failed
+
+def main():
+  parser = argparse.ArgumentParser(description="Run the auto-spacemesh stages, skipping the ones that are up to date")
+  parser.add_argument("--data-dir", help="Directory for data files", default="data")
+  parser.add_argument("--force", help="Run this stage even when it is up to date (repeatable)", action="append", default=[])
+  parser.add_argument("--coinbase", help="Coinbase address written to config.json", default=default_coinbase)
+  parser.add_argument("--workers", help="Stages run at the same time", default=4, type=int)
+  parser.add_argument("--profile", action="store_true", help="Print the slowest stages at the end")
+  parser.add_argument("targets", nargs="*", help="Stages to bring up to date (default: stage3)", default=["stage3"])
+  argv = sys.argv[1:]
+  stage2_args = None
+  if "--" in argv:
+    stage2_args = argv[argv.index("--") + 1:]
+    argv = argv[:argv.index("--")]
+  args = parser.parse_args(argv)
+
+  stages = build_pipeline(args.data_dir, stage2_args, coinbase=args.coinbase)
+  for name in args.targets + args.force:
+    if name not in stages:
+      print(f"Error: Unknown stage {name} (choose from {', '.join(stages)})")
+      sys.exit(1)
+  os.makedirs(args.data_dir, exist_ok=True)
+  tracer = Tracer("pipeline", args.data_dir, args.profile)
+  ok = run_pipeline(stages, args.targets, f"{args.data_dir}/pipeline.json", args.force, args.workers, tracer)
+  tracer.finish()
+  if not ok:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,39 @@
+import json
+from datetime import datetime, timezone
+
+import epoch_scheduler
+from epoch_scheduler import cycle_gap, cycle_gaps, load_network, load_proving_rate, parse_time
+
+def utc(value):
+  return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+def test_mainnet_cycle_gap_ends_at_round_start():
+  # mainnet PoET rounds start on Monday 08:00 UTC, the 12h cycle gap before them opens Sunday 20:00 UTC
+  network = load_network()
+  gap = cycle_gap(network, 1)
+  assert gap["start"] == utc("2023-08-06T20:00:00")
+  assert gap["end"] == utc("2023-08-07T08:00:00")
+  assert gap["registration_deadline"] == utc("2023-08-07T07:00:00")
+  assert gap["eligible_epoch"] == 2
+
+def test_mainnet_cycle_gaps_stay_on_sunday_evening():
+  network = load_network()
+  for epoch in (2, 10, 25, 40):
+    gap = cycle_gap(network, epoch)
+    start = datetime.fromtimestamp(gap["start"], timezone.utc)
+    end = datetime.fromtimestamp(gap["end"], timezone.utc)
+    assert (start.weekday(), start.hour, start.minute) == (6, 20, 0)
+    assert (end.weekday(), end.hour, end.minute) == (0, 8, 0)
+    assert gap["end"] == parse_time(epoch_scheduler.mainnet["genesis_time"]) + epoch * 14 * 86400 + 240 * 3600
+
+def test_cycle_gaps_skip_passed_deadlines():
+  network = load_network()
+  gap = cycle_gap(network, 5)
+  # an hour into the gap registration is still open, after the deadline the next epoch's gap is first
+  assert cycle_gaps(network, gap["start"] + 3600, 1)[0]["epoch"] == 5
+  assert cycle_gaps(network, gap["registration_deadline"] + 1, 1)[0]["epoch"] == 6
+
+def test_proving_rate_comes_from_proving_json(tmp_path):
+  assert load_proving_rate(str(tmp_path)) == epoch_scheduler.default_proving_rate
+  (tmp_path / "proving.json").write_text(json.dumps({ "proving_rate": 123456789.0 }))
+  assert load_proving_rate(str(tmp_path)) == 123456789.0
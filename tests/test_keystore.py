@@ -0,0 +1,32 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import keystore
+import stage1
+
+def take(keystore_path, stage1_path):
+  return stage1.take_keystore_identity(keystore_path, stage1_path)[0]
+
+def test_parallel_runs_take_different_identities(tmp_path):
+  path = str(tmp_path / "keystore.bin")
+  node_ids = keystore.generate_identities(path, 4)
+  with ProcessPoolExecutor(4) as executor:
+    # generating more identities meanwhile must not lose a status change
+    generated = executor.submit(keystore.generate_identities, path, 2)
+    taken = list(executor.map(take, [path] * 4, [str(tmp_path / f"run{index}" / "stage1") for index in range(4)]))
+    generated.result()
+  assert sorted(taken) == sorted(node_ids)
+  store = keystore.Keystore(path)
+  assert sorted(identity.node_id for identity in store.identities("exported")) == sorted(node_ids)
+  assert len(list(store.identities("new"))) == 2
+  store.close()
+
+def test_rerun_takes_the_same_identity(tmp_path):
+  path = str(tmp_path / "keystore.bin")
+  keystore.generate_identities(path, 2)
+  stage1_path = str(tmp_path / "stage1")
+  first = take(path, stage1_path)
+  # stage1.json was never written, the next run picks up key.bin's identity
+  assert take(path, stage1_path) == first
+  store = keystore.Keystore(path)
+  assert len(list(store.identities("new"))) == 1
+  store.close()
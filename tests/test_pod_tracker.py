@@ -0,0 +1,55 @@
+import sys
+import types
+
+# the runpod SDK is only needed for the API calls, which are replaced below
+sys.modules.setdefault("runpod", types.ModuleType("runpod"))
+
+import pod_tracker
+
+pod = { "desiredStatus": "RUNNING", "costPerHr": 2.0, "runtime": { "uptimeInSeconds": 1800, "ports": [{ "privatePort": 22, "isIpPublic": True, "ip": "10.0.0.1", "publicPort": 2222 }] } }
+
+class FakeRunPod:
+  def __init__(self, failures=0):
+    self.failures = failures
+    self.terminated = []
+
+  def get_pod(self, pod_id):
+    if self.failures:
+      self.failures -= 1
+      raise ConnectionError("api down")
+    return pod
+
+  def terminate_pod(self, pod_id):
+    self.terminated.append(pod_id)
+
+def track(monkeypatch, fake, *args, **kwargs):
+  monkeypatch.setattr(pod_tracker, "runpod", fake)
+  monkeypatch.setattr(pod_tracker.time, "sleep", lambda seconds: None)
+  return pod_tracker.track_pod("pod-1", 100, *args, log=lambda message: None, **kwargs)
+
+def test_generated_output_keeps_the_pod(monkeypatch):
+  fake = FakeRunPod(failures=2)
+  result = track(monkeypatch, fake, lambda pod: "num_labels_written: 100")
+  assert result["status"] == "generated"
+  assert result["pod_kept"] and result["ssh"] == ("10.0.0.1", 2222)
+  assert result["cost"] == 1.0
+  assert fake.terminated == []
+
+def test_terminates_only_after_transfer(monkeypatch):
+  fake = FakeRunPod()
+  done = iter([False, False, True])
+  result = track(monkeypatch, fake, None, lambda: next(done), lambda: False)
+  assert result["status"] == "complete" and not result["pod_kept"]
+  assert fake.terminated == ["pod-1"]
+
+def test_failed_transfer_keeps_the_pod(monkeypatch):
+  fake = FakeRunPod()
+  result = track(monkeypatch, fake, None, lambda: False, lambda: True)
+  assert result["status"] == "failed" and result["pod_kept"]
+  assert fake.terminated == []
+
+def test_gives_up_after_consecutive_api_failures(monkeypatch):
+  fake = FakeRunPod(failures=5)
+  result = track(monkeypatch, fake, max_api_failures=5)
+  assert result["status"] == "untracked" and result["pod_kept"]
+  assert fake.terminated == []
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from post_layout import apply_layout, plan_layout
+
+def disk(path, device, free, read_rate):
+  os.makedirs(path, exist_ok=True)
+  return { "path": str(path), "device": device, "free": free, "read_rate": read_rate, "write_rate": read_rate }
+
+def postdata(count, size):
+  return [(f"postdata_{index}.bin", size) for index in range(count)]
+
+def test_faster_disk_gets_the_larger_share(tmp_path):
+  files = postdata(12, 100)
+  layout = plan_layout(files, [disk(tmp_path / "fast", 1, 10_000, 300), disk(tmp_path / "slow", 2, 10_000, 100)])
+  shares = { os.path.basename(item["path"]): item["bytes"] for item in layout["disks"] }
+  assert shares == { "fast": 900, "slow": 300 }
+  assert layout["proving_seconds"] == 3
+  assert layout["read_rate"] == 400
+  assert sorted(layout["files"]) == sorted(name for name, _ in files)
+
+def test_paths_on_one_filesystem_take_turns(tmp_path):
+  layout = plan_layout(postdata(4, 100), [disk(tmp_path / "a", 1, 10_000, 100), disk(tmp_path / "b", 1, 10_000, 100)])
+  assert [item["files"] for item in layout["disks"]] == [["postdata_0.bin", "postdata_2.bin"], ["postdata_1.bin", "postdata_3.bin"]]
+
+def test_free_space_is_respected(tmp_path):
+  layout = plan_layout(postdata(4, 100), [disk(tmp_path / "fast", 1, 100, 1000), disk(tmp_path / "slow", 2, 10_000, 1)])
+  assert [item["bytes"] for item in layout["disks"]] == [100, 300]
+  with pytest.raises(ValueError):
+    plan_layout(postdata(4, 100), [disk(tmp_path / "small", 1, 300, 100)])
+
+def test_apply_layout_links_files_to_their_disks(tmp_path):
+  files = postdata(4, 100)
+  layout = plan_layout(files, [disk(tmp_path / "a", 1, 10_000, 100), disk(tmp_path / "b", 2, 10_000, 100)])
+  post_dir = tmp_path / "post"
+  post_dir.mkdir()
+  # a file generated before the layout stays where it is
+  (post_dir / "postdata_0.bin").write_bytes(b"x" * 100)
+  apply_layout(str(post_dir), layout, files, "post-abcd1234", preallocate_files=False, log=lambda line: None)
+  assert not os.path.islink(post_dir / "postdata_0.bin")
+  for name, _ in files[1:]:
+    assert os.readlink(post_dir / name) == f"{layout['files'][name]}/post-abcd1234/{name}"
+    assert os.path.isdir(f"{layout['files'][name]}/post-abcd1234")
+
+def test_apply_layout_keeps_data_already_on_another_disk(tmp_path):
+  files = postdata(2, 100)
+  disks = [disk(tmp_path / "a", 1, 10_000, 100), disk(tmp_path / "b", 2, 10_000, 100)]
+  layout = plan_layout(files, disks)
+  post_dir = str(tmp_path / "post")
+  apply_layout(post_dir, layout, files, "sub", preallocate_files=False, log=lambda line: None)
+  name = "postdata_0.bin"
+  with open(os.readlink(f"{post_dir}/{name}"), "wb") as f:
+    f.write(b"x" * 10)
+  # a new plan moving the file elsewhere does not orphan the data written so far
+  moved = dict(layout, files=dict(layout["files"], **{ name: str(tmp_path / "b" if layout["files"][name].endswith("a") else tmp_path / "a") }))
+  original = layout["files"][name]
+  apply_layout(post_dir, moved, files, "sub", preallocate_files=False, log=lambda line: None)
+  assert os.readlink(f"{post_dir}/{name}") == f"{original}/sub/{name}"
+  assert moved["files"][name] == original
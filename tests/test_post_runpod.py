@@ -0,0 +1,80 @@
+import sys
+import threading
+import types
+
+# the runpod SDK is only needed for the API calls, which are replaced below
+sys.modules.setdefault("runpod", types.ModuleType("runpod"))
+
+import post_runpod
+
+# 8 files of 16 bytes
+config = { "node_id": "ab" * 32, "node_id_first_8": "abababab", "commitment_atx_id": "cd" * 32, "num_units": 2, "labels_per_unit": 4, "max_file_size": 16, "disk_size": 500 }
+gpu = { "id": "NVIDIA RTX A5000", "quantity": 1 }
+
+class FakeRunPod:
+  # every pod writes its shard's files when polled, except `lost_pod`, which exits on its second poll
+  def __init__(self, post_dir, lost_pod):
+    self.post_dir = post_dir
+    self.lost_pod = lost_pod
+    self.created = []
+    self.terminated = []
+    self.polls = {}
+
+  def create_pod(self, **kwargs):
+    self.created.append(kwargs)
+    return { "id": f"pod-{len(self.created)}", "machine": { "podHostId": f"host-{len(self.created)}" } }
+
+  def get_pod(self, pod_id):
+    self.polls[pod_id] = self.polls.get(pod_id, 0) + 1
+    if pod_id == self.lost_pod:
+      return { "desiredStatus": "EXITED" if self.polls[pod_id] > 1 else "RUNNING" }
+    env = self.created[int(pod_id.split("-")[1]) - 1]["env"]
+    for index in range(int(env["FROM_FILE"]), int(env["TO_FILE"]) + 1):
+      with open(f"{self.post_dir}/postdata_{index}.bin", "wb") as f:
+        f.write(b"x" * 16)
+    return { "desiredStatus": "RUNNING" }
+
+  def terminate_pod(self, pod_id):
+    self.terminated.append(pod_id)
+    if pod_id == self.lost_pod:
+      raise ConnectionError("api down")
+
+def test_lost_pod_is_replaced(tmp_path, monkeypatch):
+  post_dir = tmp_path / "post"
+  post_dir.mkdir()
+  fake = FakeRunPod(str(post_dir), "pod-1")
+  monkeypatch.setattr(post_runpod, "runpod", fake)
+  monkeypatch.setattr(post_runpod.time, "sleep", lambda seconds: None)
+  # stand-in pulls that run until they are stopped
+  transfers = []
+
+  def start_transfer(shard, *args):
+    stop = threading.Event()
+    transfer = { "pod_id": shard["pod_id"], "error": None, "stop": stop, "transport": types.SimpleNamespace(close=lambda: None), "thread": threading.Thread(target=stop.wait) }
+    transfer["thread"].start()
+    transfers.append(transfer)
+    return transfer
+
+  monkeypatch.setattr(post_runpod, "start_transfer", start_transfer)
+  messages = []
+  shards = post_runpod.run_runpod_shards("https://example.com/generate-post.sh", config, gpu, 2, str(post_dir), str(tmp_path / "stage2.json"), poll_interval=0, log=messages.append)
+
+  assert [shard["status"] for shard in shards] == ["complete", "complete"]
+  assert len(fake.created) == 3 and fake.created[2]["env"] == fake.created[0]["env"]
+  # every pod is released, a failing terminate is only logged
+  assert sorted(fake.terminated) == ["pod-1", "pod-2", "pod-3"]
+  assert any("could not terminate pod pod-1" in message for message in messages)
+  # the lost pod's pull was stopped before the shard moved on
+  lost = [transfer for transfer in transfers if transfer["pod_id"] == "pod-1"]
+  assert lost and lost[0]["stop"].is_set() and not lost[0]["thread"].is_alive()
+  for transfer in transfers:
+    transfer["stop"].set()
+
+def test_shard_pods_get_their_own_size_and_range():
+  files = post_runpod.post_files(config)
+  shard = post_runpod.split_shards(len(files), 2)[1]
+  disk_size = post_runpod.shard_disk_size(files, shard)
+  assert disk_size == 11
+  assert post_runpod.shard_docker_args("https://example.com/g.sh", config, disk_size).endswith(f"bash -s 11 {config['node_id']}'")
+  env = post_runpod.shard_env(config, shard)
+  assert (env["FROM_FILE"], env["TO_FILE"]) == ("4", "7")
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from post_shards import run_local_shards
+
+# 8 files of 16 bytes
+config = { "node_id": "ab" * 32, "commitment_atx_id": "cd" * 32, "num_units": 2, "labels_per_unit": 4, "max_file_size": 16 }
+
+# stand-in for postcli: writes its file range, or records its pid and hangs when asked to
+stub_generator = """#!/bin/sh
+post_dir=$1 from_file=$2 to_file=$3 hang=$4
+if [ -n "$hang" ]; then
+  echo $$ >> "$hang"
+  exec sleep 60
+fi
+i=$from_file
+while [ $i -le $to_file ]; do
+  head -c 16 /dev/zero > "$post_dir/postdata_$i.bin"
+  i=$((i + 1))
+done
+"""
+
+def generator(tmp_path, hang=""):
+  script = tmp_path / "generator.sh"
+  script.write_text(stub_generator)
+  script.chmod(0o755)
+  return f"{script} {{post_dir}} {{from_file}} {{to_file}} {hang}"
+
+def test_generates_every_shard(tmp_path):
+  post_dir = tmp_path / "post"
+  shards = run_local_shards(config, str(post_dir), ["0", "1"], generator(tmp_path), 3, poll_interval=0.01, log=lambda message: None)
+  assert [shard["status"] for shard in shards] == ["complete"] * 3
+  assert sorted(os.listdir(post_dir)) == [f"postdata_{index}.bin" for index in range(8)]
+
+def test_missing_generator_fails_the_shards(tmp_path):
+  messages = []
+  shards = run_local_shards(config, str(tmp_path / "post"), ["0"], str(tmp_path / "missing-generator") + " {from_file}", 2, retries=1, poll_interval=0.01, log=messages.append)
+  assert [(shard["status"], shard["attempts"]) for shard in shards] == [("failed", 2), ("failed", 2)]
+  assert any("could not start the generator" in message for message in messages)
+
+def test_interrupted_run_stops_its_generators(tmp_path):
+  pids_path = tmp_path / "pids"
+
+  def log(message):
+    # interrupt at a progress report once both generators are up
+    if message.startswith("S2.3 Progress") and pids_path.exists() and len(pids_path.read_text().split()) == 2:
+      raise KeyboardInterrupt
+
+  with pytest.raises(KeyboardInterrupt):
+    run_local_shards(config, str(tmp_path / "post"), ["0", "1"], generator(tmp_path, pids_path), 2, poll_interval=0.01, progress_interval=0.01, log=log)
+  for pid in pids_path.read_text().split():
+    with pytest.raises(ProcessLookupError):
+      os.kill(int(pid), 0)
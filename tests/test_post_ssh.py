@@ -0,0 +1,81 @@
+import os
+import sys
+
+from post_shards import post_files
+from post_ssh import LocalExecTransport, run_ssh_shards
+
+# 8 files of 16 bytes
+config = { "node_id": "ab" * 32, "commitment_atx_id": "cd" * 32, "num_units": 2, "labels_per_unit": 4, "max_file_size": 16 }
+
+fake_generator = """
+import os, sys
+post_dir, from_file, to_file, size, fail_marker = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), sys.argv[5]
+# the first run of the shard holding file 0 dies half way, later runs succeed
+if from_file == 0 and not os.path.exists(fail_marker):
+  open(fail_marker, "w").close()
+  with open(f"{post_dir}/postdata_0.bin", "wb") as f:
+    f.write(b"x" * (size // 2))
+  sys.exit(3)
+for index in range(from_file, to_file + 1):
+  with open(f"{post_dir}/postdata_{index}.bin", "wb") as f:
+    f.write(b"x" * size)
+print(f"wrote {from_file}-{to_file}")
+"""
+
+def generator(tmp_path, fail=False):
+  script = tmp_path / "generator.py"
+  script.write_text(fake_generator)
+  marker = tmp_path / ("failed-once" if fail else "never-fail")
+  if not fail:
+    marker.touch()
+  return f"{sys.executable} {script} {{post_dir}} {{from_file}} {{to_file}} {{max_file_size}} {marker}"
+
+def local_host(work_dir, capacity=1):
+  transport = LocalExecTransport(str(work_dir), f"local:{work_dir}")
+  return { "name": transport.name, "transport": transport, "capacity": capacity, "providers": ["0"] * capacity }
+
+def assert_complete(post_dir):
+  for name, size in post_files(config):
+    assert os.path.getsize(f"{post_dir}/{name}") == size
+
+def test_shards_are_spread_over_hosts_and_fetched(tmp_path):
+  post_dir = tmp_path / "post"
+  hosts = [local_host(tmp_path / "host-a"), local_host(tmp_path / "host-b", capacity=2)]
+  lines = []
+  shards = run_ssh_shards(config, str(post_dir), hosts, generator(tmp_path), num_shards=4, poll_interval=0.01, log=lines.append)
+  assert [shard["status"] for shard in shards] == ["complete"] * 4
+  assert_complete(post_dir)
+  # fetched files are removed from the hosts
+  assert not any(name.endswith(".bin") for host in ["host-a", "host-b"] for name in os.listdir(tmp_path / host))
+  assert any("wrote" in line for line in lines)
+
+def test_failed_shard_is_requeued_and_resumed(tmp_path):
+  post_dir = tmp_path / "post"
+  hosts = [local_host(tmp_path / "host-a"), local_host(tmp_path / "host-b")]
+  lines = []
+  shards = run_ssh_shards(config, str(post_dir), hosts, generator(tmp_path, fail=True), num_shards=4, max_host_failures=3, poll_interval=0.01, log=lines.append)
+  assert [shard["status"] for shard in shards] == ["complete"] * 4
+  assert shards[0]["attempts"] == 2
+  assert all(shard["attempts"] == 1 for shard in shards[1:])
+  assert any("Shard 0 exited with code 3" in line and "requeued" in line for line in lines)
+  assert_complete(post_dir)
+
+def test_shard_gives_up_after_retries(tmp_path):
+  post_dir = tmp_path / "post"
+  script = tmp_path / "fail.py"
+  script.write_text("import sys\nsys.exit(1)\n")
+  hosts = [local_host(tmp_path / "host-a")]
+  shards = run_ssh_shards(config, str(post_dir), hosts, f"{sys.executable} {script}", num_shards=1, retries=1, max_host_failures=5, poll_interval=0.01, log=lambda line: None)
+  assert shards[0]["status"] == "failed"
+  assert shards[0]["attempts"] == 2
+
+def test_complete_shards_are_not_generated_again(tmp_path):
+  post_dir = tmp_path / "post"
+  post_dir.mkdir()
+  for name, size in post_files(config)[:4]:
+    (post_dir / name).write_bytes(b"x" * size)
+  hosts = [local_host(tmp_path / "host-a")]
+  lines = []
+  shards = run_ssh_shards(config, str(post_dir), hosts, generator(tmp_path), num_shards=2, poll_interval=0.01, log=lines.append)
+  assert [shard["attempts"] for shard in shards] == [0, 1]
+  assert_complete(post_dir)
@@ -0,0 +1,76 @@
+import json
+import os
+
+from post_transfer import LocalTransport, pull, size_manifest
+
+# 3 files of 32 bytes
+metadata = { "NumUnits": 1, "LabelsPerUnit": 6, "MaxFileSize": 32 }
+files = [("postdata_0.bin", 32), ("postdata_1.bin", 32), ("postdata_2.bin", 32)]
+
+def write(path, data):
+  with open(path, "wb") as f:
+    f.write(data)
+
+class GeneratingTransport(LocalTransport):
+  # a producer that takes one more generator step every time its files are listed
+  def __init__(self, source_dir, steps):
+    super().__init__(source_dir)
+    self.steps = list(steps)
+
+  def stats(self):
+    if self.steps:
+      name, data = self.steps.pop(0)
+      write(f"{self.source_dir}/{name}", data)
+    return super().stats()
+
+def test_size_manifest_waits_for_the_generator():
+  # a full-size file is only final once the next one exists
+  assert size_manifest({ "postdata_0.bin": (32, 1) }, files) == {}
+  assert list(size_manifest({ "postdata_0.bin": (32, 1), "postdata_1.bin": (5, 2) }, files)) == ["postdata_0.bin"]
+  # the last file once everything else is full size and it stopped changing
+  stats = { "postdata_0.bin": (32, 1), "postdata_1.bin": (32, 2), "postdata_2.bin": (32, 3) }
+  assert "postdata_2.bin" not in size_manifest(stats, files)
+  assert "postdata_2.bin" not in size_manifest(stats, files, { **stats, "postdata_2.bin": (32, 2) })
+  assert size_manifest(stats, files, stats)["postdata_2.bin"] == { "size": 32, "sha256": None, "mtime": 3 }
+
+def test_pull_while_generating(tmp_path):
+  source = tmp_path / "source"
+  source.mkdir()
+  (source / "postdata_metadata.json").write_text(json.dumps(metadata))
+  dest = tmp_path / "dest"
+  steps = [
+    ("postdata_0.bin", b"a" * 10),
+    ("postdata_0.bin", b"a" * 32),
+    ("postdata_1.bin", b"b" * 20),
+    ("postdata_1.bin", b"b" * 32),
+    ("postdata_2.bin", b"c" * 32),
+  ]
+  messages = []
+  state = pull(GeneratingTransport(str(source), steps), str(dest), streams=2, poll_interval=0, timeout=5, log=messages.append)
+  assert sorted(state) == [name for name, _ in files]
+  for name, _ in files:
+    assert (dest / name).read_bytes() == (source / name).read_bytes()
+  assert not any("changed" in message for message in messages)
+
+def test_pull_refetches_a_file_that_changed(tmp_path):
+  source = tmp_path / "source"
+  source.mkdir()
+  (source / "postdata_metadata.json").write_text(json.dumps(metadata))
+  for name, size in files:
+    write(f"{source}/{name}", b"x" * size)
+
+  class RewritingTransport(LocalTransport):
+    # postdata_0.bin is rewritten while its first fetch is running
+    rewritten = False
+
+    def fetch(self, name, offset, dest):
+      super().fetch(name, offset, dest)
+      if name == "postdata_0.bin" and not self.rewritten:
+        self.rewritten = True
+        write(f"{self.source_dir}/{name}", b"y" * 32)
+        os.utime(f"{self.source_dir}/{name}", (0, 1))
+
+  messages = []
+  pull(RewritingTransport(str(source)), str(tmp_path / "dest"), streams=1, poll_interval=0, timeout=5, log=messages.append)
+  assert (tmp_path / "dest" / "postdata_0.bin").read_bytes() == b"y" * 32
+  assert any("postdata_0.bin changed" in message for message in messages)
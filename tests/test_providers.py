@@ -0,0 +1,50 @@
+import sys
+import types
+
+# the runpod SDK is only needed by RunPodProvider, which is not used here
+sys.modules.setdefault("runpod", types.ModuleType("runpod"))
+
+import providers
+
+class FakeProvider:
+  def __init__(self, name, ready_after, cancel_error=None):
+    self.name = name
+    self.ready_after = ready_after
+    self.cancel_error = cancel_error
+    self.polls = 0
+    self.cancelled = []
+
+  def options(self, quantity, total_bytes, max_cost_per_tib=None):
+    return [{ "provider": self.name, "id": f"{self.name}-gpu", "quantity": quantity, "market": "on-demand", "price": 1.0, "cost_per_tib": 1.0 }]
+
+  def provision(self, option):
+    return { "id": f"{self.name}-pod" }
+
+  def ready(self, handle):
+    self.polls += 1
+    return self.polls > self.ready_after
+
+  def cancel(self, handle):
+    self.cancelled.append(handle["id"])
+    if self.cancel_error:
+      raise self.cancel_error
+
+def test_losers_are_cancelled():
+  # the winner needs a few polls, so the other provider has capacity to cancel by then
+  fast = FakeProvider("fast", 5)
+  slow = FakeProvider("slow", 1000)
+  unreleased = []
+  provider, option, handle = providers.race_for_capacity([fast, slow], 1, 1 << 30, poll_interval=0.01, unreleased=unreleased, log=lambda message: None)
+  assert provider is fast and handle == { "id": "fast-pod" }
+  assert slow.cancelled == ["slow-pod"] and fast.cancelled == []
+  assert unreleased == []
+
+def test_failed_cancel_is_reported():
+  fast = FakeProvider("fast", 5)
+  stuck = FakeProvider("stuck", 1000, ConnectionError("api down"))
+  unreleased = []
+  messages = []
+  provider, _, _ = providers.race_for_capacity([fast, stuck], 1, 1 << 30, poll_interval=0.01, unreleased=unreleased, log=messages.append)
+  assert provider is fast
+  assert unreleased == [{ "provider": "stuck", "option": "stuck-gpu", "id": "stuck-pod", "error": "api down" }]
+  assert any("Could not cancel stuck" in message for message in messages)
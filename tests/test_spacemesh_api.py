@@ -0,0 +1,47 @@
+import pytest
+
+from spacemesh_api import Activation, NodeStatus, SpacemeshClient, close_all_channels, decode_message, encode_highest_response, encode_message, encode_status_response, serve_fake_node
+
+atx = Activation("11" * 32, 12345, "22" * 32, "sm1qqqqqqq", 16, 3)
+
+@pytest.fixture
+def node():
+  responses = {}
+  server, endpoint = serve_fake_node({
+    "NodeService/Status": lambda request, context: responses["status"],
+    "ActivationService/Highest": lambda request, context: responses["highest"],
+  })
+  yield SpacemeshClient(endpoint), responses
+  close_all_channels()
+  server.stop(None)
+
+def test_status_round_trip(node):
+  client, responses = node
+  status = NodeStatus(connected_peers=42, is_synced=True, synced_layer=100, top_layer=101, verified_layer=99)
+  responses["status"] = encode_status_response(status)
+  assert client.status() == status
+
+def test_status_zero_and_missing_layers(node):
+  client, responses = node
+  # proto3 leaves zero values out: layer 0 is an empty LayerNumber, a layer the node does not report is no field at all
+  responses["status"] = encode_message([(1, encode_message([(3, b""), (4, encode_message([(1, 7)]))]))])
+  assert client.status() == NodeStatus(connected_peers=0, is_synced=False, synced_layer=0, top_layer=7, verified_layer=None)
+  responses["status"] = b""
+  assert client.status() == NodeStatus(0, False, None, None, None)
+
+def test_highest_atx_round_trip(node):
+  client, responses = node
+  responses["highest"] = encode_highest_response(atx)
+  assert client.highest_atx() == atx
+
+def test_highest_atx_missing_fields(node):
+  client, responses = node
+  # only the ID is set: the layer is unknown, everything else takes its proto3 default
+  responses["highest"] = encode_message([(1, encode_message([(1, encode_message([(1, bytes.fromhex(atx.id))]))]))])
+  assert client.highest_atx() == Activation(atx.id, None, "", "", 0, 0)
+  responses["highest"] = encode_message([(1, encode_message([(2, b"")]))])
+  assert client.highest_atx().layer == 0
+
+def test_varint_round_trip():
+  for value in [0, 1, 127, 128, 300, 2 ** 32, 2 ** 63 - 1]:
+    assert decode_message(encode_message([(1, value)])) == { 1: value }
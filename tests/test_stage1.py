@@ -0,0 +1,51 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+import tarfile
+
+from spacemesh_api import Activation, NodeStatus, encode_highest_response, encode_status_response, serve_fake_node
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+atx = Activation("11" * 32, 40000, "22" * 32, "sm1qqqqqqq", 4, 1)
+coinbase = "sm1qqqqqqtest"
+
+def test_fast_path(tmp_path):
+  server, endpoint = serve_fake_node({
+    "NodeService/Status": lambda request, context: encode_status_response(NodeStatus(30, True, 40100, 40100, 40099)),
+    "ActivationService/Highest": lambda request, context: encode_highest_response(atx),
+  })
+  data_dir = tmp_path / "data"
+  stage1_path = data_dir / "stage1"
+  stage1_path.mkdir(parents=True)
+  # a local template keeps the run offline
+  (stage1_path / "config.mainnet.json").write_text(json.dumps({ "api": {}, "main": { "layers-per-epoch": 4032 } }))
+  try:
+    result = subprocess.run([sys.executable, "stage1.py", "--data-dir", str(data_dir), "--node", endpoint, "--num-units", "2", "--coinbase", coinbase, "--timeout", "5"],
+      cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+  finally:
+    server.stop(None)
+  assert result.returncode == 0, result.stdout.decode()
+
+  config = json.loads((stage1_path / "stage1.json").read_text())
+  assert config["commitment_atx_id"] == atx.id
+  assert config["num_units"] == 2 and config["node_id_first_8"] == config["node_id"][:8]
+  # key.bin holds seed + public key, hex encoded
+  key = (stage1_path / "key.bin").read_text()
+  assert len(key) == 128 and key[64:] == config["node_id"]
+
+  metadata = json.loads((stage1_path / "postdata_metadata.json").read_text())
+  assert base64.b64decode(metadata["NodeId"]).hex() == config["node_id"]
+  assert base64.b64decode(metadata["CommitmentAtxId"]).hex() == atx.id
+  assert metadata["NumUnits"] == 2
+
+  node_config = json.loads((stage1_path / "config.json").read_text())
+  assert node_config["main"] == { "layers-per-epoch": 4032 }
+  assert node_config["api"]["grpc-public-listener"] == "0.0.0.0:19092"
+  assert node_config["smeshing"]["smeshing-coinbase"] == coinbase
+  assert node_config["smeshing"]["smeshing-opts"]["smeshing-opts-datadir"] == str(stage1_path)
+  assert node_config["smeshing"]["smeshing-opts"]["smeshing-opts-numunits"] == 2
+
+  with tarfile.open(data_dir / f"{config['node_id_first_8']}.stage1.tar.gz") as tar:
+    assert sorted(tar.getnames()) == ["key.bin", "postdata_metadata.json", "stage1.json"]
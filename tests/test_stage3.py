@@ -0,0 +1,37 @@
+import stage3
+
+def synthetic(tmp_path, max_file_size=256):
+  # 64 labels in files of max_file_size bytes
+  post_dir = str(tmp_path / "post")
+  stage3.generate_synthetic_post(post_dir, 1, 64, max_file_size)
+  return post_dir
+
+def verify(post_dir):
+  return stage3.verify_post(post_dir, sample_rate=1.0, workers=1, log=lambda message: None)
+
+def test_good_post(tmp_path):
+  result = verify(synthetic(tmp_path))
+  assert result["ok"] and result["problems"] == []
+  assert sum(file_result["samples"] for file_result in result["files"].values()) == 64
+
+def test_zero_filled_file(tmp_path):
+  post_dir = synthetic(tmp_path)
+  with open(f"{post_dir}/postdata_1.bin", "wb") as f:
+    f.write(bytes(256))
+  result = verify(post_dir)
+  assert not result["ok"]
+  assert result["problems"] == ["postdata_1.bin has 16 unwritten labels in 16 samples"]
+
+def test_truncated_file(tmp_path):
+  post_dir = synthetic(tmp_path)
+  with open(f"{post_dir}/postdata_2.bin", "wb") as f:
+    f.write(b"x" * 8)
+  result = verify(post_dir)
+  assert not result["ok"]
+  assert result["problems"] == ["postdata_2.bin is truncated (8 bytes, shorter than one 16 byte label)"]
+
+def test_files_shorter_than_a_label_are_not_sampled(tmp_path):
+  # metadata whose MaxFileSize is below one label describes files that cannot hold a label
+  result = verify(synthetic(tmp_path, max_file_size=8))
+  assert not result["ok"] and result["files"] == {}
+  assert "postdata_0.bin is truncated (8 bytes, shorter than one 16 byte label)" in result["problems"]
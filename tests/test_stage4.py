@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+import time
+import types
+
+import stage4
+from spacemesh_api import NodeStatus, close_all_channels, encode_status_response, serve_fake_node
+
+# stand-in for go-spacemesh: "crash" exits at once, "run" writes `lines` log lines and keeps running
+stub_node = """
+import sys, time
+mode, lines = sys.argv[1], int(sys.argv[2])
+for index in range(lines):
+  print(f"log line {index:04d}", flush=True)
+if mode == "crash":
+  sys.exit(3)
+time.sleep(60)
+"""
+
+def supervise(tmp_path, monkeypatch, mode, lines=1, until=None, **kwargs):
+  # run a NodeSupervisor on the stub until `until(supervisor)` holds; 1s supervisor polls are shortened
+  script = tmp_path / "node.py"
+  script.write_text(stub_node)
+  monkeypatch.setattr(stage4, "time", types.SimpleNamespace(sleep=lambda seconds: time.sleep(min(seconds, 0.02)), time=time.time, monotonic=time.monotonic))
+  messages = []
+  supervisor = stage4.NodeSupervisor([sys.executable, str(script), mode, str(lines)], kwargs.pop("endpoint", "127.0.0.1:1"), str(tmp_path / "go-spacemesh.log"), log=messages.append, **kwargs)
+  thread = threading.Thread(target=supervisor.run)
+  thread.start()
+  deadline = time.monotonic() + 20
+  try:
+    while not until(supervisor) and time.monotonic() < deadline:
+      time.sleep(0.02)
+  finally:
+    supervisor.stop()
+    thread.join(20)
+    close_all_channels()
+  assert until(supervisor)
+  return supervisor, messages
+
+def test_restarts_a_crashing_node_with_backoff(tmp_path, monkeypatch):
+  filelock = tmp_path / "sm.lock"
+  filelock.mkdir()
+  supervisor, messages = supervise(tmp_path, monkeypatch, "crash", until=lambda supervisor: supervisor.restarts >= 3, filelock=str(filelock), min_backoff=1, max_backoff=4, pid_path=str(tmp_path / "node.pid"))
+  assert supervisor.crashes >= 3
+  delays = [message.split("restarting in ")[1] for message in messages if "restarting in" in message]
+  assert delays[:3] == ["1s", "2s", "4s"]
+  # the filelock a crashed node leaves behind is removed before every start
+  assert not filelock.exists()
+  assert int((tmp_path / "node.pid").read_text()) > 0
+
+def test_restarts_a_stalled_node(tmp_path, monkeypatch):
+  def status_stream(request, context):
+    # the synced layer never moves
+    yield encode_status_response(NodeStatus(10, True, 5, 5, 5))
+    while context.is_active():
+      time.sleep(0.05)
+
+  server, endpoint = serve_fake_node({}, stream_handlers={ "NodeService/StatusStream": status_stream })
+  try:
+    supervisor, messages = supervise(tmp_path, monkeypatch, "run", endpoint=endpoint, stall_timeout=0.5, min_backoff=0, until=lambda supervisor: supervisor.stalls >= 1)
+  finally:
+    server.stop(None)
+  assert supervisor.crashes == 0
+  assert supervisor.last_status.synced_layer == 5
+  assert any("synced layer stalled" in message for message in messages)
+
+def test_rotates_the_node_log(tmp_path, monkeypatch):
+  log_path = tmp_path / "go-spacemesh.log"
+  # 200 lines of 15 bytes over 500 byte files: the current log and two backups are kept
+  supervise(tmp_path, monkeypatch, "run", lines=200, max_log_bytes=500, log_backups=2, until=lambda supervisor: b"log line 0199" in log_path.read_bytes())
+  assert os.path.exists(f"{log_path}.1") and os.path.exists(f"{log_path}.2") and not os.path.exists(f"{log_path}.3")
+  kept = b""
+  for path in [f"{log_path}.2", f"{log_path}.1", log_path]:
+    assert os.path.getsize(path) <= 500
+    kept += open(path, "rb").read()
+  # the newest lines survive in order, nothing is lost or repeated across the files
+  numbers = [int(line.split()[-1]) for line in kept.decode().splitlines()]
+  assert numbers == list(range(numbers[0], 200))
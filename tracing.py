@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# Step timing for the auto-spacemesh stages.
+#
+# Every numbered step (S1.1, S2.3, ...) runs inside a span that records its
+# start time, duration and outcome. Spans are appended as JSON lines to
+# <data-dir>/traces/<stage>.jsonl while the stage runs (rotated to .jsonl.1
+# once it grows past max_trace_bytes); when it finishes an OpenMetrics summary
+# is written to <data-dir>/traces/<stage>.prom and, with --profile, the
+# slowest steps are printed. In memory the tracer keeps per-step totals and
+# only the latest spans, so long running watchers stay bounded.
+#
+# Shell stages record spans through the command line:
+#
+#   tracing.py record --data-dir DIR --stage stage1 --step S1.1 --name "Template download" --start EPOCH [--outcome error]
+#   tracing.py finish --data-dir DIR --stage stage1 [--since EPOCH] [--profile]
+#
+# Author:
+#
+#   Zanoryt <zanoryt@protonmail.com>
+#
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class Tracer:
+  def __init__(self, stage, data_dir=None, profile=False, log=print, max_spans=1000, max_trace_bytes=16 << 20):
+    self.stage = stage
+    self.profile = profile
+    self.log = log
+    self.spans = deque(maxlen=max_spans)
+    self.steps = {}
+    self.max_trace_bytes = max_trace_bytes
+    self.lock = threading.Lock()
+    self.trace_path = None
+    self.metrics_path = None
+    if data_dir:
+      os.makedirs(f"{data_dir}/traces", exist_ok=True)
+      self.trace_path = f"{data_dir}/traces/{stage}.jsonl"
+      self.metrics_path = f"{data_dir}/traces/{stage}.prom"
+
+  def record(self, step, name, start, duration, outcome="ok", error=None):
+    span = { "stage": self.stage, "step": step, "name": name, "start": start, "duration": duration, "outcome": outcome }
+    if error:
+      span["error"] = error
+    with self.lock:
+      self.spans.append(span)
+      add_span(self.steps, span)
+      if self.trace_path:
+        if os.path.isfile(self.trace_path) and os.path.getsize(self.trace_path) > self.max_trace_bytes:
+          os.replace(self.trace_path, f"{self.trace_path}.1")
+        with open(self.trace_path, "a") as f:
+          f.write(json.dumps(span) + "\n")
+    return span
+
+  def load(self, spans):
+    # replace what was recorded with spans read back from a trace file
+    with self.lock:
+      self.spans.clear()
+      self.steps = {}
+      for span in spans:
+        self.spans.append(span)
+        add_span(self.steps, span)
+
+  @contextmanager
+  def span(self, step, name):
+    # outcome is "error" when the step raises or exits with a non-zero code
+    start = time.time()
+    started = time.monotonic()
+    try:
+      yield
+    except SystemExit as e:
+      self.record(step, name, start, time.monotonic() - started, "ok" if e.code in (None, 0) else "error", f"exit code {e.code}")
+      raise
+    except BaseException as e:
+      self.record(step, name, start, time.monotonic() - started, "error", f"{type(e).__name__}: {e}")
+      raise
+    self.record(step, name, start, time.monotonic() - started)
+
+  def finish(self):
+    with self.lock:
+      steps = list(self.steps.values())
+    if self.metrics_path:
+      with open(self.metrics_path, "w") as f:
+        f.write(openmetrics_summary(steps))
+    if self.profile:
+      print_profile(steps, log=self.log)
+
+def add_span(steps, span):
+  # fold one span into the per (stage, step) count, total and max duration and errors
+  key = (span["stage"], span["step"])
+  step = steps.setdefault(key, { "stage": span["stage"], "step": span["step"], "name": span["name"], "count": 0, "total": 0.0, "max": 0.0, "errors": 0 })
+  step["count"] += 1
+  step["total"] += span["duration"]
+  step["max"] = max(step["max"], span["duration"])
+  if span["outcome"] != "ok":
+    step["errors"] += 1
+
+def openmetrics_summary(steps):
+  lines = [
+    "# HELP autospacemesh_step_duration_seconds Time spent in each stage step",
+    "# TYPE autospacemesh_step_duration_seconds summary",
+  ]
+  for step in steps:
+    labels = f'stage="{step["stage"]}",step="{step["step"]}"'
+    lines.append(f"autospacemesh_step_duration_seconds_count{{{labels}}} {step['count']}")
+    lines.append(f"autospacemesh_step_duration_seconds_sum{{{labels}}} {step['total']:.6f}")
+  lines.append("# HELP autospacemesh_step_errors Step runs that did not succeed")
+  lines.append("# TYPE autospacemesh_step_errors counter")
+  for step in steps:
+    lines.append(f'autospacemesh_step_errors_total{{stage="{step["stage"]}",step="{step["step"]}"}} {step["errors"]}')
+  lines.append("# EOF")
+  return "\n".join(lines) + "\n"
+
+def print_profile(steps, top=10, log=print):
+  count = sum(step["count"] for step in steps)
+  total = sum(step["total"] for step in steps)
+  log("")
+  log(f"Slowest steps ({count} spans, {total:.1f}s in total):")
+  for step in sorted(steps, key=lambda step: step["total"], reverse=True)[:top]:
+    errors = f", {step['errors']} failed" if step["errors"] else ""
+    log(f"  {step['step']:8} {step['total']:9.2f}s {step['count']:4}x  {step['name']}{errors}")
+
+def load_spans(trace_path):
+  # the rotated file first, then the current one
+  spans = []
+  for path in [f"{trace_path}.1", trace_path]:
+    if os.path.isfile(path):
+      with open(path, "r") as f:
+        spans += [json.loads(line) for line in f if line.strip()]
+  return spans
+
+def main():
+  parser = argparse.ArgumentParser(description="Record or summarize stage step timings")
+  parser.add_argument("command", choices=["record", "finish"])
+  parser.add_argument("--data-dir", help="Directory for data files", default="data")
+  parser.add_argument("--stage", help="Stage name", required=True)
+  parser.add_argument("--step", help="Step number (record)")
+  parser.add_argument("--name", help="Step description (record)", default="")
+  parser.add_argument("--start", help="Step start as epoch seconds (record)", type=float)
+  parser.add_argument("--outcome", help="Step outcome (record)", default="ok")
+  parser.add_argument("--since", help="Only summarize spans started at or after this epoch (finish)", default=0, type=float)
+  parser.add_argument("--profile", action="store_true", help="Print the slowest steps (finish)")
+  args = parser.parse_args()
+
+  tracer = Tracer(args.stage, args.data_dir, args.profile)
+  if args.command == "record":
+    tracer.record(args.step, args.name, args.start, time.time() - args.start, args.outcome)
+    return
+  tracer.load(span for span in load_spans(tracer.trace_path) if span["start"] >= args.since)
+  tracer.finish()
+
+if __name__ == "__main__":
+  main()